@@ -63,6 +63,7 @@ def create_app(test_config=None):
         
     from . import views
     app.register_blueprint(views.bp)
+    views.init_app(app)
     #app.add_url_rule('/', endpoint='index')
 
     # a simple page that says hello
@@ -5,9 +5,12 @@ import os
 
 # import 3rd parties libs
 import click
+import pandas as pd
+from flask     import current_app
 from flask.cli import AppGroup
 
 # import application libs
+from . import models
 
 
 translate_cli = AppGroup('translate')
@@ -37,7 +40,33 @@ def compile():
     """Compile all languages."""
     if os.system('pybabel compile -d covid/translations'):
         raise RuntimeError('compile command failed')
-        
+
+
+data_cli = AppGroup('data')
+
+@data_cli.command('snapshot')
+def snapshot():
+    """Convert the data file to a binary snapshot, loaded faster at start."""
+    fname = current_app.config['DATA_DIR']+'/'+current_app.config['DATA_FILE']
+    sname = models.snapshot_df(fname)
+    click.echo('snapshot of {} written in {}'.format(fname, sname))
+
+
+@data_cli.command('diff')
+@click.argument('old')
+@click.argument('new', required=False)
+def diff(old, new):
+    """Report what changed from an OLD data file to NEW (default: the data file)."""
+    if new is None:
+        new = current_app.config['DATA_DIR']+'/'+current_app.config['DATA_FILE']
+    odf = models.load_df(old, pd.read_csv, models.world_shape)
+    ndf = models.load_df(new, pd.read_csv, models.world_shape)
+    click.echo('{} -> {}'.format(old, new))
+    for line in models.diff_report(models.diff_df(odf, ndf)):
+        click.echo(line)
+
+
 def init_app(app):
     app.cli.add_command(translate_cli)
+    app.cli.add_command(data_cli)
 
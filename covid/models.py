@@ -68,9 +68,13 @@
 #     c. calculate cumulative sum of cases and deaths by nation/continent (calculate_cumulative_sum)
 
 # std libs import
-from datetime import datetime, date, timedelta
 from math     import ceil
+import copy
 import json
+import os
+import shutil
+import sys
+import threading
 
 # 3rd parties libs import
 import click
@@ -87,6 +91,83 @@ POP_FIELD = ''         # placeholder to register the population field name
 
 # START GeoEntities as {geoId: {"population": nnnn, ...}, ....}
 #    in this version we rationalize Nations+Continents+AREAS
+class GeoEntity(object):
+    '''a geographic entity: a compact record, read as a dict
+    
+    remarks.
+        - known attributes (see ATTRIBUTES) are slots, others (if any) go in a dict
+        - identities (and names, codes, ...) are interned strings,
+              nations are a tuple of them: entities share these strings
+        - it has the dict methods used on entities: e['name'], e.get('name', None),
+              e['name'] = value, e.pop('name', None), 'name' in e, keys(), items()
+    '''
+    
+    ATTRIBUTES = ('type', 'original_country', 'name', 'population', 'countryterritoryCode', 'continentExp', 'nations',)
+    __slots__  = ATTRIBUTES + ('_others',)
+    _SLOTS     = frozenset(ATTRIBUTES)
+    
+    def __init__(self, value=None):
+        self._others = None
+        for attribute, v in (value or dict()).items():
+            self[attribute] = v
+    
+    def __getitem__(self, attribute):
+        try:
+            if attribute in self._SLOTS:
+                return getattr(self, attribute)
+            return self._others[attribute]
+        except (AttributeError, KeyError, TypeError):
+            raise KeyError(attribute)
+    
+    def __setitem__(self, attribute, value):
+        if isinstance(value, str):
+            value = sys.intern(value)
+        elif attribute == 'nations' and value is not None:
+            value = tuple(sys.intern(id) if isinstance(id, str) else id for id in value)
+        if attribute in self._SLOTS:
+            setattr(self, attribute, value)
+        else:
+            if self._others is None:
+                self._others = dict()
+            self._others[attribute] = value
+    
+    def __contains__(self, attribute):
+        return hasattr(self, attribute) if attribute in self._SLOTS else (self._others is not None and attribute in self._others)
+    
+    def get(self, attribute, default=None):
+        if attribute in self._SLOTS:
+            return getattr(self, attribute, default)
+        return default if self._others is None else self._others.get(attribute, default)
+    
+    def pop(self, attribute, default=None):
+        value = self.get(attribute, default)
+        if attribute in self._SLOTS:
+            if hasattr(self, attribute):
+                delattr(self, attribute)
+        elif self._others is not None:
+            self._others.pop(attribute, None)
+        return value
+    
+    def keys(self):
+        return [attribute for attribute in self.ATTRIBUTES if hasattr(self, attribute)] + list(self._others or ())
+    
+    def items(self):
+        return [(attribute, self[attribute]) for attribute in self.keys()]
+    
+    def to_dict(self):
+        '''the entity as a dict, as in json file'''
+        return {attribute: list(value) if attribute == 'nations' and value is not None else value
+                for attribute, value in self.items()}
+    
+    def __eq__(self, other):
+        if isinstance(other, GeoEntity):
+            other = other.to_dict()
+        return self.to_dict() == other
+    
+    def __repr__(self):
+        return str(self.to_dict())
+
+
 class MC(type):
     def __contains__(self, key):
         return self.__class_contains__(self, key)
@@ -105,7 +186,7 @@ class GeoEntities(object, metaclass=MC):
     '''a class of geographic entities
     
     remarks.
-        - it uses a dict of dict as class as a protected attribute
+        - it uses a dict of GeoEntity (they are read as dicts) as class as a protected attribute
         - actual dict structure:
             geoId: { "type":             "nation" | "continent",
                      "original_country": true |false,
@@ -113,18 +194,25 @@ class GeoEntities(object, metaclass=MC):
                      "population":       anumber,
                      "countryterritoryCode": another_code,
                      "continentExp":     continent,
-                     "nations":          a list of geoId(s)
+                     "nations":          a tuple of geoId(s) (a list in json file)
                    }
+        - secondary indexes (see INDEXED) are built when entities are loaded,
+              and rebuilt at first use after a change; they are made of tuples
+              and replaced as a whole, so requests can share them
     '''
     
+    INDEXED = ('type', 'continentExp', 'original_country',)   # attributes with a secondary index
+    
     _entities = dict()
+    _index    = None          # ({attribute: {value: (id, ...)}}, {nation: (area, ...)}, {id: population}) | None if out of date
     
     @classmethod
     def set_entity(cls, id, value):
-        '''set a single entity'''
-        if type(value) is not type(dict()):
+        '''set a single entity, from a dict (or a GeoEntity)'''
+        if type(value) is not type(dict()) and not isinstance(value, GeoEntity):
             raise ValueError('setting geographic entity requires a <dict> as value, not {}'.format(type(value)))
-        cls._entities[id] = value
+        cls._entities[sys.intern(id)] = GeoEntity(value)
+        cls._index = None
         
     @classmethod
     def get_entity(cls, id):
@@ -135,6 +223,7 @@ class GeoEntities(object, metaclass=MC):
     def del_entity(cls, id):
         '''delete a single entity by id'''
         cls._entities.pop(id, None)
+        cls._index = None
         
     @classmethod
     def set_entity_att(cls, id, attribute, value):
@@ -142,6 +231,8 @@ class GeoEntities(object, metaclass=MC):
         e = cls._entities.get(id, None)
         if e is not None:
             e[attribute] = value
+            if attribute in cls.INDEXED or attribute in ('nations', 'population',):
+                cls._index = None
         else:
             cls.set_entity(id, {attribute: value})
 
@@ -159,16 +250,82 @@ class GeoEntities(object, metaclass=MC):
         e = cls._entities.get(id, None)
         if e is not None:
             e.pop(attribute, None)
+            if attribute in cls.INDEXED or attribute in ('nations', 'population',):
+                cls._index = None
+
+    @classmethod
+    def get_ids_by_att(cls, attribute, value):
+        '''get the identities of entities with attribute of indicated value
+        
+           parameters
+               - attribute     str - key to use
+               - value         obj - value to compare; it must be equal
+           
+           return
+               - ids           tuple of str - in the order of entities; by index if attribute is in INDEXED
+        '''
+        if attribute in cls.INDEXED:
+            return cls._indexes()[0][attribute].get(value, ())
+        return tuple(id for id, e in cls._entities.items() if e.get(attribute, None) is not None and e[attribute]==value)
+
+    @classmethod
+    def get_areas_of(cls, id):
+        '''get the identities of entities (areas, continents, ...) having the nation id among their nations'''
+        return cls._indexes()[1].get(id, ())
+
+    @classmethod
+    def get_population(cls, ids):
+        '''get the population of entities, as a vector aligned to ids
+        
+           parameters
+               - ids           iterable of str - identities of entities
+           
+           return
+               - population    numpy array of float64 - nan where the entity is unknown, or its
+                                   population is missing, not a number or not positive
+        '''
+        population = cls._indexes()[2]
+        return np.array([population.get(id, np.nan) for id in ids], dtype=np.float64)
+
+    @classmethod
+    def _indexes(cls):
+        '''get the secondary indexes, building them if they are out of date'''
+        index = cls._index
+        if index is None:
+            index = cls._build_indexes()
+        return index
+    
+    @classmethod
+    def _build_indexes(cls):
+        '''build the secondary indexes: by value of INDEXED attributes, by nation (of areas), and populations'''
+        by_att = {attribute: dict() for attribute in cls.INDEXED}
+        members = dict()
+        entities = list(cls._entities.items())
+        population = pd.to_numeric(pd.Series([e.get('population', None) for id, e in entities], dtype=object), errors='coerce')
+        population = population.where(population > 0).to_numpy(dtype=np.float64)
+        for id, e in entities:
+            for attribute in cls.INDEXED:
+                value = e.get(attribute, None)
+                if value is not None:
+                    by_att[attribute].setdefault(value, []).append(id)
+            for nation in e.get('nations', None) or ():
+                members.setdefault(nation, []).append(id)
+        index = ({attribute: {value: tuple(ids) for value, ids in d.items()} for attribute, d in by_att.items()},
+                 {nation: tuple(ids) for nation, ids in members.items()},
+                 {id: p for (id, e), p in zip(entities, population) if not np.isnan(p)},)
+        cls._index = index
+        return index
 
     @classmethod
     def load_from_json(cls, fname):
         with open(fname, 'r') as f:
-            cls._entities = json.load(f)
+            cls._entities = {sys.intern(id): GeoEntity(value) for id, value in json.load(f).items()}
+        cls._build_indexes()
         
     @classmethod
     def write_to_json(cls, fname):
         with open(fname, 'w') as f:
-            json.dump(cls._entities, f)
+            json.dump({id: e.to_dict() for id, e in cls._entities.items()}, f)
     
     #classmethod from MC
     def  __class_contains__(cls, key):
@@ -197,6 +354,7 @@ class GeoEntities(object, metaclass=MC):
                     raise ValueError(_('%(theclass)s.%(method)s: identifier %(id)s is unknown in nations and areas', theclass=self.__class__.__name__, method=mname, id=id))
         else:
             self.ids = list(self.__class__._entities.keys())
+        self._all = self.ids if ids is None else None     # all the entities, while self.ids is this list
         if attribute is not None and value is not None:
             self.ids = self._get_entities_by_att(attribute=attribute, value=value)
             
@@ -249,12 +407,12 @@ class GeoEntities(object, metaclass=MC):
                - self.ids      list of str - list of self's identities
         '''
 
-        nids = []                     # new ids
-        for id in self.ids:       
-            e = self.__class__.get_entity(id)
-            vatt = e.get(attribute, None)
-            if vatt is not None and vatt==value:
-                nids.append(id)
+        found = self.__class__.get_ids_by_att(attribute, value)
+        if self._all is not None and self.ids is self._all:    # all the entities: they are just the found ones
+            nids = list(found)
+        else:
+            found = set(found)
+            nids = [id for id in self.ids if id in found]   # new ids
         if nids == []:
             nids = None
             
@@ -295,21 +453,19 @@ class GeoEntities(object, metaclass=MC):
 
 
 def subset_cols(df, cols, direct=True):
+    '''projection of a dataframe on some of its columns
+    
+    params:
+        - df         pandas dataframe - it is not modified
+        - cols       list of str - names of columns
+        - direct     bool - if true keep cols, otherwise keep the other columns
+    
+    return:
+        - df_result  pandas dataframe - with the kept columns, in the order they have in df
+    
+    remark: only the kept columns are copied, not the whole df
     '''
-    '''
-    df_result = df.copy(deep=True)
-    all_cols = list(df.columns)
-    for col in all_cols:
-        if col in cols:
-            if direct:
-                continue
-            else:
-                del df_result[col]
-        else:
-            if direct:
-                del df_result[col]
-            
-    return df_result
+    return df[[col for col in df.columns if (col in cols) == direct]]
 
 
 def add_cols(df, cols):
@@ -320,52 +476,97 @@ def add_cols(df, cols):
         - cols       list of str - accepted values for str: 'cases/day' | '\N{Greek Capital Letter Delta}cases/day'
         
     return:
-        - df_result  pandas dataframe - with the requested columns
+        - df_result  pandas dataframe - with the requested columns; df itself if cols is empty
+    
+    remarks:
+        - df is not modified and its columns are not copied: new columns are
+              concatenated to them
+        - delta of cases is respect to the previous day with data of the same
+              country, whatever the order of rows; nan on its first day
     '''
     fname = 'add_cols'
-    df_result = df.copy(deep=True)
+    new_cols = dict()
     for col in cols:
         if col == 'cases/day':
-            df_result[col] = df_result['cases']
+            new_cols[col] = df['cases'].values
         elif col == '\N{Greek Capital Letter Delta}cases/day':
-            df_result[col] = df_result['cases'] - df_result['cases'].shift(-1)
+            new_cols[col] = delta_by_country(df, 'cases')
         else:
             raise ValueError(_('%(function)s: field %(field)s not known', function=fname, field=col))
+    if not new_cols:
+        return df
     
-    return df_result
+    return pd.concat([df, pd.DataFrame(new_cols, index=df.index)], axis='columns', copy=False)
+
+
+def delta_by_country(df, column):
+    '''difference of column values respect to the previous day with data of the same country
+    
+    return delta     numpy array of float64 - aligned to rows of df, nan on the first day of a country
+    '''
+    countries, _names = pd.factorize(df['countriesAndTerritories'])
+    order = np.lexsort((df['dateRep'].values, countries))       # by country and date, as positions of rows
+    values = df[column].values.astype(np.float64)[order]
+    same = countries[order][1:] == countries[order][:-1]
+    delta = np.empty(len(order))
+    delta[order] = np.concatenate([[np.nan], np.where(same, values[1:] - values[:-1], np.nan)])[:len(order)]
+    return delta
 
 
-def calculate_cumulative_sum(df, fields, normalize=False):
+def entities_population(population, entities):
+    '''population of entities, as a vector aligned to them
+    
+    parameters:
+        - population      pandas series - population field of rows, with countriesAndTerritories
+                              as index (or as index level)
+        - entities        list of str - names of entities, e.g. columns of a pivoted dataframe
+        
+    returns:
+        - population      numpy array of float64 - the first valid value of each entity;
+                              nan if the entity has no rows, or no positive population
+    '''
+    population = population.groupby(level='countriesAndTerritories').first().reindex(entities)
+    return population.where(population > 0).to_numpy(dtype=np.float64)
+
+
+def calculate_cumulative_sum(df, fields, normalize=False, pivot=None):
     '''give a dataframe with cumulative sums
     
     parameters:
         - df              pandas dataframe - with daily data
         - fields          list of str - fields to sum ('cases' &| 'deaths')
+        - normalize       bool - if true cumulative sums are divided by population
+        - pivot           pandas dataframe - df already pivoted by date and entity, if
+                              at hand; it is not modified
         
     returns:
         - df_result       pandas dataframe - with cumulative data
+    
+    remark: the population of entities is a vector aligned to the columns of
+            the pivot, dividing all of them at once; an entity without
+            population has nan values
     '''
     #cols = ['dateRep', 'countriesAndTerritories']
     #cols.extend(fields)
     
     #df_result = df.loc[:, cols]
     
-    df_result = df.copy(deep=True)
-    df_result = pd.pivot_table(df_result, index='dateRep', columns='countriesAndTerritories')
+    if pivot is None:
+        df_result = pd.pivot_table(df, index='dateRep', columns='countriesAndTerritories')     # pivot does not modify df: no need of a copy
+    else:
+        df_result = pivot.copy()                                                               # the pivot is shared: we cumulate a copy (dates x entities, not rows)
 
     for field in fields:
         df_result[field] = df_result[field].cumsum()
     if normalize:
+        population = df[POP_FIELD] if 'countriesAndTerritories' in df.index.names else df.set_index('countriesAndTerritories')[POP_FIELD]
         for field in fields:
-            df_result[field] = df_result[field]/df_result[POP_FIELD]
+            df_result[field] = df_result[field] / entities_population(population, df_result[field].columns)
         del df_result[POP_FIELD]
         
     return df_result
 
 
-#< WARNING this function could "drop" one or more nation(s) if it cannot handle a good
-#      pair of days as "take off" point. maybe in future it is necessary to study
-#      this case
 def calculate_cumulative_sum_with_overlap(df, column= 'cases', threshold=200, normalize=False):
     '''pivot a dataframe iterating over columns and dates traslating values to start at the same date
     
@@ -415,103 +616,88 @@ def calculate_cumulative_sum_with_overlap(df, column= 'cases', threshold=200, no
             03   ...      ...          ...
       where values in country-i are the cases in that country
       
-      Warning: this function is pretty slow because iterate over rows
-      
-      Again: to align, seach a couple of adjacent days that exceed the indicated threshold
+      Again: to align, seach a couple of adjacent days that exceed the indicated threshold.
+      Countries without such a couple are not in sdf: align_by_threshold lists them
     '''
-    fname = 'calculate_cumulative_sum_with_overlap'
+    sdf, missing = align_by_threshold(cumulate_by_country(df, column, normalize=normalize), threshold)
+    return sdf
 
-    ndf = df.copy(deep=True)
-    # here df MUST have hierarchical index, two levels. and here we are getting dates and countries from that indices
-    #     Note. the next from https://stackoverflow.com/questions/29753060/how-to-convert-numpy-datetime64-into-datetime
-    dates = df.index.get_level_values('dateRep').drop_duplicates().values.astype('M8[D]').astype('O').tolist()
-    countries = df.index.get_level_values('countriesAndTerritories').drop_duplicates().values.tolist()
-    
-    # passing from daily to cumulative
-    #    thanks to https://stackoverflow.com/questions/53927460/select-rows-in-pandas-multiindex-dataframe
-    idx = pd.IndexSlice
-    for country in countries:
-        ndf.loc[idx[:, country], column] = ndf.loc[idx[:, country], column].cumsum()
 
-    # building an empty df ...
-    sdf = pd.DataFrame(columns=[[],[]])                          # empty df, hierarchical columns (two levels)
-    population = None
+def cumulate_by_country(df, column='cases', normalize=False):
+    '''pivot daily data to cumulative data, a column by country
+    
+    params
+        - df                     pandas dataframe MultiIndex: dateRep+countriesAndTerritories
+        - column                 str - column with values to sum up: cases|deaths
+        - normalize              bool - if True calculate ratio to population 
+    
+    return
+        - cdf          pandas dataframe - dates as index, (column, country) as columns;
+                           nan where a country has no data in a day
+    '''
+    countries = df.index.get_level_values('countriesAndTerritories').drop_duplicates()
+    cdf = df[column].unstack('countriesAndTerritories').reindex(columns=countries).cumsum()
+    if normalize:
+        cdf = cdf / entities_population(df[POP_FIELD], cdf.columns)     # population on the 1st day of country
+    cdf.columns = pd.MultiIndex.from_product([[column], cdf.columns.to_list()])
+    return cdf
 
-    #    ... iterating over countries ...
-    for country in countries:
-        # if normalize is true, set country's population (now on population is not none)
-        if normalize:
-            min_date = ndf.loc[idx[:, country], :].index.get_level_values('dateRep').min() # min date for this country
-            population = ndf.loc[(min_date, country,), POP_FIELD].astype(int)
-        acountry = ndf.xs(country, level='countriesAndTerritories')
-        cases_list = []
-        zero_flag = True                   # while true: skip to next day
-        #        ... iterating over dates in a country
-        for adate in dates:
-            #            catch two adjacent days data
-            try:
-                cases = acountry.loc[adate, column]
-            except:
-                cases = None
-            #            if we are skipping and cases is None, needless to continue, shunt the cicle
-            if zero_flag and cases is None:
-                continue
-            #            cases is not None, get the 2nd day
-            if zero_flag:
-                try:
-                    next_cases = acountry.loc[adate+timedelta(days=1), column]
-                except:
-                    next_cases = None
-                
-            #             if skip is true and two value are not None (cases isn't for sure) ...
-            if (zero_flag and not next_cases is None):
-                #         ... we check if the two values are both over threshold
-                if (cases >= threshold and next_cases>= threshold):
-                    zero_flag=False
-                else:
-                    continue
-            #             if first condition is false, we check if skip is true; in such a case shunt to the for cycle
-            elif zero_flag:
-                continue
-            #             if first condition is false, and skip is false, then we can work in the body of the for cycle
-            else:
-                pass
-            #             preparing a list of cases
-            cases = cases if cases is not None else 0
-            # + ldfa,2020-09-20 in case of normalize==True we divide cases by population
-            cases = cases / population if population is not None else cases
-            cases_list.append(cases)
-             #            if not last date, cicle, else add column to dataframe
-            if adate+timedelta(days=1) in dates:
-                continue
-            else:
-                # if new column is higher of dataframe, we need to stretch it, otherwise new column will be cutted
-                if sdf.shape[1] > 0 and (sdf.shape[0] < len(cases_list)):
-                    sdf = stretch(sdf, len(cases_list))
-                sdf[column, country] = pd.Series(cases_list).astype(int)
-                #current_app.logger.debug('{}: adding ({},{}) length: {}'.format(fname, column, country, len(cases_list)))
-
-    if sdf.columns.to_list() == []:
-        sdf = None
-    else:
-        pass
-        #for country in countries:
-        #    try:
-        #        sdf[(column,country,)] = sdf[(column,country,)].cumsum()
-        #    except:
-        #        pass
 
-    return sdf
+def align_by_threshold(cdf, threshold):
+    '''translate cumulative data to start all at the same row: the 1st one of
+       a couple of adjacent days (both with data) exceeding threshold
+    
+    params
+        - cdf          pandas dataframe - cumulative data: dates as index, a column for every
+                           country; nan where a country has no data in a day
+        - threshold    number - value to overcome in two adjacent days
+    
+    return (sdf, missing)
+        - sdf          pandas dataframe - rows numbered from the overlap point (0, 1, ...),
+                           aligned columns of cdf; None if no column can be aligned
+        - missing      list - columns of cdf which never exceed threshold in two adjacent days
+    
+    remark: after the overlap point, a day without data keeps the last total of its country;
+            shorter columns are padded by nan
+    '''
+    values = cdf.values.astype(np.float64)
+    ndays = values.shape[0]
+    dates = pd.DatetimeIndex(cdf.index)
+    nxt = dates.get_indexer(dates + pd.Timedelta(days=1))          # row of the following day, -1 if it has no row
+    with np.errstate(invalid='ignore'):
+        over = values >= threshold                                 # nan is never over
+    ok = over & over[nxt] & (nxt >= 0)[:, np.newaxis]              # a couple of adjacent days over threshold
+    
+    aligned = ok.any(axis=0)
+    missing = cdf.columns[~aligned].to_list()
+    if not aligned.any():
+        return None, missing
+    
+    start  = ok.argmax(axis=0)[aligned]                            # overlap point of every aligned column
+    filled = cdf.loc[:, aligned].ffill().values
+    height = ndays - start.min()
+    rows   = np.arange(height)[:, np.newaxis] + start              # source row of every cell of the result
+    cols   = np.broadcast_to(np.arange(len(start)), rows.shape)
+    valid  = rows < ndays
+    result = np.full(rows.shape, np.nan)                           # the only allocation of the result
+    result[valid] = filled[rows[valid], cols[valid]]
+    
+    return pd.DataFrame(result, columns=cdf.columns[aligned]), missing
 
 
 def stretch(df, height):
-    '''raise the height of a dataframe to the requested size'''
+    '''raise the height of a dataframe to the requested size
+    
+    remarks.
+        - new rows are labelled from df.shape[0] to height-1, their values are nan
+        - df is reindexed at once (not extended one row at a time)
+        - overlap (align_by_threshold) does not need it: its result is allocated
+              with the final height
+    '''
     if df.shape[0] >= height:
         return df
     
-    for ndx in range(df.shape[0], height):
-        df.loc[ndx] = np.NaN * df.shape[1]
-    return df
+    return df.reindex(df.index.append(pd.RangeIndex(df.shape[0], height)))
 
 
 def suggest_threshold(df, column='cases', ratio=0.1):
@@ -535,7 +721,7 @@ def suggest_threshold(df, column='cases', ratio=0.1):
     return ceil(little_cases * ratio)
     
 
-def worst_countries(df, field, countries, lndx, rndx, normalize=False):
+def worst_countries(df, field, countries, lndx, rndx, normalize=False, first=None, last=None, ranking=None):
     '''return worst countries from a given list respect to a given field.
        worst means higher value of cumulative sum of field.
        Both extremes are included.
@@ -547,6 +733,9 @@ def worst_countries(df, field, countries, lndx, rndx, normalize=False):
            - lndx         int - left index, >= 1
            - rndx         int - right index, >= lndx
            - normalize    bool - if true use ratio to population
+           - first        date - left extreme of time interval, None for the first day of data
+           - last         date - right extreme of time interval, None for the last day of data
+           - ranking      Ranking - of df; if it has field, totals come from it
        return
            - l            list of str - geoId of countries with worst values
        
@@ -555,6 +744,8 @@ def worst_countries(df, field, countries, lndx, rndx, normalize=False):
                   from field. Then it returns [lndx-1 : rndx] positions from 
                   the sorted countries list.
            - must be rndx < lndx
+           - countries without data in time interval are not ranked; when normalize,
+                  the ones without population come last
     '''
     fname = 'worst_countries'
     if lndx<=0 or rndx<=0 or lndx > rndx:
@@ -566,8 +757,17 @@ def worst_countries(df, field, countries, lndx, rndx, normalize=False):
     if rndx-lndx-1>=len(countries):
         return countries[:]
     
-    # make a copy, expand it by eventual areas nations, drop unnecessary columns (we need field and geoId only)
-    ndf = df.copy()
+    if ranking is not None and ranking.has(field):
+        # areas totals are already in the running totals: we only read two rows of them
+        return ranking.top(field, countries, lndx, rndx, normalize=normalize, first=first, last=last)
+    
+    if first is not None or last is not None:
+        df = select_rows_by_dates(df,
+                                  df['dateRep'].min() if first is None else first,
+                                  df['dateRep'].max() if last  is None else last)
+    
+    # project it on the only needed columns (field and geoId) and expand it by eventual areas nations
+    ndf = df[['geoId', field]]
     
     areas = []                                                    # START expand it by eventual areas nations
     for country in countries:
@@ -578,29 +778,18 @@ def worst_countries(df, field, countries, lndx, rndx, normalize=False):
             pass
     if len(areas) > 0:
         areas_df = create_rows_by_areas(df, areas, 'nations')
-        ndf = pd.concat([ndf, areas_df])                          # END   expand it by eventual areas nations
-        
-    columns = ndf.columns.to_list()
-    columns.remove(field)
-    columns.remove('geoId')
-    ndf = ndf.drop(columns, axis='columns')
+        ndf = pd.concat([ndf, areas_df[['geoId', field]]])        # END   expand it by eventual areas nations
     
     # remove unwanted countries, groub by country and sum field column
     ndf = ndf[ndf['geoId'].isin(countries)]
     ndf = ndf.groupby(['geoId'])[field].sum()     # this is a pandas series with country as index, cells are int64
     
     if normalize:
-        ndf = ndf.astype(np.float64)             # from int64 to float64 otherwise we'll get zeroes
-        ndf_index = ndf.index.to_list()
-        for country in ndf_index:
-            #ndf.at[country] /= GeoEntities.get_entity_att(country, 'population')
-            try:
-                ndf.at[country] = ndf.at[country] / GeoEntities.get_entity_att(country, 'population')
-            except:
-                ndf = ndf.drop(index=country)
+        population = GeoEntities.get_population(ndf.index)
+        ndf = ndf.astype(np.float64) / population         # from int64 to float64 otherwise we'll get zeroes
     
     # sort in descending order and we get first how_many index
-    ndf = ndf.sort_values(ascending=False)
+    ndf = ndf.sort_values(ascending=False, kind='mergesort')
     l   =  ndf.index.to_list()[lndx-1:rndx]
     return l
 
@@ -644,52 +833,124 @@ def create_rows_by_continents(df, ids, pop_field='popData2019'):
     
     return:
         - ndf             (new) pandas dataframe - subset of df
-        
-    rem: this is very similar to create_rows_by_areas, but here an there
-         there are small differences. So, for sake of readability, I've
-         decided to duplicate some code
     '''
-    df_result = pd.DataFrame()
-    for id in ids:
-        df_tmp = pd.DataFrame()
-        df_nrc = df[df['continentExp']==id]
-        # ... calculating area population
-        grouped = df_nrc.groupby(by='dateRep', as_index=False)
-        population = df_nrc[['countriesAndTerritories', pop_field]].drop_duplicates().sum()[pop_field]
-        # ... grouping by date and adding new cols to new df
-        grouped = df_nrc.groupby(by='dateRep', as_index=False)
-        df_tmp['dateRep'] = grouped.groups       # 1st col: dates
-        df_tmp = df_tmp.reset_index()            #
-        del df_tmp['index']
-        df_tmp['day'] = df_tmp['dateRep'].map(lambda x: x.day)
-        df_tmp['month'] = df_tmp['dateRep'].map(lambda x: x.month)
-        df_tmp['year'] = df_tmp['dateRep'].map(lambda x: x.year)
-    
-        df_tmp['cases'] = grouped.sum()['cases']
-        df_tmp['deaths'] = grouped.sum()['deaths']
-        
-        df_tmp['countriesAndTerritories'] = id[:]
-        df_tmp['geoId']                   = id[:]
-        df_tmp['countryterritoryCode']    = id[:]
-        df_tmp[pop_field]                 = population
-        df_tmp['continentExp']            = id[:]
-        # adding continent's data to final result (all continents)
-        df_result = pd.concat([df_result, df_tmp])
-    return df_result
+    return aggregate_rows(df, continents_groups(df, ids, pop_field), pop_field)
 
 
-def subset_rows_by_nations(df, ids):
+def continents_groups(df, ids, pop_field='popData2019'):
+    '''groups of rows (see aggregate_rows) of continents: rows where continentExp is the continent
+    
+    remark: population of a continent is the sum of populations of its nations in df
+    '''
+    cdf = df.loc[df['continentExp'].isin(ids).values, ['continentExp', 'countriesAndTerritories', pop_field]]
+    population = cdf.drop_duplicates().groupby('continentExp')[pop_field].sum()
+    return [{'key':                  'continentExp',
+             'members':              [id],
+             'name':                 id,
+             'geoId':                id,
+             'countryterritoryCode': id,
+             'population':           population.get(id, 0),
+             'continentExp':         id,
+            } for id in ids]
+
+
+def areas_groups(ids):
+    '''groups of rows (see aggregate_rows) of areas: rows where geoId is one of the nations of area
+    
+    remark: areas unknown to GeoEntities are skipped
+    '''
+    groups = []
+    for id in ids:
+        name = GeoEntities.get_entity_att(id, 'name')
+        if name is None:
+            continue
+        groups.append({'key':                  'geoId',
+                       'members':              GeoEntities.get_entity_att(id, 'nations') or (),
+                       'name':                 name,
+                       'geoId':                id,
+                       'countryterritoryCode': GeoEntities.get_entity_att(id, 'countryterritoryCode'),
+                       'population':           GeoEntities.get_entity_att(id, 'population'),
+                       'continentExp':         GeoEntities.get_entity_att(id, 'continentExp'),
+                      })
+    return groups
+
+
+def aggregate_rows(df, groups, pop_field='popData2019'):
+    '''create rows of aggregates (areas, continents) summing cases and deaths
+       of their rows by date, all of them in one pass
+    
+    parameters:
+        - df              pandas dataframe - containing raw data
+                              see heading comment in this module to get this dataframe format
+        - groups          list of dict - an aggregate for each one, with:
+                              'key' (column to match: 'geoId' | 'continentExp'), 'members' (values of key),
+                              and 'name', 'geoId', 'countryterritoryCode', 'population', 'continentExp'
+                              (attributes of the new rows)
+        - pop_field       str - field name to store aggregates population
+    
+    return:
+        - result_df       pandas dataframe - same format of originating df; by group
+                              (in the given order) and date; a row belongs to all the groups
+                              having it as member (e.g. Italy is in EU and in Europe)
+    '''
+    rows, gids = ([], [],)                     # pairs (row of df, group)
+    for key in ('geoId', 'continentExp',):
+        if not any(group['key']==key for group in groups):
+            continue
+        codes, uniques = pd.factorize(df[key])
+        for n, group in enumerate(groups):
+            if group['key']==key:
+                members = uniques.get_indexer(pd.Index(group['members']).dropna())
+                r = np.flatnonzero(np.isin(codes, members[members >= 0]))
+                rows.append(r)
+                gids.append(np.full(len(r), n, dtype=np.intp))
+    r = np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+    g = np.concatenate(gids) if gids else np.empty(0, dtype=np.intp)
+    
+    # sums by (group, day) in a dense array: group major, by date
+    first = df['dateRep'].min() if len(r) else pd.Timestamp(0)
+    days = ((df['dateRep'].values[r] - first.to_datetime64()) // np.timedelta64(1, 'D')).astype(np.intp)
+    ndays = days.max() + 1 if len(r) else 0
+    cells = g * ndays + days
+    present = np.bincount(cells, minlength=len(groups) * ndays) > 0
+    n, day = np.divmod(np.flatnonzero(present), max(ndays, 1))
+    sums = dict()
+    for field in ('cases', 'deaths',):
+        values = df[field].values[r]
+        total = np.bincount(cells, weights=np.nan_to_num(values.astype(np.float64)), minlength=len(groups) * ndays)[present]
+        sums[field] = total.astype(np.int64) if np.issubdtype(values.dtype, np.integer) else total
+    dates = pd.DatetimeIndex(first + pd.to_timedelta(day, unit='D'))
+    
+    attributes = {att: np.array([group[att] for group in groups] + [None], dtype=object)
+                  for att in ('name', 'geoId', 'countryterritoryCode', 'population', 'continentExp',)}
+    return pd.DataFrame({'dateRep':                 dates,
+                         'day':                     dates.day,
+                         'month':                   dates.month,
+                         'year':                    dates.year,
+                         'cases':                   sums['cases'],
+                         'deaths':                  sums['deaths'],
+                         'countriesAndTerritories': attributes['name'][n],
+                         'geoId':                   attributes['geoId'][n],
+                         'countryterritoryCode':    attributes['countryterritoryCode'][n],
+                         pop_field:                 pd.to_numeric(attributes['population'][n]),
+                         'continentExp':            attributes['continentExp'][n],
+                        })
+
+
+def subset_rows_by_nations(df, ids, offsets=None):
     '''get rows where geoId value is in ids
     
     parameters:
         - df              pandas dataframe - to subset
                               see heading comment in this module to get this dataframe format
         - ids             list of str - codes of nations to select
+        - offsets         Offsets - of df; if they are, rows come from them
     
     return:
         - ndf             (new) pandas dataframe - subset of df
     '''
-    
+    if offsets is not None and offsets.applies(df):
+        return offsets.take(ids)
     return df[df['geoId'].isin(ids)]
 
 
@@ -707,89 +968,50 @@ def create_rows_by_areas(df, ids, context, pop_field='popData2019'):
         - result_df       pandas dataframe - with data of given areas,
                               same format of originating df
     '''
-    df_result = pd.DataFrame()
-    
-    for id in ids:          # for every area's id
-        df_tmp = pd.DataFrame()
-        # getting area's countries
-        # - ldfa,2020-09-28 passing to GeoEntities
-        #area_name = areas_get_nation_name(id, context)
-        area_name = GeoEntities.get_entity_att(id, 'name')
-        if area_name is None:
-            continue
-        # - ldfa,2020-09-28 passing to GeoEntities
-        #localities = [ k for k in AREAS[area_name]['nations'].keys()]   # ids of countries forming area
-        localities = GeoEntities.get_entity_att(id, 'nations')
-        # ... calculating area population
-        df_nrc  = df[df['geoId'].isin(localities)] 
-        
-        # - ldfa,2020-09-28 passing to GeoEntities
-        #population = df_nrc[['countriesAndTerritories', pop_field]].drop_duplicates().sum()[pop_field]
-        
-        # ... grouping by date and adding new cols to new df
-        grouped = df_nrc.groupby(by='dateRep', as_index=False)
-        df_tmp['dateRep'] = grouped.groups       # 1st col: dates
-        df_tmp = df_tmp.reset_index()            #
-        del df_tmp['index']
-        df_tmp['day'] = df_tmp['dateRep'].map(lambda x: x.day)
-        df_tmp['month'] = df_tmp['dateRep'].map(lambda x: x.month)
-        df_tmp['year'] = df_tmp['dateRep'].map(lambda x: x.year)
-    
-        df_tmp['cases'] = grouped.sum()['cases']
-        df_tmp['deaths'] = grouped.sum()['deaths']
-        
-        df_tmp['countriesAndTerritories'] = area_name[:]
-        # - ldfa,2020-09-29 passing to GeoEntities
-        #df_tmp['geoId']                   = AREAS[area_name]['geoId']
-        #df_tmp['countryterritoryCode']    = AREAS[area_name]['countryterritoryCode']
-        #df_tmp[pop_field]                 = population
-        #df_tmp['continentExp']            = AREAS[area_name]['continentExp']
-
-        df_tmp['geoId']                   = id[:]
-        df_tmp['countryterritoryCode']    = GeoEntities.get_entity_att(id, 'countryterritoryCode')
-        df_tmp[pop_field]                 = GeoEntities.get_entity_att(id, 'population')
-        df_tmp['continentExp']            = GeoEntities.get_entity_att(id, 'continentExp')
-
-        # adding area's data to final result (all areas)
-        df_result = pd.concat([df_result, df_tmp])
-    return df_result
+    return aggregate_rows(df, areas_groups(ids), pop_field)
 
 
-def select_rows_by_dates(df, first, last, remember=False):
+def select_rows_by_dates(df, first, last, remember=False, offsets=None):
     '''drops rows with date out of the indicated [first, last] time interval
     
     params:
-        -df          pandas dataframe - to analize
+        -df          pandas dataframe - to analize, with dateRep as datetime64
         - first      datetime.date - left extreme of time interval
         - last       datetime.date - right extreme of time interval
         - remember   bool - if true sum values in dropped rows on the 1st surviving row
                             considering countriesAndTerritories field as a grouping criterion
+        - offsets    Offsets - of df; if they are, rows come from them by binary search
     
     return a new pandas dataframe
+    
+    remark: with remember, totals before first are carried forward by one
+            groupby and one aligned sum, not by a lookup for each country
     '''
     fname = 'select_rows_by_dates'
-    min_date = df['dateRep'].min()
-    ti_df = df[(df['dateRep']>=first) & (df['dateRep']<=last)]    # result candidate: time interval dataframe; this has rows in indicated time interval
-    if not remember or first <= min_date:
-        result= ti_df
+    first, last = (pd.Timestamp(first), pd.Timestamp(last),)    # to compare with the datetime64 dateRep column
+    indexed = offsets is not None and offsets.applies(df)
+    if indexed:
+        ti_df = offsets.take(first=first, last=last)
     else:
-        # here we calculate cases and deaths totals for every country ...
-        base_df = df[(df['dateRep']<first)]
-        cols_to_drop = [col for col in base_df.columns.to_list() if col not in {'countriesAndTerritories', 'cases', 'deaths',}]
-        base_df = base_df.drop(cols_to_drop, axis='columns')
-        base_df = base_df.set_index('countriesAndTerritories').groupby(level=[0]).sum()  # ... this is: country (as index), (total)cases, (total)deaths
-        
-        # ... and now we need sum up these totals on the min day of each country
-        ti_df2 = ti_df.set_index(['countriesAndTerritories', 'dateRep'])
-        for country in base_df.index.to_list():
-            try:
-                country_min_date = ti_df[(ti_df['countriesAndTerritories']==country)]['dateRep'].min()
-                ti_df2.at[(country, country_min_date,), 'cases']  = ti_df2.at[(country, country_min_date,), 'cases'] + base_df.at[country, 'cases']
-                ti_df2.at[(country, country_min_date,), 'deaths'] = ti_df2.at[(country, country_min_date,), 'deaths'] + base_df.at[country, 'deaths']
-            except:
-                pass
-        result = ti_df2.reset_index()             # ... and here we have result, with cases and deaths of days before first summed up to first
-   
+        ti_df = df[(df['dateRep']>=first) & (df['dateRep']<=last)]    # result candidate: time interval dataframe; this has rows in indicated time interval
+    if not remember or first <= df['dateRep'].min():
+        return ti_df
+    
+    # here we calculate cases and deaths totals for every country before first ...
+    fields = [field for field in ('cases', 'deaths',) if field in df.columns]
+    before = offsets.take(last=first - pd.Timedelta(days=1)) if indexed else df[(df['dateRep']<first)]
+    base_df = before.groupby('countriesAndTerritories')[fields].sum()  # ... this is: country (as index), (total)cases, (total)deaths
+    
+    # ... and now we sum up these totals on the min day of each country, all countries at once:
+    #     - a country with more rows on its min day gets totals on the first one of them
+    #     - a country without rows in time interval has nowhere to put its totals: it stays out of result
+    #     - a country without rows before first gets nothing (fill_value=0)
+    result = ti_df.reset_index(drop=True)
+    first_rows = result.sort_values('dateRep', kind='mergesort').drop_duplicates('countriesAndTerritories').index
+    carried = base_df.reindex(result.loc[first_rows, 'countriesAndTerritories'], fill_value=0)
+    for field in fields:
+        result.loc[first_rows, field] = result.loc[first_rows, field].to_numpy() + carried[field].to_numpy()
+    
     return result
 
 
@@ -800,14 +1022,894 @@ def world_shape(df):
     params: df        pandas dataframe - df to model
     
     return df         pandas dataframe - the modeled dataframe
+    
+    remark: dateRep becomes a datetime64 column; the parse is vectorized
+            and, by cache, every distinct date string is parsed only once
     '''
-    df['dateRep'] = df['dateRep'].map(lambda x: datetime.strptime(x, current_app.config['D_FMT2']).date()) # from str to date
+    df['dateRep'] = pd.to_datetime(df['dateRep'], format=current_app.config['D_FMT2'], cache=True) # from str to datetime64
     df.loc[(df['countriesAndTerritories']=='CANADA'), 'countriesAndTerritories'] = 'Canada'
     return df
 
 
+# START dense (date x entity) cube of daily data
+#     the query patterns (see heading comment) regroup and pivot the rows of data
+#     on every request. The cube does it once, when data are loaded: queries
+#     become slices of its arrays
+CUBE_FIELDS = ('cases', 'deaths',)
+
+
+class Cube(object):
+    '''dense arrays of daily data: a row for every day, a column for every geographic entity
+
+    attributes
+        - dates          pandas DatetimeIndex - every day from the first to the last date of data
+        - ids            list of str - entities: nations of data, then areas and continents
+        - pos            dict - {id: column}
+        - daily          dict - {field: 2D numpy array of float64} - daily data, nan where
+                             the entity has no data (i.e. no row) in that day
+        - total          dict - {field: 2D numpy array of float64} - running totals of daily data
+        - present        2D numpy array of bool - True where the entity has data
+        - names, codes, population, continents
+                         numpy arrays - attributes of entities, by column
+        - nations        pandas Index - geoIds of nations, they are the first columns
+        - membership     2D numpy array - (nation x area) 1.0 if the nation is in the area
+
+    remarks.
+        - areas and continents are built from GeoEntities (with their nations)
+              and from the continentExp field of data, if GeoEntities misses them:
+              an area has data in a day if at least one of its nations has them
+        - the cube is READ ONLY, as the dataframe it comes from
+    '''
+
+    def __init__(self, df, pop_field=None):
+        if pop_field is None: pop_field = POP_FIELD
+        self.pop_field = pop_field
+        first = df['dateRep'].min()
+        self.dates = pd.date_range(first, df['dateRep'].max(), freq='D', name='dateRep')
+        self.int_fields = {field for field in CUBE_FIELDS if np.issubdtype(df[field].dtype, np.integer)}
+
+        # nations, with attributes from their first row
+        ndf = df.dropna(subset=['geoId']).drop_duplicates('geoId')
+        nations = ndf['geoId'].to_list()
+        npos = {id: n for n, id in enumerate(nations)}
+        npop = ndf[pop_field].values.astype(np.float64) if pop_field in ndf.columns else np.full(len(nations), np.nan)
+        ids, names, codes, population, continents = (nations[:],
+                                                     ndf['countriesAndTerritories'].to_list(),
+                                                     ndf['countryterritoryCode'].to_list(),
+                                                     npop.tolist(),
+                                                     ndf['continentExp'].to_list(),)
+
+        # areas and continents, with positions of their nations
+        members = []
+        for id in GeoEntities().keys():
+            e = GeoEntities.get_entity(id)
+            if id in npos or e.get('original_country', None) is True or not e.get('nations', None):
+                continue
+            ids.append(id)
+            names.append(e.get('name', id))
+            codes.append(e.get('countryterritoryCode', id))
+            population.append(e.get('population', None) if e.get('population', None) is not None else np.nan)
+            continents.append(e.get('continentExp', id))
+            members.append([npos[n] for n in e['nations'] if n in npos])
+        for continent, cdf in ndf.groupby('continentExp'):
+            if continent in ids:
+                continue
+            ids.append(continent)
+            names.append(continent)
+            codes.append(continent)
+            population.append(np.nansum(npop[[npos[n] for n in cdf['geoId']]]))
+            continents.append(continent)
+            members.append([npos[n] for n in cdf['geoId']])
+        membership = np.zeros((len(nations), len(members)))
+        for col, rows in enumerate(members):
+            membership[rows, col] = 1.0
+
+        self.nations    = pd.Index(nations)
+        self.membership = membership
+        self.ids        = ids
+        self.pos        = {id: n for n, id in enumerate(ids)}
+        self.names      = np.array(names, dtype=object)
+        self.codes      = np.array(codes, dtype=object)
+        self.population = np.array(population, dtype=np.float64)
+        self.continents = np.array(continents, dtype=object)
+
+        self.present, values = self._cells(df, first, len(self.dates))
+        self.daily = dict()
+        self.total = dict()
+        for field in CUBE_FIELDS:
+            self.total[field] = np.cumsum(values[field], axis=0)
+            values[field][~self.present] = np.nan
+            self.daily[field] = values[field]
+
+    def _cells(self, df, first, days):
+        '''from rows to cells: present and daily values of the rows of df, by (day from first, entity)'''
+        r = ((df['dateRep'].values - first.to_datetime64()) // np.timedelta64(1, 'D')).astype(np.intp)
+        c = self.nations.get_indexer(df['geoId'])
+        ok = c >= 0                                                   # rows without geoId are skipped
+        r, c = (r[ok], c[ok],)
+        present = np.zeros((days, len(self.nations)), dtype=bool)
+        present[r, c] = True
+        present = np.hstack([present, (present.astype(np.float64) @ self.membership) > 0])
+        values = dict()
+        for field in CUBE_FIELDS:
+            v = np.zeros((days, len(self.nations)))
+            np.add.at(v, (r, c), np.nan_to_num(df[field].values[ok].astype(np.float64)))
+            values[field] = np.hstack([v, v @ self.membership])
+        return present, values
+
+    def appends(self, df):
+        '''True if df has the same data of this cube, plus some days after its last one
+        
+        remark: this is the check we need to use extended; it is cheaper than diff_df
+                because it compares rows of df with cells of the cube
+        '''
+        nn = len(self.nations)
+        missing = df['geoId'].isna().values
+        c = self.nations.get_indexer(df['geoId'])
+        if ((c < 0) & ~missing).any():                                 # a new nation
+            return False
+        r = ((df['dateRep'].values - self.dates[0].to_datetime64()) // np.timedelta64(1, 'D')).astype(np.intp)
+        old = ~missing & (r < len(self.dates))
+        r, c = (r[old], c[old],)
+        if (   (r < 0).any()                                          # a day before the first one
+            or len(r) != self.present[:, :nn].sum()                   # a removed row ...
+            or not self.present[r, c].all()                           # ... or an added one
+            or len(np.unique(r.astype(np.int64) * nn + c)) != len(r)):   # a duplicated row
+            return False
+        for field in CUBE_FIELDS:
+            if not np.array_equal(np.nan_to_num(df[field].values[old].astype(np.float64)), self.daily[field][r, c]):
+                return False
+        first = ~missing & ~df['geoId'].duplicated().values                 # attributes from first rows, as __init__
+        c = self.nations.get_indexer(df['geoId'].values[first])
+        population = (df[self.pop_field].values[first].astype(np.float64) if self.pop_field in df.columns
+                      else np.full(len(c), np.nan))
+        return (    len(c) == nn
+                and same_values(df['countriesAndTerritories'].values[first], self.names[c]).all()
+                and same_values(df['countryterritoryCode'].values[first], self.codes[c]).all()
+                and same_values(df['continentExp'].values[first], self.continents[c]).all()
+                and same_values(population, self.population[c]).all())
+
+    def extended(self, df):
+        '''a new cube with the days of df after the last day of this one
+        
+        params
+            - df           pandas dataframe - ALL data: old days plus the new ones;
+                               rows of days already in the cube are NOT read again,
+                               so they MUST be unchanged (see appends)
+        
+        return cube        Cube - this cube if df has no new days
+        
+        remark: running totals of new days continue from the last totals of
+                this cube, so we don't compute again the whole history
+        '''
+        last = self.dates[-1]
+        ndf = df[df['dateRep'] > last]
+        if ndf.empty:
+            return self
+        cube = copy.copy(self)
+        cube.int_fields = {field for field in CUBE_FIELDS if np.issubdtype(df[field].dtype, np.integer)}
+        cube.dates = pd.date_range(self.dates[0], ndf['dateRep'].max(), freq='D', name='dateRep')
+        present, values = self._cells(ndf, last + pd.Timedelta(days=1), len(cube.dates) - len(self.dates))
+        cube.present = np.vstack([self.present, present])
+        cube.daily = dict()
+        cube.total = dict()
+        for field in CUBE_FIELDS:
+            cube.total[field] = np.cumsum(np.vstack([self.total[field][-1:], values[field]]), axis=0)[1:]   # as a whole cumsum
+            cube.total[field] = np.vstack([self.total[field], cube.total[field]])
+            values[field][~present] = np.nan
+            cube.daily[field] = np.vstack([self.daily[field], values[field]])
+        return cube
+
+    def covers(self, ids):
+        '''True if all ids are entities of the cube'''
+        return all(id in self.pos for id in ids)
+
+    def window(self, first=None, last=None):
+        '''slice of days in [first, last]; None means the first/last day of data'''
+        start = 0 if first is None else self.dates.searchsorted(pd.Timestamp(first))
+        stop  = len(self.dates) if last is None else self.dates.searchsorted(pd.Timestamp(last), side='right')
+        return slice(start, max(start, stop))
+
+    def _daily(self, field, w, cols, remember):
+        '''daily data in window w; if remember, the totals before window are summed on the 1st day with data'''
+        values = self.daily[field][w][:, cols]
+        if remember and w.start > 0:
+            values = values.copy()
+            present = self.present[w][:, cols]
+            has = present.any(axis=0)
+            rows = present.argmax(axis=0)[has]
+            values[rows, np.flatnonzero(has)] += self.total[field][w.start-1, cols][has]
+        return values
+
+    def rows(self, ids, first=None, last=None, remember=False):
+        '''rows of data of the given entities, as the query patterns give them
+
+        params
+            - ids          list of str - entities, they MUST be in the cube
+            - first        date - left extreme of time interval, None for the first day of data
+            - last         date - right extreme of time interval, None for the last day of data
+            - remember     bool - if true sum values before first on the 1st day with data
+
+        return df          pandas dataframe - a row for every entity and day with data;
+                               by entity and, for every entity, by date in descending order,
+                               as the ECDC file has them (the shared dataset is sorted by
+                               entity and ascending date instead)
+        
+        remark: add_cols does not depend on this order, see delta_by_country
+        '''
+        cols = np.array([self.pos[id] for id in ids], dtype=np.intp)
+        w = self.window(first, last)
+        ncol, nday = np.nonzero(self.present[w][:, cols][::-1].T)    # entity major, date descending
+        day = w.stop - 1 - nday
+        col = cols[ncol]
+        dates = self.dates[day]
+        data = {'dateRep': dates,
+                'day':     dates.day,
+                'month':   dates.month,
+                'year':    dates.year,
+               }
+        for field in CUBE_FIELDS:
+            values = self._daily(field, w, cols, remember)[day - w.start, ncol]
+            data[field] = values.astype(np.int64) if field in self.int_fields else values
+        data['countriesAndTerritories'] = self.names[col]
+        data['geoId']                   = np.array(self.ids, dtype=object)[col]
+        data['countryterritoryCode']    = self.codes[col]
+        data[self.pop_field]            = self.population[col]
+        data['continentExp']            = self.continents[col]
+        return pd.DataFrame(data)
+
+    def pivot(self, fields, ids, first=None, last=None, remember=False, normalize=False):
+        '''cumulative data of the given entities: a row by date, a column by (field, name of entity)
+
+        params
+            - fields       list of str - 'cases' | 'deaths' are cumulative,
+                               'cases/day' | '\N{Greek Capital Letter Delta}cases/day' are daily
+            - ids          list of str - entities, they MUST be in the cube
+            - first        date - left extreme of time interval, None for the first day of data
+            - last         date - right extreme of time interval, None for the last day of data
+            - remember     bool - if true cumulative data start from the totals before first
+            - normalize    bool - if true cumulative data are divided by population
+
+        return df          pandas dataframe - as calculate_cumulative_sum returns it;
+                               only dates where at least one entity has data
+        '''
+        cols = np.array([self.pos[id] for id in ids], dtype=np.intp)
+        w = self.window(first, last)
+        blocks = [self._values(field, w, cols, remember, normalize) for field in fields]
+        keep = self.present[w][:, cols].any(axis=1)
+        columns = pd.MultiIndex.from_product([fields, self.names[cols].tolist()], names=[None, 'countriesAndTerritories'])
+        values = np.hstack(blocks) if blocks else np.empty((len(keep), 0))
+        index = pd.DatetimeIndex(self.dates[w][keep].values, name='dateRep')
+        return pd.DataFrame(values[keep], index=index, columns=columns)
+
+    def entities(self, fields, ids, first=None, last=None, remember=False, normalize=False, cumulative=True):
+        '''data of the given entities, one at a time: the columns of pivot, without
+           building them all together
+
+        params: as pivot ones, plus
+            - cumulative   bool - if false 'cases' | 'deaths' are daily too, as in rows
+
+        return generator   of (name, present, df) for every entity of ids:
+            - name             str - name of the entity
+            - present          numpy array of bool - by row of df, True where the entity has data
+            - df               pandas dataframe - a row by date (the ones of pivot), a column by field
+
+        remark: memory of a step is the one of an entity, whatever the number of ids
+        '''
+        cols = np.array([self.pos[id] for id in ids], dtype=np.intp)
+        w = self.window(first, last)
+        keep = self.present[w][:, cols].any(axis=1)                    # dates of pivot, i.e. of all the entities
+        index = pd.DatetimeIndex(self.dates[w][keep].values, name='dateRep')
+        for col in cols:
+            col = np.array([col], dtype=np.intp)
+            blocks = [self._values(field, w, col, remember, normalize) if cumulative or field not in CUBE_FIELDS
+                      else self._daily(field, w, col, remember)
+                      for field in fields]
+            values = np.hstack(blocks) if blocks else np.empty((len(keep), 0))
+            yield self.names[col[0]], self.present[w][keep, col[0]], pd.DataFrame(values[keep], index=index, columns=fields)
+
+    def last_values(self, fields, ids, first=None, last=None, remember=False):
+        '''values of the given entities at their last day with data: the last row of
+           pivot of each entity, read from the running totals
+
+        params: as pivot ones, plus
+            - fields       list of str - as pivot ones, and the population field
+
+        return df          pandas dataframe - a row by name of entity with data in [first, last],
+                               in the order of ids, a column by field; a delta without a previous
+                               day is nan, as in pivot
+
+        remark: cumulative values are a difference of running totals, so the cost
+                does not depend on the number of days
+        '''
+        fname = 'last_values'
+        cols = np.array([self.pos[id] for id in ids], dtype=np.intp)
+        w = self.window(first, last)
+        present = self.present[w][:, cols]
+        has = present.any(axis=0)
+        cols, present = (cols[has], present[:, has],)
+        n = np.arange(len(cols))
+        day = w.stop - 1 - present[::-1].argmax(axis=0)                # last day with data of every entity
+        before = present.copy()
+        before[day - w.start, n] = False
+        has_before = before.any(axis=0)
+        day_before = w.stop - 1 - before[::-1].argmax(axis=0)          # the previous one, if has_before
+
+        def daily(field, days):                                        # as _daily, on one day for every entity
+            values = self.daily[field][days, cols]
+            if remember and w.start > 0:
+                values = values + np.where(days == w.start + present.argmax(axis=0), self.total[field][w.start-1, cols], 0)
+            return values
+
+        data = dict()
+        for field in fields:
+            if field in CUBE_FIELDS:
+                values = self.total[field][day, cols]
+                if not remember and w.start > 0:
+                    values = values - self.total[field][w.start-1, cols]
+            elif field == 'cases/day':
+                values = daily('cases', day)
+            elif field == '\N{Greek Capital Letter Delta}cases/day':
+                values = np.where(has_before, daily('cases', day) - daily('cases', day_before), np.nan)
+            elif field == self.pop_field:
+                values = self.population[cols]
+            else:
+                raise ValueError(_('%(function)s: field %(field)s not known', function=fname, field=field))
+            data[field] = values
+        return pd.DataFrame(data, index=self.names[cols], columns=fields)
+
+    def _values(self, field, w, cols, remember, normalize):
+        '''values of a field of pivot in window w, a column for every entity of cols'''
+        fname = 'pivot'
+        if field in CUBE_FIELDS:
+            values = self.total[field][w][:, cols]
+            if not remember and w.start > 0:
+                values = values - self.total[field][w.start-1, cols]
+            values = np.where(self.present[w][:, cols], values, np.nan)
+            if normalize:
+                values = values / self.population[cols]
+        elif field == 'cases/day':
+            values = self._daily('cases', w, cols, remember)
+        elif field == '\N{Greek Capital Letter Delta}cases/day':
+            values = self._daily('cases', w, cols, remember)
+            values = values - pd.DataFrame(values).ffill().shift(1).values   # respect to the previous day with data
+        else:
+            raise ValueError(_('%(function)s: field %(field)s not known', function=fname, field=field))
+        return values
+# END   dense (date x entity) cube of daily data
+
+
+# START offsets of the rows of each nation
+#     select_rows_by_dates and subset_rows_by_nations filter the rows of data
+#     with a boolean mask over the whole dataframe. If the dataframe is sorted
+#     by (geoId, dateRep), the rows of a nation are contiguous and, inside them,
+#     the rows of a time interval too: offsets and a binary search give them
+OFFSETS_KEYS = ['geoId', 'dateRep']
+
+
+def sort_rows(df):
+    '''df sorted by (geoId, dateRep), as Offsets needs it; rows without geoId are the last ones
+    
+    return df          pandas dataframe - df itself if it is already sorted, otherwise a sorted copy
+    '''
+    if Offsets.is_sorted(df):
+        return df
+    return df.sort_values(OFFSETS_KEYS, kind='mergesort', na_position='last').reset_index(drop=True)
+
+
+class Offsets(object):
+    '''where the rows of each nation are, in a dataframe sorted by (geoId, dateRep)
+
+    attributes
+        - df             pandas dataframe - the indexed one; offsets are valid only for it
+        - ids            list of str - geoIds of nations, in the order of their rows
+        - pos            dict - {id: n}, position of the nation in ids
+        - starts, stops  numpy arrays of int - rows of the n-th nation are df.iloc[starts[n]:stops[n]];
+                             the last item is for rows without geoId (they have no id)
+        - keys           numpy array of int64 - (nation, day) of every row as a single
+                             sortable number: a time interval is a binary search away
+
+    remark: the cost of a lookup depends on the number of nations and on the
+            number of rows it gets, not on the number of rows of df
+    '''
+
+    DAY = np.timedelta64(1, 'D')
+
+    def __init__(self, df):
+        fname = 'Offsets'
+        missing = df['geoId'].isna().values
+        codes, uniques = pd.factorize(df['geoId'])
+        codes = np.where(missing, len(uniques), codes).astype(np.int64)   # rows without geoId: an entity after the last one
+        days = ((df['dateRep'].values - np.datetime64('1970-01-01')) // self.DAY).astype(np.int64)
+        self.keys = codes << 32 | (days - days.min() if len(days) else days)
+        if (np.diff(self.keys) < 0).any():
+            raise ValueError(_('%(function)s: dataframe is not sorted by geoId and dateRep', function=fname))
+        self.df     = df
+        self.day0   = days.min() if len(days) else 0
+        self.ids    = uniques.to_list()
+        self.pos    = {id: n for n, id in enumerate(self.ids)}
+        bounds      = np.searchsorted(codes, np.arange(len(uniques) + 2))
+        self.starts = bounds[:-1]
+        self.stops  = bounds[1:]
+
+    @staticmethod
+    def is_sorted(df):
+        '''True if df is sorted by (geoId, dateRep), with rows without geoId at its end'''
+        missing = df['geoId'].isna().values
+        if missing.any() and not missing[missing.argmax():].all():
+            return False
+        ok = ~missing
+        nations = pd.Index(df['geoId'].values[ok])
+        if not nations.is_monotonic_increasing:
+            return False
+        dates = df['dateRep'].values
+        changes = np.flatnonzero(nations.values[1:] != nations.values[:-1]) + 1   # first rows of nations, but the 1st one
+        steps = np.diff(dates[ok]).astype(np.int64)
+        steps[changes - 1] = 0
+        tail = np.diff(dates[missing]).astype(np.int64)
+        return bool((steps >= 0).all() and (tail >= 0).all())
+
+    def applies(self, df):
+        '''True if these offsets are the ones of df'''
+        return df is self.df
+
+    def _day(self, when, ceil=False):
+        '''a date as days from the first day of data'''
+        days = (pd.Timestamp(when).to_datetime64() - np.datetime64('1970-01-01')) / self.DAY
+        return int(np.ceil(days) if ceil else np.floor(days)) - self.day0
+
+    def positions(self, ids=None, first=None, last=None):
+        '''positions (for df.iloc) of the rows of the given nations in [first, last]
+
+        params
+            - ids          list of str - geoIds of nations; ids without rows are skipped;
+                               None means all rows, rows without geoId too
+            - first        date - left extreme of time interval, None for no left extreme
+            - last         date - right extreme of time interval, None for no right extreme
+
+        return pos         numpy array of int - ascending, as a boolean mask would select them
+        '''
+        if ids is None:
+            entities = np.arange(len(self.starts))
+        else:
+            entities = np.unique([self.pos[id] for id in ids if id in self.pos]).astype(np.int64)
+        starts, stops = (self.starts[entities], self.stops[entities],)
+        if first is not None:
+            starts = np.searchsorted(self.keys, entities << 32 | max(self._day(first, ceil=True), 0))
+        if last is not None:
+            day = self._day(last)
+            if day < 0:
+                return np.empty(0, dtype=np.intp)
+            stops = np.searchsorted(self.keys, entities << 32 | day, side='right')
+        lengths = np.maximum(stops - starts, 0)
+        return (np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())).astype(np.intp)
+
+    def take(self, ids=None, first=None, last=None):
+        '''rows of df of the given nations in [first, last]; see positions'''
+        return self.df.iloc[self.positions(ids, first, last)]
+# END   offsets of the rows of each nation
+
+
+# START ranking of entities by totals
+#     "Worst World" and "Worst EU" queries (see worst_countries) rank entities
+#     by their total of a field in a time interval: with running totals,
+#     absolute and per capita, a total is a difference of two rows and the
+#     worst ones are an argpartition away
+class Ranking(object):
+    '''running totals of a cube, absolute and per capita, to rank its entities
+
+    attributes
+        - cube           Cube - where totals come from
+        - population     numpy array of float64 - by column of cube, from GeoEntities
+                             (see get_population); nan if the entity has no population
+        - per_capita     dict - {field: 2D numpy array of float64} - running totals
+                             divided by population
+        - seen           2D numpy array of int - running count of days with data
+    '''
+
+    def __init__(self, cube):
+        self.cube       = cube
+        self.population = GeoEntities.get_population(cube.ids)
+        self.per_capita = {field: cube.total[field] / self.population for field in cube.total}
+        self.seen       = np.cumsum(cube.present, axis=0, dtype=np.int32)
+
+    def has(self, field):
+        '''True if the field can be ranked'''
+        return field in self.per_capita
+
+    @staticmethod
+    def _interval(running, w, cols):
+        '''running values of cols summed up in window w: a difference of two rows'''
+        if w.stop <= w.start:
+            return np.zeros(len(cols), dtype=running.dtype)
+        values = running[w.stop-1, cols]
+        return values - running[w.start-1, cols] if w.start > 0 else values
+
+    def top(self, field, ids, lndx, rndx, normalize=False, first=None, last=None):
+        '''ids from lndx-th to rndx-th (1 based, both included) by descending total of field in [first, last]
+
+        params
+            - field        str - 'cases' | 'deaths'
+            - ids          list of str - entities to rank; the ones not in cube are not ranked
+            - lndx, rndx   int - positions of the first and of the last entity to return
+            - normalize    bool - if true rank by total per capita
+            - first        date - left extreme of time interval, None for the first day of data
+            - last         date - right extreme of time interval, None for the last day of data
+
+        return l           list of str - ids; ties keep the order they have in ids
+
+        remark: entities without data in the interval are not ranked; when normalize,
+                the ones without population come last, in the order they have in ids
+        '''
+        ids = [id for id in dict.fromkeys(ids) if id in self.cube.pos]
+        cols = np.array([self.cube.pos[id] for id in ids], dtype=np.intp)
+        w = self.cube.window(first, last)
+        running = self.per_capita[field] if normalize else self.cube.total[field]
+        values = self._interval(running, w, cols)
+        ranked = np.flatnonzero(self._interval(self.seen, w, cols) > 0)
+        values = np.nan_to_num(values[ranked], nan=-np.inf)     # without population: after any total
+        if rndx < len(ranked):                                  # only the worst ones, and their ties, are sorted
+            worst = np.argpartition(-values, rndx-1)[:rndx]
+            keep = values >= values[worst].min()
+            ranked, values = (ranked[keep], values[keep],)
+        order = np.lexsort((ranked, -values))                   # by descending value, then by position in ids
+        return [ids[n] for n in ranked[order]][lndx-1:rndx]
+# END   ranking of entities by totals
+
+
+# START differences between two versions of data
+#     get_covid_data.sh replaces the data file every day. Usually the new file
+#     only appends a day of data, but sometimes ECDC corrects some past days:
+#     the cube of the old data is extended (see Cube.appends, Cube.extended), while corrections
+#     need to rebuild it. The diff reports what changed ("flask data diff")
+DIFF_KEYS = ['geoId', 'dateRep']
+
+
+def diff_df(old, new):
+    '''compare two shaped dataframes of data, by (geoId, dateRep)
+    
+    params
+      - old        pandas dataframe - previous data
+      - new        pandas dataframe - current data
+      
+    return diff        dict - with keys:
+        - old_last, new_last     pandas Timestamp - last day of old and new data
+        - added                  pandas dataframe - keys of rows in new, but not in old
+        - removed                pandas dataframe - keys of rows in old, but not in new
+        - changed                pandas dataframe - keys, old and new values of rows with
+                                     different cases or deaths
+        - new_entities           list of str - geoIds in new, but not in old
+        - removed_entities       list of str - geoIds in old, but not in new
+        - changed_entities       list of str - geoIds with different name, codes, population or continent
+        - appendable             bool - true if new only appends days after the last day of old
+    
+    remark: rows without geoId are ignored, as the cube does
+    '''
+    fields = list(CUBE_FIELDS)
+    attributes = [c for c in ('countriesAndTerritories', 'countryterritoryCode', POP_FIELD, 'continentExp')
+                  if c in old.columns and c in new.columns]
+    om, nm = (old['geoId'].notna().values, new['geoId'].notna().values,)
+    o = {c: old[c].values[om] for c in DIFF_KEYS + fields + attributes}
+    n = {c: new[c].values[nm] for c in DIFF_KEYS + fields + attributes}
+    okey, nkey = row_keys(o, n)
+    opos, found = lookup_keys(okey, nkey)                  # new rows in old
+    _, kept = lookup_keys(nkey, okey)                      # old rows in new
+    changed = {c: n[c][found] for c in DIFF_KEYS}
+    differ = np.zeros(found.sum(), dtype=bool)
+    for field in fields:
+        a, b = (o[field][opos[found]], n[field][found],)
+        differ |= ~same_values(a, b)
+        changed[field + '_old'], changed[field + '_new'] = (a, b,)
+    
+    oa, na = (entities_attributes(o, attributes), entities_attributes(n, attributes),)
+    common = oa.index.intersection(na.index)
+    oa, na = (oa.loc[common], na.loc[common],)
+    same = np.ones(len(common), dtype=bool)
+    for attribute in attributes:
+        same &= same_values(oa[attribute].values, na[attribute].values)
+    
+    diff = {'old_last':         pd.Timestamp(o['dateRep'].max()),
+            'new_last':         pd.Timestamp(n['dateRep'].max()),
+            'added':            pd.DataFrame({c: n[c][~found] for c in DIFF_KEYS}),
+            'removed':          pd.DataFrame({c: o[c][~kept] for c in DIFF_KEYS}),
+            'changed':          pd.DataFrame(changed, columns=list(changed.keys()))[differ].reset_index(drop=True),
+            'new_entities':     na.index.difference(oa.index).to_list(),
+            'removed_entities': oa.index.difference(na.index).to_list(),
+            'changed_entities': common[~same].to_list(),
+           }
+    diff['appendable'] = (    list(old.columns) == list(new.columns)
+                          and diff['removed'].empty
+                          and diff['changed'].empty
+                          and not diff['new_entities']
+                          and not diff['changed_entities']
+                          and bool((diff['added']['dateRep'] > diff['old_last']).all()))
+    return diff
+
+
+def same_values(a, b):
+    '''element wise equality of two arrays, where nan equals nan'''
+    return (a == b) | (pd.isna(a) & pd.isna(b))
+
+
+def row_keys(*columns):
+    '''int64 keys of (geoId, dateRep) of some dicts of columns (i.e. {name: numpy array}), comparable among them'''
+    codes, _ = pd.factorize(np.concatenate([c['geoId'] for c in columns]))
+    days = np.concatenate([c['dateRep'].astype('datetime64[D]').astype(np.int64) for c in columns])
+    keys = (codes.astype(np.int64) << 32) + days                         # days from 1970: they fit in 32 bits
+    return np.split(keys, np.cumsum([len(c['geoId']) for c in columns])[:-1])
+
+
+def lookup_keys(keys, wanted):
+    '''positions in keys of the wanted ones, and a mask of the wanted that are found'''
+    if len(keys) == 0:
+        return (np.zeros(len(wanted), dtype=np.intp), np.zeros(len(wanted), dtype=bool),)
+    order = np.argsort(keys, kind='stable')
+    pos = np.minimum(np.searchsorted(keys[order], wanted), len(keys) - 1)
+    return (order[pos], keys[order][pos] == wanted,)
+
+
+def entities_attributes(columns, attributes):
+    '''attributes of entities from their first row (as the cube takes them), indexed by geoId'''
+    first = ~pd.Series(columns['geoId']).duplicated().values
+    return pd.DataFrame({c: columns[c][first] for c in attributes}, index=pd.Index(columns['geoId'][first], name='geoId'))
+
+
+def diff_report(diff, limit=10):
+    '''lines of text describing a diff (see diff_df); at most limit changed rows are listed'''
+    lines = ['last day: {:%Y-%m-%d} -> {:%Y-%m-%d}'.format(diff['old_last'], diff['new_last']),
+             'rows added: {}, removed: {}, changed: {}'.format(len(diff['added']), len(diff['removed']), len(diff['changed'])),
+            ]
+    for key in ('new_entities', 'removed_entities', 'changed_entities'):
+        if diff[key]:
+            lines.append('{}: {}'.format(key.replace('_', ' '), ', '.join(diff[key])))
+    for row in diff['changed'].head(limit).itertuples(index=False):
+        lines.append('    {} {:%Y-%m-%d}: {}'.format(row[0], row[1],
+                     ', '.join('{} {} -> {}'.format(f, row[2+2*n], row[3+2*n]) for n, f in enumerate(CUBE_FIELDS))))
+    if len(diff['changed']) > limit:
+        lines.append('    ... and other {} rows'.format(len(diff['changed']) - limit))
+    lines.append('new data only append days' if diff['appendable'] else 'past data changed')
+    return lines
+# END   differences between two versions of data
+
+
+# START process wide store of datasets
+class Dataset(object):
+    '''a shaped dataframe, loaded once and shared by all requests (and threads) of the process
+    
+    attributes
+        - df           pandas dataframe - shaped data, sorted by (geoId, dateRep);
+                           READ ONLY: it is shared, so who needs to modify it must work on a copy
+        - stamp        tuple - (mtime, size) of the file the dataframe comes from
+        - version      str - identifies this dataset; it changes when the file changes
+        - first        datetime.date - first date available in df
+        - last         datetime.date - last date available in df
+        - countries    int - count of countries in df
+        - cube         Cube - daily and cumulative data of df as dense arrays
+        - extended     bool - true if cube extends the cube of the previous dataset
+        - offsets      Offsets - rows of each nation in df
+        - ranking      Ranking - running totals of cube, to rank entities
+        - pages        dict - parts of pages that views build once for this dataset, e.g.
+                           {(locale, 'select'): choices}; they go away with the dataset
+    '''
+
+    def __init__(self, df, stamp, previous=None):
+        df = sort_rows(df)
+        self.df      = df
+        self.stamp   = stamp
+        self.version = '{:x}-{:x}'.format(*stamp)
+        self.first   = df['dateRep'].min().date()
+        self.last    = df['dateRep'].max().date()
+        self.countries = df['countriesAndTerritories'].nunique()
+        self.extended = previous is not None and previous.cube.appends(df)
+        if self.extended:
+            self.cube = previous.cube.extended(df)     # new days only: we don't rebuild the cube
+        else:
+            self.cube = Cube(df)
+        self.offsets = Offsets(df)
+        self.ranking = Ranking(self.cube)
+        self.pages   = dict()
+
+
+class DataStore(object):
+    '''process wide store of datasets, one for each data file
+    
+    remarks.
+        - it uses a dict {fname: Dataset} as a protected class attribute
+        - a dataset is reloaded only when (mtime, size) of its file change;
+              reading is lock free, loading is serialized by a lock
+        - a reloaded dataset extends the cube of the previous one, if
+              the new file only appends days (see Cube.appends)
+        - if the file is missing or unreadable (e.g. get_covid_data.sh is
+              downloading it) we keep serving the last good dataset
+    '''
+    
+    _datasets = dict()
+    _lock     = threading.Lock()
+    
+    @classmethod
+    def get(cls, fname, opener, shaper):
+        '''get the dataset of a file, loading it if it is new or changed
+        
+        params
+          - fname      str or Path - name of file to read
+          - opener     pandas method - method to use to read file
+          - shaper     function - to shape dataframe before to store it
+          
+        return ds          Dataset
+        '''
+        fname = str(fname)
+        ds = cls._datasets.get(fname, None)
+        try:
+            stamp = file_stamp(fname)
+        except OSError:
+            if ds is None:
+                raise
+            current_app.logger.warning('DataStore: cannot stat {}, using dataset {}'.format(fname, ds.version))
+            return ds
+        if ds is not None and ds.stamp == stamp:
+            return ds
+        
+        with cls._lock:
+            ds = cls._datasets.get(fname, None)    # meanwhile another thread could have loaded it
+            if ds is not None and ds.stamp == stamp:
+                return ds
+            try:
+                ds = Dataset(load_df(fname, opener, shaper, stamp), stamp, previous=ds)
+            except Exception as e:
+                if ds is None:
+                    raise
+                current_app.logger.error('DataStore: cannot load {} ({}), using dataset {}'.format(fname, e, ds.version))
+                return ds
+            cls._datasets[fname] = ds
+            current_app.logger.info('DataStore: loaded {} as dataset {}, {} cube'.format(
+                                    fname, ds.version, 'extended' if ds.extended else 'built'))
+        return ds
+    
+    @classmethod
+    def clear(cls):
+        '''forget all datasets'''
+        with cls._lock:
+            cls._datasets = dict()
+
+
+def file_stamp(fname):
+    '''return (mtime in ns, size in bytes) of a file'''
+    st = os.stat(fname)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def load_df(fname, opener, shaper, stamp=None):
+    '''load a shaped dataframe, preferring the binary snapshot of the file if it is up to date
+    
+    params
+      - fname      str or Path - name of file to read
+      - opener     pandas method - method to use to read file
+      - shaper     function - to shape dataframe before to return it
+      - stamp      tuple - (mtime, size) of fname; if None we get it
+      
+    return df          pandas dataframe
+    '''
+    if stamp is None:
+        stamp = file_stamp(fname)
+    df = read_snapshot(snapshot_name(fname), stamp, shaper.__name__)
+    if df is None:
+        df = shaper(opener(fname))
+    return df
+# END   process wide store of datasets
+
+
+# START binary snapshot of a shaped dataframe
+#     the snapshot of data file "x.csv" is the directory "x.csv.snapshot", with:
+#         - meta.json       format, stamp of the source file, shaper name, columns
+#         - nn.npy          a numpy array for every column:
+#                               object columns as categorical codes (categories are in meta.json),
+#                               integer columns as int32 if they fit, others as they are (e.g. datetime64)
+#     arrays are read in memory, not memory-mapped: text columns are decoded from their codes
+#     to object arrays, and the dataframe takes its own copy of numeric ones
+SNAPSHOT_EXT    = '.snapshot'
+SNAPSHOT_FORMAT = 1
+
+
+def snapshot_name(fname):
+    '''name of the snapshot directory of a data file'''
+    return str(fname) + SNAPSHOT_EXT
+
+
+def write_snapshot(df, sname, stamp, shaper_name):
+    '''write a shaped dataframe as a binary columnar snapshot
+    
+    params
+      - df             pandas dataframe - shaped data
+      - sname          str - name of the snapshot directory
+      - stamp          tuple - (mtime, size) of the source file
+      - shaper_name    str - name of the function used to shape df
+      
+    remark: we write in a temporary directory, then we replace the old snapshot
+    '''
+    tmp = '{}.tmp{}'.format(sname, os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    columns = []
+    for n, col in enumerate(df.columns):
+        c = {'name': col, 'file': '{:02d}.npy'.format(n)}
+        values = df[col].values
+        if values.dtype == object:
+            cat = pd.Categorical(df[col])                 # nan has code -1
+            c['categories'] = cat.categories.to_list()
+            values = cat.codes
+        elif np.issubdtype(values.dtype, np.integer) and len(values) > 0:
+            i32 = np.iinfo(np.int32)
+            if i32.min <= values.min() and values.max() <= i32.max:
+                values = values.astype(np.int32)
+        np.save(os.path.join(tmp, c['file']), values, allow_pickle=False)
+        columns.append(c)
+    meta = {'format':  SNAPSHOT_FORMAT,
+            'stamp':   list(stamp),
+            'shaper':  shaper_name,
+            'rows':    len(df),
+            'columns': columns,
+           }
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    shutil.rmtree(sname, ignore_errors=True)
+    os.rename(tmp, sname)
+
+
+def read_snapshot(sname, stamp, shaper_name):
+    '''read a shaped dataframe from its binary snapshot
+    
+    params
+      - sname          str - name of the snapshot directory
+      - stamp          tuple - (mtime, size) of the source file now
+      - shaper_name    str - name of the function that must have shaped data
+      
+    return df          pandas dataframe | None if snapshot is missing or out of date
+    
+    remark: text columns come back as object columns, as the shaper gives them,
+            not as categoricals: groupby and pivot_table of the queries keep their results
+    '''
+    try:
+        with open(os.path.join(sname, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (   meta.get('format') != SNAPSHOT_FORMAT
+        or tuple(meta.get('stamp', ())) != tuple(stamp)
+        or meta.get('shaper') != shaper_name):
+        return None
+    
+    data = dict()
+    for c in meta['columns']:
+        values = np.load(os.path.join(sname, c['file']), allow_pickle=False)
+        if 'categories' in c:
+            categories = np.array(c['categories'] + [np.nan], dtype=object)   # code -1 takes the last one: nan
+            values = categories[values]
+        data[c['name']] = values
+    return pd.DataFrame(data, columns=[c['name'] for c in meta['columns']])
+
+
+def snapshot_df(fname, opener=None, shaper=None):
+    '''shape a data file and write its binary snapshot
+    
+    params
+      - fname      str or Path - name of file to read
+      - opener     pandas method - method to use to read file; default pd.read_csv
+      - shaper     function - to shape dataframe; default world_shape
+      
+    return sname       str - name of the snapshot directory
+    '''
+    if opener is None: opener = pd.read_csv
+    if shaper is None: shaper = world_shape
+    stamp = file_stamp(fname)                  # before reading: if file changes meanwhile, snapshot will be out of date
+    df = shaper(opener(fname))
+    sname = snapshot_name(fname)
+    write_snapshot(df, sname, stamp, shaper.__name__)
+    return sname
+# END   binary snapshot of a shaped dataframe
+
+
 def open_df(fname, opener, shaper):
-    '''read a dataframe from file
+    '''get the dataframe of a file from the process wide DataStore
     
     params
       - fname      str or Path - name of file to read
@@ -816,26 +1918,23 @@ def open_df(fname, opener, shaper):
       
     return df          pandas dataframe
     
-    remark: The dataframe is unique for each request and will be reused
-            if this is called again
+    remark: The dataframe is shared among requests and threads, so it
+            is READ ONLY. In g we keep a reference to it (g.df) and to
+            its dataset (g.dataset)
     '''
     if 'df' not in g:
-        g.df = opener(fname)
-        g.df = shaper(g.df)
-    #else:
-    #    pass
+        g.dataset = DataStore.get(fname, opener, shaper)
+        g.df = g.dataset.df
     return g.df
 
 
 def close_df(e=None):
-    """If this request connected to the dataframe, close the connection
+    """Release the references of this request to the shared dataframe
     
     params: e        error
     """
-    df = g.pop("df", None)
-
-    if df is not None:
-        del df
+    g.pop('dataset', None)
+    g.pop('df', None)
 
 
 def init_app(app):
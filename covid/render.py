@@ -0,0 +1,221 @@
+# :filename: covid/render.py
+#   drawing of charts: in the process of the request or, optionally, in a pool
+#   of worker processes, with matplotlib already imported and warm
+#
+# remark: here we do not use flask; a chart is drawn from its spec, a dict of
+#         numbers and already translated strings, so a worker can draw it
+
+# std libs import
+from concurrent.futures          import ProcessPoolExecutor
+from concurrent.futures          import TimeoutError as FutureTimeoutError
+from concurrent.futures.process  import BrokenProcessPool
+from io                          import BytesIO, StringIO
+import multiprocessing
+import threading
+
+# 3rd parties libs import
+from matplotlib.figure import Figure
+import matplotlib.pyplot as plt
+
+
+RENDER_PROCESSES = 0      # default count of worker processes, 0 to draw in the process of the request; config: RENDER_PROCESSES
+RENDER_TIMEOUT   = 30     # default seconds to wait for a chart from the workers; config: RENDER_TIMEOUT
+RENDER_QUEUE     = 16     # default max count of charts waiting for the workers; config: RENDER_QUEUE
+
+
+class Busy(Exception):
+    '''the pool can not draw the chart now: too many charts are waiting, or
+       the chart did not come in time, or a worker died'''
+    pass
+
+
+# START drawing a chart from its spec
+def draw_lines(ax, lines, num_colors):
+    '''draw lines on ax, with a color for every country
+
+    params
+        - ax            matplotlib axes
+        - lines         list of (x, y, line type, label)
+        - num_colors    int - how many colors we need: the countries
+    '''
+    # ldfa,2020-10-03 how going over 20 colors (needed to represent EU: 26 countries), see:
+    # https://stackoverflow.com/questions/8389636/creating-over-20-unique-legend-colors-using-matplotlib
+    # and here colormaps examples:
+    # https://matplotlib.org/examples/color/colormaps_reference.html
+    cm = plt.get_cmap('tab20')     # color map to use: max 20 countries
+    ax.set_prop_cycle(color=[cm(1.*i/num_colors) for i in range(num_colors)])
+    for x, y, ltype, label in lines:
+        ax.plot(x, y, ltype, label=label)
+
+
+def draw_chart(spec, fmt='svg'):
+    '''draw a chart
+
+    params
+        - spec          dict - with:
+            - lines, lines2             list of (x, y, line type, label) - of the upper and of
+                                            the lower (delta fields) axes; lines2 is None
+                                            without delta fields
+            - num_colors                int - countries
+            - title, ylabel, y2label, xlabel
+                                        str - already translated
+            - xlabelrot                 int - rotation of labels of x axis
+        - fmt           str - svg | png
+
+    return image       str - the svg document | bytes - the png image
+    '''
+    fig = Figure(figsize=(9,7))
+
+    if spec['lines2'] is None:                                 # without delta fields
+        ax = fig.subplots()
+    else:
+        ax = fig.add_axes([0.1,0.35,0.8,0.6])  # left, bottom, width, height
+        ax2 = fig.add_axes([0.1,0.20,0.8,0.15], sharex=ax)
+
+    draw_lines(ax, spec['lines'], spec['num_colors'])
+    ax.grid(True, linestyle='--')
+    ax.legend()
+    ax.set_title (spec['title'])
+    ax.set_ylabel(spec['ylabel'])
+    if spec['lines2'] is None:
+        ax.tick_params(axis='x', labelrotation=spec['xlabelrot'])
+        ax.set_xlabel(spec['xlabel'])
+        fig.subplots_adjust(bottom=0.2)
+    else:
+        draw_lines(ax2, spec['lines2'], spec['num_colors'])
+        ax2.set_ylabel(spec['y2label'])
+        ax2.tick_params(axis='x', labelrotation=spec['xlabelrot'])
+        ax2.grid(True, linestyle='--')
+        ax2.legend()
+        ax2.set_xlabel(spec['xlabel'])
+
+    # Save it to a temporary buffer.
+    if fmt == 'png':
+        buf = BytesIO()
+        fig.savefig(buf, format="png")
+    else:
+        buf = StringIO()
+        fig.savefig(buf, format="svg")
+    return buf.getvalue()
+
+
+def warm():
+    '''prepare a worker: matplotlib is imported and its fonts are cached by drawing a chart'''
+    spec = {'lines': [([0, 1], [0, 1], '-', 'warm')], 'lines2': None, 'num_colors': 1,
+            'title': 'warm', 'ylabel': 'warm', 'y2label': 'warm', 'xlabel': 'warm', 'xlabelrot': 80, }
+    draw_chart(spec, 'svg')
+    draw_chart(spec, 'png')
+# END   drawing a chart from its spec
+
+
+# START pool of worker processes
+class RenderPool(object):
+    '''a pool of worker processes drawing charts; the thread of a request
+       waits for its chart without holding the GIL
+
+    attributes
+        - processes      int - count of worker processes; 0 to draw in the process of the request
+        - timeout        number - seconds to wait for a chart
+        - queue          int - max count of charts waiting for the workers (drawn ones included)
+        - pending        int - count of jobs submitted and not yet finished: charts, even the
+                             ones out of time, and the warm up of the workers
+
+    remarks:
+        - the workers start at the first chart, in the process that draws it,
+              i.e. after a WSGI server forks its workers; they are spawned,
+              not forked, because the process of a request has threads
+        - configure changes the pool only when its parameters change; it is
+              meant to be called once, at application setup (see views.init_app)
+    '''
+
+    def __init__(self, processes=RENDER_PROCESSES, timeout=RENDER_TIMEOUT, queue=RENDER_QUEUE):
+        self.processes = processes
+        self.timeout   = timeout
+        self.queue     = queue
+        self._waiting  = set()     # futures not finished yet
+        self._executor = None
+        self._lock     = threading.Lock()
+
+    @property
+    def pending(self):
+        return len(self._waiting)
+
+    def configure(self, processes, timeout, queue):
+        '''set the parameters; a new count of processes replaces the workers'''
+        with self._lock:
+            self.timeout = timeout
+            self.queue   = queue
+            if processes != self.processes:
+                self.processes = processes
+                self._shutdown()
+
+    def draw(self, spec, fmt='svg'):
+        '''draw a chart, in a worker if we have them
+
+        params: as draw_chart ones
+
+        return image       as draw_chart one
+
+        remark: raise Busy if too many charts are waiting, if the chart does not come
+                in time, or if a worker died (the pool restarts at the next chart)
+        '''
+        if self.processes <= 0:
+            return draw_chart(spec, fmt)
+        with self._lock:
+            if self.pending >= self.queue:
+                raise Busy('{} charts are waiting'.format(self.pending))
+            warming = self._start() if self._executor is None else []
+            executor = self._executor
+            try:
+                future = executor.submit(draw_chart, spec, fmt)
+            except (BrokenProcessPool, RuntimeError):          # broken, or shut down
+                future = None
+            else:
+                self._waiting.add(future)
+        for job in warming + [future]:                         # out of the lock: a finished job calls back at once
+            if job is not None:
+                job.add_done_callback(self._done)
+        if future is None:
+            self._broken(executor)
+            raise Busy('the pool is broken')
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()                                    # if it is running, it is pending until it is drawn
+            raise Busy('chart not drawn in {} seconds'.format(self.timeout))
+        except BrokenProcessPool:
+            self._broken(executor)
+            raise Busy('the pool is broken')
+
+    def shutdown(self):
+        '''stop the workers; they start again at the next chart'''
+        with self._lock:
+            self._shutdown()
+
+    def _start(self):
+        '''start the workers, with the lock held; return the futures of their warm up'''
+        self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                             mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=warm)
+        warming = [self._executor.submit(int) for n in range(self.processes)]   # workers start (and warm up) now, not at the first charts
+        self._waiting.update(warming)
+        return warming
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _done(self, future):
+        '''a job finished: drawn, failed or cancelled'''
+        with self._lock:
+            self._waiting.discard(future)
+
+    def _broken(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+
+
+RENDERER = RenderPool()     # of this process
+# END   pool of worker processes
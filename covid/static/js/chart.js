@@ -0,0 +1,192 @@
+// :filename: covid/static/js/chart.js
+//   draws in the browser the chart of draw_graph, from its json data
+//   (see views.chart_json): the server does numeric work only
+//
+// to use: an element <div class="covid-chart" data-chart-url="url of json data"
+//   data-chart-error="already translated message if the chart is not available">
+//   becomes an <svg> chart, laid out as the one matplotlib draws on the server
+
+(function () {
+    'use strict';
+
+    var SVGNS  = 'http://www.w3.org/2000/svg';
+    var WIDTH  = 900;                          // as figsize=(9,7) at 100 dpi
+    var HEIGHT = 700;
+    var DASHES = {'-': '', '--': '6,3', '-.': '6,3,1,3', ':': '1,3'};
+    var DAY    = 86400000;                     // ms: dates of data are at midnight UTC
+    // tab20 colormap, as the server uses it: color i of n is TAB20[floor(20*i/n)]
+    var TAB20  = ['#1f77b4', '#aec7e8', '#ff7f0e', '#ffbb78', '#2ca02c', '#98df8a', '#d62728', '#ff9896',
+                  '#9467bd', '#c5b0d5', '#8c564b', '#c49c94', '#e377c2', '#f7b6d2', '#7f7f7f', '#c7c7c7',
+                  '#bcbd22', '#dbdb8d', '#17becf', '#9edae5'];
+
+    function color(i, n) {
+        return TAB20[Math.min(19, Math.floor(20 * i / n))];
+    }
+
+    function node(parent, name, attributes, text) {
+        var element = document.createElementNS(SVGNS, name);
+        for (var key in attributes) {
+            element.setAttribute(key, attributes[key]);
+        }
+        if (text !== undefined) {
+            element.textContent = text;
+        }
+        parent.appendChild(element);
+        return element;
+    }
+
+    // about 5 round steps from lo to hi
+    function ticks(lo, hi, count) {
+        if (!(hi > lo)) {
+            return [lo];
+        }
+        var step = Math.pow(10, Math.floor(Math.log(hi - lo) / Math.LN10));
+        var err = count * step / (hi - lo);
+        if (err <= 0.15) { step *= 10; } else if (err <= 0.35) { step *= 5; } else if (err <= 0.75) { step *= 2; }
+        var result = [];
+        for (var v = Math.ceil(lo / step) * step; v <= hi + step * 1e-9; v += step) {
+            result.push(Math.abs(v) < step * 1e-9 ? 0 : v);
+        }
+        return result;
+    }
+
+    // about count dates from lo to hi (ms), in steps of whole days: 1, 2, 7, 14, 28, 56 ...
+    function day_ticks(lo, hi, count) {
+        var days = (hi - lo) / DAY, step = 1;
+        [1, 2, 7, 14, 28].some(function (s) { step = s; return days / s <= count; });
+        while (days / step > count) { step *= 2; }
+        var result = [];
+        for (var d = Math.ceil(lo / DAY); d * DAY <= hi; d += step) {
+            result.push(d * DAY);
+        }
+        return result;
+    }
+
+    function label(v) {
+        var a = Math.abs(v);
+        if (a !== 0 && (a < 1e-3 || a >= 1e7)) {
+            return v.toExponential(1);
+        }
+        return String(Math.round(v * 1e6) / 1e6);
+    }
+
+    // axes in a box of the figure: [left, bottom, width, height] as fractions, as matplotlib add_axes
+    function axes(svg, box, xs, lines, options) {
+        var left = box[0] * WIDTH, top = (1 - box[1] - box[3]) * HEIGHT;
+        var width = box[2] * WIDTH, height = box[3] * HEIGHT;
+        var ymin = Infinity, ymax = -Infinity;
+        lines.forEach(function (line) {
+            line.y.forEach(function (v) {
+                if (v !== null) { ymin = Math.min(ymin, v); ymax = Math.max(ymax, v); }
+            });
+        });
+        if (ymin === Infinity) { ymin = 0; ymax = 1; }
+        var margin = (ymax - ymin) * 0.05 || 1;
+        ymin -= margin; ymax += margin;
+        var xmin = xs[0], xmax = xs[xs.length - 1];
+        var xmargin = (xmax - xmin) * 0.05 || 1;
+        xmin -= xmargin; xmax += xmargin;
+        function px(v) { return left + (v - xmin) / (xmax - xmin) * width; }
+        function py(v) { return top + (ymax - v) / (ymax - ymin) * height; }
+
+        var g = node(svg, 'g', {'font-family': 'sans-serif', 'font-size': '10'});
+        node(g, 'rect', {x: left, y: top, width: width, height: height, fill: 'white', stroke: 'black'});
+
+        // grid and ticks
+        ticks(ymin, ymax, 5).forEach(function (v) {
+            node(g, 'line', {x1: left, x2: left + width, y1: py(v), y2: py(v), stroke: '#b0b0b0', 'stroke-dasharray': '4,2'});
+            node(g, 'text', {x: left - 4, y: py(v) + 3, 'text-anchor': 'end'}, label(v));
+        });
+        (options.dates ? day_ticks : ticks)(xs[0], xs[xs.length - 1], 8).forEach(function (v) {
+            node(g, 'line', {x1: px(v), x2: px(v), y1: top, y2: top + height, stroke: '#b0b0b0', 'stroke-dasharray': '4,2'});
+            if (options.xticks) {
+                var text = options.dates ? new Date(v).toISOString().slice(0, 10) : label(v);
+                node(g, 'text', {x: px(v), y: top + height + 12, 'text-anchor': 'end',
+                                 transform: 'rotate(-' + options.xlabelrot + ' ' + px(v) + ' ' + (top + height + 12) + ')'}, text);
+            }
+        });
+
+        // lines: a gap where there are no data, colors cycle as in matplotlib
+        var clip = 'clip' + Math.random().toString(36).slice(2);
+        node(node(g, 'clipPath', {id: clip}), 'rect', {x: left, y: top, width: width, height: height});
+        lines.forEach(function (line, n) {
+            var d = '', pen = 'M';
+            line.y.forEach(function (v, i) {
+                if (v === null) { pen = 'M'; return; }
+                d += pen + px(xs[i]).toFixed(1) + ' ' + py(v).toFixed(1);
+                pen = 'L';
+            });
+            line.color = color(n % options.num_colors, options.num_colors);
+            node(g, 'path', {d: d, fill: 'none', stroke: line.color, 'stroke-width': 1.5,
+                             'stroke-dasharray': DASHES[line.ltype] || '', 'clip-path': 'url(#' + clip + ')'});
+        });
+
+        // legend
+        if (lines.length) {
+            var lg = node(g, 'g', {});
+            var rows = lines.length, lh = 13;
+            var box_ = node(lg, 'rect', {x: left + 6, y: top + 6, width: 10, height: rows * lh + 6,
+                                         fill: 'white', 'fill-opacity': 0.8, stroke: '#cccccc'});
+            var widest = 0;
+            lines.forEach(function (line, n) {
+                var y = top + 12 + n * lh;
+                node(lg, 'line', {x1: left + 10, x2: left + 30, y1: y, y2: y, stroke: line.color, 'stroke-width': 1.5,
+                                  'stroke-dasharray': DASHES[line.ltype] || ''});
+                node(lg, 'text', {x: left + 34, y: y + 3}, line.label);
+                widest = Math.max(widest, line.label.length * 5.5);
+            });
+            box_.setAttribute('width', widest + 34);
+        }
+
+        if (options.title) {
+            node(g, 'text', {x: left + width / 2, y: top - 8, 'text-anchor': 'middle', 'font-size': '12'}, options.title);
+        }
+        node(g, 'text', {x: left - 45, y: top + height / 2, 'text-anchor': 'middle',
+                         transform: 'rotate(-90 ' + (left - 45) + ' ' + (top + height / 2) + ')'}, options.ylabel);
+        if (options.xlabel) {
+            node(g, 'text', {x: left + width / 2, y: top + height + 80, 'text-anchor': 'middle'}, options.xlabel);
+        }
+    }
+
+    function draw(element, data) {
+        var dates = data.x.length && typeof data.x[0] === 'string';
+        var xs = data.x.map(function (v) { return dates ? Date.parse(v) : v; });
+        var svg = document.createElementNS(SVGNS, 'svg');
+        svg.setAttribute('viewBox', '0 0 ' + WIDTH + ' ' + HEIGHT);
+        svg.setAttribute('width', '100%');
+        var options = {dates: dates, num_colors: data.num_colors, xlabelrot: data.xlabelrot, title: data.title};
+        if (data.lines2 === null) {
+            axes(svg, [0.125, 0.2, 0.775, 0.68], xs, data.lines,
+                 Object.assign({ylabel: data.ylabel, xlabel: data.xlabel, xticks: true}, options));
+        } else {
+            axes(svg, [0.1, 0.35, 0.8, 0.6], xs, data.lines,
+                 Object.assign({ylabel: data.ylabel, xticks: false}, options));
+            options.title = null;
+            axes(svg, [0.1, 0.20, 0.8, 0.15], xs, data.lines2,
+                 Object.assign({ylabel: data.y2label, xlabel: data.xlabel, xticks: true}, options));
+        }
+        element.innerHTML = '';
+        element.appendChild(svg);
+    }
+
+    function load(element) {
+        var request = new XMLHttpRequest();
+        request.open('GET', element.getAttribute('data-chart-url'));
+        request.responseType = 'json';
+        request.onload = function () {
+            if (request.status === 200 && request.response) {
+                draw(element, request.response);
+            } else {
+                element.textContent = element.getAttribute('data-chart-error') + ' (' + request.status + ')';
+            }
+        };
+        request.send();
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        var elements = document.querySelectorAll('.covid-chart[data-chart-url]');
+        for (var i = 0; i < elements.length; i++) {
+            load(elements[i]);
+        }
+    });
+})();
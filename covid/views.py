@@ -5,29 +5,31 @@
 #          #<      make attention; probably: remove this line
 
 # std libs import
-from datetime import datetime, date, timedelta
-from io       import StringIO
-from math     import ceil
+from collections import OrderedDict
+from datetime    import datetime, date, timedelta
+from math        import ceil
+import hashlib
+import json
+import sys
+import threading
 
 # 3rd parties libs import
 from flask import (
     Blueprint, flash, g, redirect, render_template, request, url_for,
-    current_app
+    current_app, Response
 )
 from werkzeug.exceptions import abort
 from flask_babel import _
 from flask_babel import lazy_gettext as _l
 from flask_babel import get_locale
-from matplotlib.figure import Figure
-import matplotlib.pyplot as plt
 
-import bs4    as bs
 import numpy  as np
 import pandas as pd
 
 # application libs import
 from . import models
 from . import forms
+from . import render
 
 
 bp = Blueprint('views', __name__)
@@ -53,6 +55,126 @@ FIRST     = ''     # this placeholder to register the 1st day available ...
 LAST      = ''     #   ... and this to hold the last day available
 POP_FIELD = ''     # placeholder to register the population field name
 EU_NUM = 10        # placehoder
+GRAPH_CACHE_BYTES = 64 * 2**20   # default size limit of the cache of graphs; config: GRAPH_CACHE_BYTES
+CHART_MAX_AGE     = 3600         # default seconds a client can keep a chart; config: CHART_MAX_AGE
+CHART_MIMETYPES   = {'svg': 'image/svg+xml', 'png': 'image/png', 'json': 'application/json', }
+CHART_MODES       = ('server', 'client', )   # who draws the chart of draw_graph: the first one is the default; config: CHART_MODE
+LAZY_ENTITIES     = 15           # default count of entities from which we fold them one at a time; config: LAZY_ENTITIES
+
+
+# START cache of rendered graphs
+class LRUCache(object):
+    '''a thread safe cache, bounded by the size of its items; when it is
+       full, it drops the least recently used ones
+    
+    attributes
+        - max_bytes      int - limit to the sum of the sizes of items
+        - size           int - actual sum of the sizes of items
+        - hits           int - count of get finding the key ...
+        - misses         int - ... and of get not finding it
+    '''
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size      = 0
+        self.hits      = 0
+        self.misses    = 0
+        self._items    = OrderedDict()        # {key: (value, size)}, from the least to the most recently used
+        self._lock     = threading.Lock()
+    
+    def get(self, key, default=None):
+        '''get the value of a key, marking it as the most recently used'''
+        with self._lock:
+            item = self._items.get(key, None)
+            if item is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+    
+    def put(self, key, value, size=0):
+        '''store a value, dropping the least recently used ones if we exceed max_bytes
+        
+        return bool        False if the value alone exceeds max_bytes (and it is not stored)
+        '''
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if size > self.max_bytes:
+                return False
+            self._items[key] = (value, size)
+            self.size += size
+            self._evict()
+            return True
+    
+    def resize(self, max_bytes):
+        '''change the limit, dropping the least recently used items if we exceed it'''
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+    
+    def clear(self):
+        '''drop all items, counters included'''
+        with self._lock:
+            self._items = OrderedDict()
+            self.size, self.hits, self.misses = (0, 0, 0,)
+    
+    def stats(self):
+        '''counters as a dict'''
+        return {'items': len(self._items), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def _evict(self):
+        while self.size > self.max_bytes:
+            _key, (_value, _size) = self._items.popitem(last=False)
+            self.size -= _size
+
+
+def payload_size(value):
+    '''size in bytes of what a value holds: strings by their utf-8 length, bytes by their
+       length, containers by the sizes of their items (and keys), dataframes by their
+       deep memory usage, other objects by sys.getsizeof
+    
+    remarks:
+        - sys.getsizeof of a container does not count its items
+        - an object referred twice is counted twice, as a dataframe and its QueryResult
+              in build_data ones: the size is an upper bound
+    '''
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum([payload_size(k) + payload_size(v) for k, v in value.items()])
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum([payload_size(v) for v in value])
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(index=True, deep=True)))
+    if isinstance(value, (QueryResult, LazyResult)):
+        return value.nbytes()
+    return sys.getsizeof(value)
+
+
+GRAPHS = LRUCache(GRAPH_CACHE_BYTES)     # {(dataset version, locale, 'page' | format | 'data', draw_graph parameters): page parts | image | data}
+# END   cache of rendered graphs
+
+
+def init_app(app):
+    '''configure the cache of graphs and the pool drawing charts. This is called by
+       the application factory.
+    
+    remark: both are shared by all requests (and threads) of the process, so they are
+            configured once, here, not while requests are using them
+    '''
+    GRAPHS.resize(app.config.get('GRAPH_CACHE_BYTES', GRAPH_CACHE_BYTES))
+    render.RENDERER.configure(app.config.get('RENDER_PROCESSES', render.RENDER_PROCESSES),
+                              app.config.get('RENDER_TIMEOUT', render.RENDER_TIMEOUT),
+                              app.config.get('RENDER_QUEUE', render.RENDER_QUEUE))
+
 
 @bp.before_request
 def before_request():
@@ -63,20 +185,20 @@ def before_request():
     global EU_NUM
     current_app.logger.debug('> before_request()')
     g.locale = str(get_locale())
-    df = models.open_df(current_app.config['DATA_DIR']+'/'+current_app.config['DATA_FILE'],
-                        pd.read_csv,
-                        models.world_shape)                     # stores dataframe in g.df
-    FIRST, LAST = (df['dateRep'].min(), df['dateRep'].max(),)
+    models.open_df(current_app.config['DATA_DIR']+'/'+current_app.config['DATA_FILE'],
+                   pd.read_csv,
+                   models.world_shape)                     # stores shared dataframe in g.df, its dataset in g.dataset
+    FIRST, LAST = (g.dataset.first, g.dataset.last,)
     #g.nations = models.Nations(dataframe=df)  # - ldfa, 2020-10-01 passing to models.GeoEntities
-    g.first_date = df['dateRep'].min()
-    g.last_date = df['dateRep'].max()
+    g.first_date = g.dataset.first
+    g.last_date = g.dataset.last
     POP_FIELD = current_app.config['POP_FIELD'][:]
     EU_NUM = current_app.config['EU_NUM']
 
 
 @bp.teardown_request
 def teardown_request(error=None):
-    '''close data after request
+    '''release data after request
     
     params: error         error - use str(error) to print
     '''
@@ -95,7 +217,7 @@ def index():
     
     fname = 'select'
     current_app.logger.debug('> {}()'.format(fname))
-    how_many = g.df['countriesAndTerritories'].drop_duplicates().count()
+    how_many = g.dataset.countries                         # counted once, when the dataset is loaded
     
     return render_template('index.html', 
                            title=_("Covid: time trend analysis"), 
@@ -116,38 +238,15 @@ def select():
     
     form = forms.SelectForm()
     
-    # builds MAIN fields selection, i.e. [(1, 'cases',), ...]
-    mkeys = forms.list_delta_fields(direct=False)
-    form.mfields.choices = list(zip([forms.FIELDS[key]['id'] for key in mkeys], mkeys))
-
-    # builds SECONDARY fields selection, i.e. [(1, 'cases',), ...]
-    skeys = forms.list_delta_fields(direct=True)
-    form.sfields.choices = list(zip([forms.FIELDS[key]['id'] for key in skeys], skeys))
-    
-    #form.fields.default = ['1',] # to set a default, this does not work;
-                                  #    we use the "default" parameter in the class;
-                                  #    alternatively we can set data (see below)
-    
-    #form.context.choices = [('nations','nations',), ('continents', 'continents',),]
-    form.context.choices = list(zip(models.CONTEXT_SELECT, models.CONTEXT_SELECT))
-    
-    # builds continents selection: [('Africa', 'Africa',), ...] + [('North_America', 'North America',), ...]
-    # - ldfa,2020.09.25 using models.GeoEntities instead of g.nations
-    #form.continents.choices = [ (c, c, ) for c in g.nations.keys()]
-    #form.continents.choices.extend( [ (c, c, ) for c in models.AREAS.keys() if models.AREAS[c]['context']=='continents'] )
-    n = models.GeoEntities(attribute='type', value='nation')             # countries
-    c = models.GeoEntities(attribute='type', value='continent')             # continents
-    form.continents.choices = list(c.get_list_of_keys_names())
-    form.continents.choices.sort(key=lambda x: x[1])                           # sort by name
-    continents = [continent for continent in c.get_entities_att('name').values()]       # this is used in render_template
-    nations    = [country for country in n.get_entities_att('name').values()]       # this is used in render_template
-    
-    # - ldfa,2020.09.25 using models.GeoEntities instead of g.nations
-    #form.countries.choices = g.nations.get_for_select()
-    #form.countries.choices.extend( [ (v['geoId'], c, ) for c, v in models.AREAS.items() if models.AREAS[c]['context']=='nations'] )
-    n = models.GeoEntities(attribute='type', value='nation')             # nations
-    form.countries.choices = list(n.get_list_of_keys_names())
-    form.countries.choices.sort(key=lambda x: x[1])            # sort by name
+    # choices of fields, context, continents and countries are built once per dataset version and locale
+    choices = select_choices()
+    form.mfields.choices    = choices['mfields']
+    form.sfields.choices    = choices['sfields']
+    form.context.choices    = choices['context']
+    form.continents.choices = choices['continents']
+    form.countries.choices  = choices['countries']
+    continents = choices['continents_names']               # this is used in render_template
+    nations    = choices['nations_names']                  # this is used in render_template
 
     if request.method=='POST':
         time_range1 = forms.Range(FIRST, LAST)   #+- ldfa fix bug #2 initializing TimeRange for POST
@@ -217,13 +316,22 @@ def select():
     #form.process()
     
     
+    # the countries picker is the biggest part of page: without selections or errors, it is always the same
+    countries_picker = None
+    if not form.countries.data and not form.countries.errors:
+        key = (g.locale, 'countries_picker')
+        countries_picker = g.dataset.pages.get(key)
+        if countries_picker is None:
+            countries_picker = g.dataset.pages.setdefault(key, render_template('select_countries.html', form=form))
+    
     return render_template('select.html', 
                            title=_('Select country'), 
                            main_fields=forms.dict_delta_fields(direct=False),
                            secondary_fields=forms.dict_delta_fields(direct=True),
                            form=form,
                            nations=nations,
-                           continents=continents
+                           continents=continents,
+                           countries_picker=countries_picker
                           )
 
 @bp.route('/other_select', methods=['GET', 'POST'])
@@ -240,13 +348,10 @@ def other_select():
     form = forms.OtherSelectForm()
     
     #form.fields.choices = list(zip([forms.FIELDS[key]['id'] for key in forms.FIELDS.keys()], forms.FIELDS.keys()))
-    # builds MAIN fields selection, i.e. [(1, 'cases',), ...]
-    mkeys = forms.list_delta_fields(direct=False)
-    form.mfields.choices = list(zip([forms.FIELDS[key]['id'] for key in mkeys], mkeys))
-
-    # builds SECONDARY fields selection, i.e. [(1, 'cases',), ...]
-    skeys = forms.list_delta_fields(direct=True)
-    form.sfields.choices = list(zip([forms.FIELDS[key]['id'] for key in skeys], skeys))
+    # MAIN and SECONDARY fields selection, i.e. [(1, 'cases',), ...], built once per dataset version and locale
+    choices = select_choices()
+    form.mfields.choices = choices['mfields']
+    form.sfields.choices = choices['sfields']
     
     form.query.choices = forms.OTHER_CHOICES
     
@@ -302,7 +407,9 @@ def other_select():
             # get from n1 to n2 worst nations in World and redirect query to nations/...
             n1 = form.n1.data
             n2 = form.n2.data
-            idsl = models.worst_countries(g.df, all_columns[0], idsl, n1, n2, normalize=normalize)
+            idsl = models.worst_countries(g.df, all_columns[0], idsl, n1, n2, normalize=normalize,
+                                          first=None if remember else first, last=last,   # worst in what we are going to draw
+                                          ranking=g.dataset.ranking)
             ids = '-'.join(idsl)
             return redirect(url_for('views.draw_graph',
                                     context='nations',
@@ -361,7 +468,37 @@ def other_select():
                           )
 
 
-def query_patterns(df, context, ids, first=None, last=None, remember=False):
+def select_choices():
+    '''choices of the select forms, built once per dataset version and locale
+    
+    return choices     dict - with lists of (value, label) pairs:
+                           'mfields', 'sfields', 'context', 'continents' and 'countries' (sorted by name);
+                           and lists of names: 'continents_names', 'nations_names'
+    
+    remark: they are kept in the dataset (see models.Dataset.pages) and shared among
+            requests, so they are READ ONLY
+    '''
+    key = (g.locale, 'select')
+    choices = g.dataset.pages.get(key)
+    if choices is not None:
+        return choices
+    
+    mkeys = forms.list_delta_fields(direct=False)                       # MAIN fields, i.e. [(1, 'cases',), ...]
+    skeys = forms.list_delta_fields(direct=True)                        # SECONDARY fields
+    n = models.GeoEntities(attribute='type', value='nation')            # nations
+    c = models.GeoEntities(attribute='type', value='continent')         # continents
+    choices = {'mfields':          list(zip([forms.FIELDS[key]['id'] for key in mkeys], mkeys)),
+               'sfields':          list(zip([forms.FIELDS[key]['id'] for key in skeys], skeys)),
+               'context':          list(zip(models.CONTEXT_SELECT, models.CONTEXT_SELECT)),
+               'continents':       sorted(c.get_list_of_keys_names(), key=lambda x: x[1]),     # sort by name
+               'countries':        sorted(n.get_list_of_keys_names(), key=lambda x: x[1]),     # sort by name
+               'continents_names': list(c.get_entities_att('name').values()),
+               'nations_names':    list(n.get_entities_att('name').values()),
+              }
+    return g.dataset.pages.setdefault(key, choices)
+
+
+def query_patterns(df, context, ids, first=None, last=None, remember=False, cube=None, offsets=None):
     '''implements models.py query patterns
     
     parameters:
@@ -372,6 +509,9 @@ def query_patterns(df, context, ids, first=None, last=None, remember=False):
                               e.g. 'AF-AL-AT-EU' or 'Asia-North_America'
         - first         date - left of date interval
         - last          date - right of date interval
+        - cube          models.Cube - of df; if it has all ids, rows come from it
+        - offsets       models.Offsets - of df; otherwise rows come from them, without
+                              scanning all rows of df
     
     returns:
         - ndf           pandas dataframe - with (only) requested rows
@@ -400,8 +540,14 @@ def query_patterns(df, context, ids, first=None, last=None, remember=False):
     
     # list of ids of countries or continents
     l_ids = ids.split('-')
+    if cube is not None and cube.covers(l_ids):       # areas and continents are already in the cube
+        return cube.rows(l_ids, first, last, remember)
     areas = models.get_areas(l_ids)
     not_areas = list(set(l_ids) - set(areas))
+    if context=='nations' and offsets is not None:   # only rows of the requested nations and of nations of areas
+        members = [n for area in areas for n in (models.GeoEntities.get_entity_att(area, 'nations') or ())]
+        df = models.subset_rows_by_nations(df, not_areas + members, offsets=offsets)
+        offsets = None                               # they are not the ones of this new df
     
     # in all patterns: 1 & 2 ...
     #     ... get all records in dates interval (note: here we modify globally g.df)
@@ -416,23 +562,20 @@ def query_patterns(df, context, ids, first=None, last=None, remember=False):
     else:
         if first is None: first = df['dateRep'].min()
         if last  is None: last  = df['dateRep'].max()
-        ddf = models.select_rows_by_dates(df, first, last, remember)
+        ddf = models.select_rows_by_dates(df, first, last, remember, offsets=offsets)
     
-    #     ... this creates rows for areas as 'nations' or 'continents' depending on context
-    df_areas = models.create_rows_by_areas(ddf, areas, context, pop_field=POP_FIELD)
-
     # query pattern 1: nations + areas + date ...
-    #     ... date filter & create rows by area already applied
+    #     ... date filter already applied, this creates rows for areas
     if context=='nations':
+        df_areas = models.create_rows_by_areas(ddf, areas, context, pop_field=POP_FIELD)
         df_not_areas = models.subset_rows_by_nations(ddf, not_areas)
+        ndf = pd.concat([df_not_areas, df_areas])
     
     # query pattern 2: continents + subcontinents (alias: areas) + date ...
-    #     ... date filter & create rows by area  already applied
+    #     ... date filter already applied, this creates rows for continents and areas in one pass
     else:
-        df_not_areas = models.create_rows_by_continents(ddf, not_areas, pop_field=POP_FIELD)
-    
-    # in all patterns: 1 & 2, concatenate results 
-    ndf = pd.concat([df_not_areas, df_areas])
+        groups = models.continents_groups(ddf, not_areas, pop_field=POP_FIELD) + models.areas_groups(areas)
+        ndf = models.aggregate_rows(ddf, groups, pop_field=POP_FIELD)
     
     return ndf
 
@@ -456,11 +599,113 @@ def draw_graph(context, ids, fields='cases', normalize=False, overlap=False, fir
         - draw continents cases
         - draw continents deaths
         - N.A. draw normalized values
+    
+    remarks:
+        - the image is not in the page, it is got from draw_chart
+        - the query argument chart=server|client chooses who draws it: the server, as
+              svg, or the browser (static/js/chart.js), from its json data; default
+              is CHART_MODE (config)
        '''
 
     fname = 'draw_graph'
     current_app.logger.debug('{}({}, {}, {}, {}, {}, {}, {})'.format(fname, context, ids, fields, normalize, overlap, first, last))
     
+    kwargs = graph_params(context, ids, fields, normalize, overlap, first, last, remember)   # args to return here
+    
+    # the page depends only on data (their version), language (of labels) and parameters
+    key = (g.dataset.version, g.locale, 'page',) + tuple(kwargs.values())
+    graph = GRAPHS.get(key)
+    if graph is None:
+        data_key, data = query_data(kwargs)
+        graph = build_graph(data, kwargs['normalize'])
+        GRAPHS.put(key, graph, size=payload_size(graph))
+        GRAPHS.put(data_key, data, size=payload_size(data))   # for the image request, sized after the tables used them
+    current_app.logger.debug('{}: graphs cache {}'.format(fname, GRAPHS.stats()))
+    for message in graph['messages']:
+        flash(message)
+    
+    overlap = kwargs['overlap']
+    title = _('overlap') if overlap else _('plot')
+    chart_mode = request.args.get('chart', current_app.config.get('CHART_MODE', CHART_MODES[0]))
+    if not chart_mode in CHART_MODES:
+        chart_mode = CHART_MODES[0]
+    img_url = url_for('views.draw_chart', fmt='svg' if chart_mode == 'server' else 'json', **kwargs)
+    other_mode_url = url_for('views.draw_graph', chart=[mode for mode in CHART_MODES if mode != chart_mode][0], **kwargs)
+    kwargs['overlap'] = False if overlap else True    # ready to switch from overlap to not overlap, and vice versa
+    
+    return render_template('plot.html',
+                           title=title,
+                           time_interval=(kwargs['first'], kwargs['last'],),
+                           columns=graph['columns'],
+                           all_fields=forms.FIELDS,
+                           countries=graph['countries'],
+                           continents_composition=graph['continents_composition'],
+                           normalize=kwargs['normalize'],
+                           overlap=overlap,
+                           threshold=graph['threshold'],
+                           img_url=img_url,
+                           chart_mode=chart_mode,
+                           other_mode_url=other_mode_url,
+                           html_table_last_values=graph['html_table_last_values'],
+                           html_table=graph['html_table'],
+                           kwargs=kwargs,
+                           last_day=kwargs['last']
+                          )
+
+
+@bp.route('/chart/<context>/<ids>/<fields>/<normalize>/<overlap>/<first>/<last>/<remember>.<any(svg, png, json):fmt>')
+def draw_chart(context, ids, fields, normalize, overlap, first, last, remember, fmt):
+    '''the image of draw_graph, as svg or png; or its data, as json, to draw it in the browser
+    
+    params: as draw_graph ones, plus
+        - fmt           str - svg | png | json (see chart_json)
+    
+    remarks.
+        - the image depends only on data, language and parameters: its strong ETag
+              is a hash of them, so we answer 304 to a request with the same ETag
+              before drawing
+        - Cache-Control allows browsers and proxies to keep the image for
+              CHART_MAX_AGE seconds (config), then they need to revalidate it
+        - with a pool of processes drawing charts (see render.RenderPool), we
+              answer 503 if it is busy; json data do not need it
+    '''
+    fname = 'draw_chart'
+    current_app.logger.debug('{}({}, {}, {}, {}, {}, {}, {}, {})'.format(fname, context, ids, fields, normalize, overlap, first, last, fmt))
+    
+    params = graph_params(context, ids, fields, normalize, overlap, first, last, remember)
+    key = (g.dataset.version, g.locale, fmt,) + tuple(params.values())
+    etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        chart = GRAPHS.get(key)
+        if chart is None:
+            data_key, data = query_data(params)
+            try:
+                chart = build_chart(data, params, fmt)
+            except render.Busy as e:
+                current_app.logger.warning('{}: {}'.format(fname, e))
+                abort(503)                                    # the client can try again, instead of piling up here
+            GRAPHS.put(key, chart, size=len(chart))
+            GRAPHS.put(data_key, data, size=payload_size(data))
+        response = Response(chart, mimetype=CHART_MIMETYPES[fmt])
+    response.set_etag(etag)
+    response.cache_control.public  = True
+    response.cache_control.max_age = current_app.config.get('CHART_MAX_AGE', CHART_MAX_AGE)
+    response.vary.add('Accept-Language')                  # labels are translated
+    return response
+
+
+def graph_params(context, ids, fields, normalize, overlap, first, last, remember):
+    '''check and convert the parameters of draw_graph (and draw_chart)
+    
+    params: as draw_graph ones
+    
+    return kwargs      dict - normalize, overlap and remember as bool, first and last as date
+    '''
+    fname = 'draw_graph'
+    
     # START parameters check
     normalize = True if normalize in {'True', 'true',} else False
     overlap   = True if overlap   in {'True', 'true',} else False
@@ -475,25 +720,305 @@ def draw_graph(context, ids, fields='cases', normalize=False, overlap=False, fir
     first = datetime.strptime(first, '%Y-%m-%d').date() if first is not None else FIRST
     last  = datetime.strptime(last, '%Y-%m-%d').date() if last is not None else LAST
     
-    #   args to return here
-    kwargs={'context':  context,
-           'ids':       ids,
-           'fields':    fields,
-           'normalize': normalize,
-           'overlap':   overlap,
-           'first':     first,
-           'last':      last,
-           'remember':  remember,
-           }
-    
     #   check request context
     if not context in models.CONTEXT_SELECT:
         raise ValueError(_('%(function)s: context %(context)s is not allowed', function=fname, context=context))
         
     # END   parameters checks
     
+    return {'context':   context,
+            'ids':       ids,
+            'fields':    fields,
+            'normalize': normalize,
+            'overlap':   overlap,
+            'first':     first,
+            'last':      last,
+            'remember':  remember,
+           }
+
+
+def query_data(params):
+    '''the data of draw_graph parameters, shared by the page and its image
+    
+    params
+        - params        dict - draw_graph parameters, as graph_params returns them
+    
+    return (key, data)
+        - key           tuple - of data in GRAPHS
+        - data          dict - as build_data returns it; from GRAPHS if the page, or
+                            the image, of the same parameters built it
+    
+    remarks:
+        - on a miss of a page, its image is a miss too: without this, the image
+              request would run build_data again
+        - the caller puts data in GRAPHS after it used them, so their size includes
+              the parts of the result computed meanwhile; data are READ ONLY
+    '''
+    key = (g.dataset.version, g.locale, 'data',) + tuple(params.values())
+    data = GRAPHS.get(key)
+    if data is None:
+        data = build_data(**params)
+    return key, data
+
+
+def build_graph(data, normalize):
+    '''compute what draw_graph shows, but the image: the tables
+    
+    params
+        - data          dict - as build_data returns it
+        - normalize     bool - as draw_graph one
+    
+    return graph       dict - parts of the page, see the final return
+    '''
+    country_names = data['countries']
+    columns = data['columns']
+    html_table = table_nations(data['ddf'], country_names, columns, normalize=normalize, result=data['result'])
+    html_table_last_values = table_last_values(data['ddf'], country_names, columns, normalize=normalize, result=data['result'])
+    return {'columns':                columns,
+            'countries':              country_names,
+            'continents_composition': data['continents_composition'],
+            'threshold':              data['threshold'],
+            'html_table':             html_table,
+            'html_table_last_values': html_table_last_values,
+            'messages':               data['messages'],
+           }
+
+
+def build_chart(data, params, fmt):
+    '''draw the image of draw_graph
+    
+    params
+        - data          dict - as build_data returns it
+        - params        dict - draw_graph parameters, as graph_params returns them
+        - fmt           str - svg | png | json
+    
+    return bytes       the image, or its data as json
+    '''
+    if fmt == 'json':
+        spec, mc = chart_spec(data['ndf'], data['countries'], data['columns'],
+                              normalize=params['normalize'], overlap=params['overlap'])
+        return chart_json(spec).encode('utf-8')
+    img_data, mc = draw_nations(data['ndf'], data['countries'], data['columns'],
+                                normalize=params['normalize'], overlap=params['overlap'], fmt=fmt)
+    return img_data.encode('utf-8') if fmt == 'svg' else img_data
+
+
+# START result of a query, shared by chart and tables
+class QueryResult(object):
+    '''the daily rows of a query and what chart and tables get from them;
+       each part is computed once, at its first use
+
+    attributes
+        - ddf            pandas dataframe - daily data, as rows (not modified)
+        - columns        list of str - names of fields
+        - fields         list of str - fields to cumulate, i.e. columns but the delta ones
+        - normalize      bool - if true cumulative values are divided by population
+        - cube           models.Cube - of the dataset, if the query is a slice of it (i.e. its
+                             entities are in the cube, without overlap); None otherwise
+        - ids, first, last, remember
+                         the query, as draw_graph parameters; they are needed only with cube
+
+    parts
+        - grouped        daily data summed by date and entity
+        - daily          grouped pivoted: dates as index, (field, entity) as columns
+        - cumulative     daily with cumulative sums of fields
+        - chart          cumulative, divided by population if normalize
+        - weekly         weekly means of rows, (year, week) as index
+        - last_values    last not nan value of cumulative, entities as index; with cube, it
+                             is read from its running totals, without cumulating rows
+    '''
+    KEYS = ['dateRep', 'countriesAndTerritories']
+
+    def __init__(self, ddf, columns, normalize=False, cube=None, ids=None, first=None, last=None, remember=False):
+        self.ddf       = ddf
+        self.columns   = columns
+        self.fields    = [field for field in columns if field not in forms.list_delta_fields()]
+        self.normalize = normalize
+        self.cube      = cube
+        self.ids       = ids
+        self.first     = first
+        self.last      = last
+        self.remember  = remember
+        self._parts    = dict()
+
+    def _part(self, name, build):
+        '''a part, building it at the first request'''
+        if name not in self._parts:
+            self._parts[name] = build()
+        return self._parts[name]
+
+    def nbytes(self):
+        '''memory of rows and of the parts built up to now, in bytes'''
+        return payload_size([self.ddf] + list(self._parts.values()))
+
+    @property
+    def grouped(self):
+        def build():
+            values = [col for col in self.ddf.columns if col not in self.KEYS and (col != POP_FIELD or self.normalize)]
+            return self.ddf.groupby(self.KEYS)[values].sum(min_count=1)    # a missing delta stays nan, as in the cube
+        return self._part('grouped', build)
+
+    @property
+    def daily(self):
+        return self._part('daily', lambda: pd.pivot_table(self.grouped, index='dateRep', columns='countriesAndTerritories', dropna=False))
+
+    @property
+    def cumulative(self):
+        return self._part('cumulative', lambda: models.calculate_cumulative_sum(self.grouped, self.fields, pivot=self.daily))
+
+    @property
+    def chart(self):
+        def build():
+            if not self.normalize:
+                return self.cumulative
+            return models.calculate_cumulative_sum(self.grouped, self.fields, normalize=True, pivot=self.daily)
+        return self._part('chart', build)
+
+    def _averaged(self, columns):
+        '''columns to average in weekly: cases/day is a copy of cases, population is not an observation'''
+        dropped = {'dateRep', 'countriesAndTerritories', 'year', POP_FIELD,}
+        if 'cases/day' in self.columns and 'cases' in self.columns:
+            dropped.add('cases/day')
+        return [col for col in columns if col not in dropped]
+
+    @staticmethod
+    def _mean_tags():
+        '''weekly names of columns, to avoid confusion with names in graph'''
+        return {name: forms.FIELDS[name]['mean_tag'] for name in forms.FIELDS.keys()}
+
+    @property
+    def weekly(self):
+        def build():
+            ndf = self.ddf
+            if not 'dateRep' in ndf.columns:
+                ndf = ndf.reset_index(level=0)
+            values = [col for col in self._averaged(ndf.columns) if pd.api.types.is_numeric_dtype(ndf[col])]
+            # daily dates to weeks: week and year are grouping keys, not new columns of rows
+            dates = pd.to_datetime(ndf['dateRep'])
+            keys = [dates.dt.year.rename('year'), dates.dt.week.rename('week'), ndf['countriesAndTerritories']]
+            wdf = ndf[values].groupby(keys).mean()
+            wdf = wdf.rename(columns=self._mean_tags())
+            return pd.pivot_table(wdf, index=['year','week'], columns='countriesAndTerritories')
+        return self._part('weekly', build)
+
+    @property
+    def last_values(self):
+        def build():
+            if self.cube is not None:                          # from running totals (see models.Cube.last_values)
+                ldf = self.cube.last_values(self.columns + ([POP_FIELD] if self.normalize else []),
+                                            self.ids, self.first, self.last, self.remember)
+                ldf = ldf.sort_index().sort_index(axis='columns')
+            else:
+                cdf = self.cumulative
+                # last not nan value of every column (nan if all column is nan) ...
+                values = cdf.values.astype(np.float64)
+                valid = ~np.isnan(values)
+                last_row = values.shape[0] - 1 - valid[::-1].argmax(axis=0)
+                last = np.where(valid.any(axis=0), values[last_row, np.arange(values.shape[1])], np.nan)
+                # ... and transposing to get countries as row index
+                ldf = pd.Series(last, index=cdf.columns).unstack(level=0)
+                ldf.index.name = None
+                ldf.columns.name = None
+            if self.normalize:
+                for field in self.fields:
+                    ldf[field+'/pop.'] = ldf[field].divide(ldf[POP_FIELD])
+            return ldf
+        return self._part('last_values', build)
+
+
+class LazyResult(QueryResult):
+    '''as QueryResult, but from the cube and folding its entities one at a time:
+       the rows of the query are never built, and memory of a step is the one
+       of an entity, whatever the number of them
+
+    attributes
+        - cube           models.Cube - of the dataset
+        - ids            list of str - entities of the query, they MUST be in the cube
+        - names          list of str - names of ids
+        - first, last, remember, columns, fields, normalize
+                         as QueryResult ones; ddf is None
+
+    parts
+        - lines          generator of the lines of chart, by column (it is not kept)
+        - weekly         as QueryResult one
+        - last_values    as QueryResult one, that reads it from the cube
+
+    remark: the results of a query are the same of QueryResult ones from its rows
+    '''
+
+    def __init__(self, cube, ids, columns, first=None, last=None, remember=False, normalize=False):
+        super().__init__(None, columns, normalize, cube, ids, first, last, remember)
+        self.names     = [cube.names[cube.pos[id]] for id in ids]
+
+    def nbytes(self):
+        '''memory held by the result, in bytes: names and the tables built up to now, data are in the cube'''
+        return payload_size([self.names] + list(self._parts.values()))
+
+    def _entities(self, fields, normalize=False, cumulative=True):
+        return self.cube.entities(fields, self.ids, self.first, self.last, self.remember, normalize=normalize, cumulative=cumulative)
+
+    def lines(self, column):
+        '''(country, x, y) of the chart lines of a column, an entity at a time'''
+        for name, present, edf in self._entities([column], normalize=self.normalize):
+            yield name, edf.index.values, edf[column]
+
+    @property
+    def weekly(self):
+        def build():
+            values = self._averaged(self.columns)
+            tags = self._mean_tags()
+            names, blocks = ([], [],)
+            for name, present, edf in self._entities(values, cumulative=False):
+                if not blocks:                                     # dates are the same for all entities: weeks too
+                    dates = edf.index
+                    weeks, index = pd.factorize(dates.year * 100 + dates.week, sort=True)
+                    index = pd.MultiIndex.from_arrays([index // 100, index % 100], names=['year', 'week'])
+                block = np.full((len(index), len(values)), np.nan)
+                for n, col in enumerate(values):                   # mean of the rows of the entity, nan skipped
+                    ok = present & ~np.isnan(edf[col].values)
+                    count = np.bincount(weeks[ok], minlength=len(index))
+                    total = np.bincount(weeks[ok], weights=edf[col].values[ok], minlength=len(index))
+                    block[count > 0, n] = total[count > 0] / count[count > 0]
+                names.append(name)
+                blocks.append(block)
+            if not blocks:                                         # no entity has data in time interval
+                return pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=['year', 'week']))
+            columns = pd.MultiIndex.from_tuples([(tags.get(col, col), name) for name in names for col in values],
+                                                names=[None, 'countriesAndTerritories'])
+            wdf = pd.DataFrame(np.hstack(blocks), index=index, columns=columns).sort_index(axis='columns')
+            return wdf.dropna(how='all').dropna(how='all', axis='columns')    # as pivot_table does
+        return self._part('weekly', build)
+# END   result of a query, shared by chart and tables
+
+
+def build_data(context, ids, fields, normalize, overlap, first, last, remember):
+    '''get the data to draw and to tabulate
+    
+    params: as draw_graph ones, already checked and converted by graph_params
+    
+    return data        dict - with:
+        - ddf                       pandas dataframe - daily data, as rows; None if lazy
+        - ndf                       pandas dataframe - data to draw; if lazy, the LazyResult
+        - result                    QueryResult - of ddf, shared by chart and tables; or
+                                        LazyResult, if lazy
+        - columns                   list of str - names of fields
+        - countries                 list of str - names of entities to show (i.e. with data)
+        - continents_composition    dict of dict - nations of continents, or None
+        - threshold                 int - of overlap
+        - messages                  list of str - to flash
+    '''
+    fname = 'build_data'
+    messages = []                                          # to flash when the page is shown
+    
+    # with many entities from the cube (e.g. "Worst World", or all nations) we are lazy:
+    #     we do not build rows, chart and tables fold data of an entity at a time
+    cube = g.dataset.cube
+    l_ids = ids.split('-')
+    sliced = not overlap and cube.covers(l_ids)
+    lazy = sliced and len(l_ids) >= current_app.config.get('LAZY_ENTITIES', LAZY_ENTITIES)
+    
     # here "new dataframe" (ndf) has (only) the necessary rows with daily data of cases and deaths
-    ddf = query_patterns(g.df, context, ids, first, last, remember)
+    ddf = None if lazy else query_patterns(g.df, context, ids, first, last, remember, cube=cube, offsets=g.dataset.offsets)
     
     # managing fields: transforms field sids (from http get) to field names
     fields  = forms.fields_from_sids_to_names(fields)         # str to str
@@ -517,12 +1042,12 @@ def draw_graph(context, ids, fields='cases', normalize=False, overlap=False, fir
     #     |...
     #     |12  2020-04-25     15                 Albania
     #     |13  2020-04-24     29                 Albania
-    ddf = models.add_cols(ddf, used_delta_fields)          # add columns for used delta fields
     flds.extend(used_delta_fields)
-    ddf = models.subset_cols(ddf, flds)                    # drop unused columns
+    if not lazy:
+        ddf = models.add_cols(ddf, used_delta_fields)      # add columns for used delta fields
+        ddf = models.subset_cols(ddf, flds)                # drop unused columns
     
     # Getting names of contries (|continents|areas) to draw.                                                                                          Note: ids are identifiers ...
-    l_ids = ids.split('-')
     # - ldfa, 2020-09-27 passing to GeoEntities
     #country_names = models.get_geographic_names(l_ids, g.nations)     # ... while these are names
     #country_names_dict = models.get_geographic_characteristics(l_ids, g.nations)     # ... while these are names
@@ -564,9 +1089,22 @@ def draw_graph(context, ids, fields='cases', normalize=False, overlap=False, fir
     #     |           Albania                     16
     #     note: cases are daily cases
     #     note: sum() is not useful in case of nations. BUT it serves in case of continents and/or areas
-    ndf = ddf.groupby(['dateRep', 'countriesAndTerritories']).sum()
+    #     note: without overlap, when the cube has all ids, we skip it and slice the pivot from the cube
+    if lazy:
+        result = LazyResult(cube, l_ids, columns, first, last, remember, normalize=normalize)
+    else:
+        result = QueryResult(ddf, columns, normalize=normalize,
+                             cube=cube if sliced else None, ids=l_ids, first=first, last=last, remember=remember)
     
-    if not overlap:
+    if lazy:
+        threshold = 0
+        # here ndf is the LazyResult: draw_nations gets its lines an entity at a time
+        ndf = result
+    elif sliced:
+        threshold = 0
+        # here ndf will become as in the next case, without regrouping and pivoting rows
+        ndf = cube.pivot(used_not_delta_fields + used_delta_fields, l_ids, first, last, remember, normalize=normalize)
+    elif not overlap:
         threshold = 0
         # here ndf will become:
         #     |                              cases
@@ -577,7 +1115,8 @@ def draw_graph(context, ids, fields='cases', normalize=False, overlap=False, fir
         #     |...
         #     |2020-04-30                      773     132
         #     Note: cases in output ndf become cumulative cases
-        ndf = models.calculate_cumulative_sum(ndf, used_not_delta_fields, normalize=normalize)  # pivot and calculate cumulative sum of used fields (not the delta fields)
+        #     Note: the same cumulative sums give the table of last values
+        ndf = result.chart                                     # pivot and calculate cumulative sum of used fields (not the delta fields)
         # if normalize==True, we divided cases by population
     else:
         # here ndf will become:
@@ -590,44 +1129,41 @@ def draw_graph(context, ids, fields='cases', normalize=False, overlap=False, fir
         #     |4         527     102
         #     |5         651     116
         #     |6         773     132    
-        threshold = models.suggest_threshold(ndf, column=used_not_delta_fields[0], ratio=THRESHOLD_RATIO)
-        ndf = models.calculate_cumulative_sum_with_overlap(ndf, column=used_not_delta_fields[0], threshold=threshold, normalize=normalize)
+        threshold = models.suggest_threshold(result.grouped, column=used_not_delta_fields[0], ratio=THRESHOLD_RATIO)
+        ndf = models.cumulate_by_country(result.grouped, column=used_not_delta_fields[0], normalize=normalize)
+        ndf, not_aligned = models.align_by_threshold(ndf, threshold)
         # if normalize==True, we divided cases by population
+        if not_aligned:
+            messages.append(_('%(countries)s: not drawn, they never exceed the threshold in a couple of adjacent days',
+                    countries=', '.join([country for column, country in not_aligned])))
     
     if ndf is None:
         raise ValueError(_('%(function)s: got an empty dataframe from pivot; overlap is: %(overlap)s', function=fname, overlap=overlap))
 
-    img_data, mc  = draw_nations(ndf, country_names, columns, normalize=normalize, overlap=overlap)  # image data, mc is missing countries
+    mc = missing_countries(ndf, country_names)             # as draw_nations would find them
     country_names = [country for country in country_names if country not in mc]
-    html_table = table_nations(ddf, country_names, columns, normalize=normalize)
-    html_table_last_values = table_last_values(ddf, country_names, columns, normalize=normalize)
+    return {'ddf':                    ddf,
+            'ndf':                    ndf,
+            'result':                 result,
+            'columns':                columns,
+            'countries':              country_names,
+            'continents_composition': continents_composition,
+            'threshold':              threshold,
+            'messages':               messages,
+           }
 
-    title = _('overlap') if overlap else _('plot')
-    kwargs['overlap'] = False if overlap else True    # ready to switch from overlap to not overlap, and vice versa
-    
-    return render_template('plot.html',
-                           title=title,
-                           time_interval=(first, last,),
-                           columns=columns,
-                           all_fields=forms.FIELDS,
-                           countries=country_names,
-                           continents_composition=continents_composition,
-                           normalize=normalize,
-                           overlap=overlap,
-                           threshold=threshold,
-                           img_data = img_data,
-                           html_table_last_values=html_table_last_values,
-                           html_table=html_table,
-                           kwargs=kwargs,
-                           last_day=last
-                          )
+
+def missing_countries(df, countries):
+    '''countries without any column in a dataframe ready to be drawn (or in a LazyResult)'''
+    names = set(df.names) if isinstance(df, LazyResult) else set(df.columns.get_level_values(-1))
+    return [country for country in countries if country not in names]
 
 
 def get_used_delta_fields(fields):
     return   list(set(fields) & set(forms.list_delta_fields()))
 
 #def draw_nations(df, country_name_field, country_names, fields, normalize=False, overlap=False):
-def draw_nations(df, country_names, fields, normalize=False, overlap=False):
+def draw_nations(df, country_names, fields, normalize=False, overlap=False, fmt='svg'):
     '''prepare data to draw chosen observations and make it
     
     parameters:
@@ -636,135 +1172,178 @@ def draw_nations(df, country_names, fields, normalize=False, overlap=False):
         - fields        list of str - name of variables to draw
         - normalize     bool - ~~True~~|False
         - overlap       bool - ~~True~~|False
+        - fmt           str - svg: image is the <svg> element, str | png: image is bytes
+    
+    remark: render.RENDERER draws the image, in a worker process if RENDER_PROCESSES (config)
+            is more than 0; then it can raise render.Busy
     '''
     fname = 'draw_nations'
     #current_app.logger.debug('> {}({}, {}, {}, {}, {})'.format(fname, df, country_names, fields, normalize, overlap))
     
+    spec, mc = chart_spec(df, country_names, fields, normalize=normalize, overlap=overlap)
+    img_data = render.RENDERER.draw(spec, fmt)
+    if fmt != 'png':
+        img_data = svg_element(img_data)                   # get image data only (<svg ...> ... </svg>)
+    return img_data, mc
+
+
+def chart_spec(df, country_names, fields, normalize=False, overlap=False):
+    '''what draw_nations draws, as render.draw_chart wants it: numbers and already
+       translated strings, so a worker process can draw it
+    
+    params: as draw_nations ones
+    
+    return (spec, mc)
+        - spec          dict - see render.draw_chart
+        - mc            list of str - missing countries
+    '''
     delta_fields = forms.list_delta_fields()
     used_delta_fields = get_used_delta_fields(fields)
     
     tmpfields = [field for field in fields if not field in used_delta_fields]
-    #if '\N{Greek Capital Letter Delta}cases/day' in fields:
-    #    tmpfields.remove('\N{Greek Capital Letter Delta}cases/day')
-    #if 'cases/day' in fields:
-    #    tmpfields.remove('cases/day')
-    #for field in tmpfields:
-    #    sdf[field] = sdf[field].cumsum()
-    #if normalize:
-    #    for field in tmpfields:
-    #        df[field] = df[field]/df[POP_FIELD]
-    #    del df[POP_FIELD]
     
     # fighting for a good picture
-    fig = Figure(figsize=(9,7))
-    
-    if set(fields).isdisjoint(delta_fields):               # fields has not delta_fields
-        ax = fig.subplots()
-    else:
-        ax = fig.add_axes([0.1,0.35,0.8,0.6])  # left, bottom, width, height
-        ax2 = fig.add_axes([0.1,0.20,0.8,0.15], sharex=ax)
-    
-    xlabelrot = 80
-    title  = _l('Observations about Covid-19 outbreak')
-    ylabel = _l('number of cases') if not normalize else _l('rate to population')
-    y2label = _l('n.of cases')
-    xlabel = _l('date') if not overlap else _l('days from overlap point')
-    
-    fig, mc = generate_figure(ax, df, country_names, columns=tmpfields)      # figure, missing countries
-    
-    ax.grid(True, linestyle='--')
-    ax.legend()
-    ax.set_title (title)
-    ax.set_ylabel(ylabel)
-    if set(fields).isdisjoint(delta_fields):               # fields has not delta_fields
-        ax.tick_params(axis='x', labelrotation=xlabelrot)
-        ax.set_xlabel(xlabel)
-        fig.subplots_adjust(bottom=0.2)
+    spec = {'num_colors': len(country_names),
+            'xlabelrot':  80,
+            'title':      str(_l('Observations about Covid-19 outbreak')),
+            'ylabel':     str(_l('number of cases') if not normalize else _l('rate to population')),
+            'y2label':    str(_l('n.of cases')),
+            'xlabel':     str(_l('date') if not overlap else _l('days from overlap point')),
+           }
     
+    spec['lines'], mc = generate_figure(df, country_names, columns=tmpfields)           # lines, missing countries
+    spec['lines2'] = None
     if not set(fields).isdisjoint(delta_fields):               # fields has delta_fields
-        fig, mc = generate_figure(ax2, df, country_names, columns=used_delta_fields)    # figure, missing countries
-        ax2.set_ylabel(y2label)
-        ax2.tick_params(axis='x', labelrotation=xlabelrot)
-        ax2.grid(True, linestyle='--')
-        ax2.legend()
-        ax2.set_xlabel(xlabel)
-    
-    # Save it to a temporary buffer.
-    buf = StringIO()
-    fig.savefig(buf, format="svg")
-    soup = bs.BeautifulSoup(buf.getvalue(),'lxml')          # parse image
-    img_data = soup.find('svg')                             # get image data only (<svg ...> ... </svg>)
-    return img_data, mc
+        spec['lines2'], mc = generate_figure(df, country_names, columns=used_delta_fields)    # lines, missing countries
+    return spec, mc
 
 
-def generate_figure(ax, df, countries, columns=None):
-    '''# Generate the figure **without using pyplot**.'''
-    if columns is None: columns = ['cases']
+def figure_lines(df, column, countries):
+    '''(country, x, y) of the lines of a column, in the order of countries
+    
+    params
+        - df            pandas dataframe - ready to be drawn; or a LazyResult, giving
+                            the lines an entity at a time
+    
+    remark: y is None if df misses the country
+    '''
+    if isinstance(df, LazyResult):
+        drawn = set()
+        for country, x, y in df.lines(column):
+            if country in countries:
+                drawn.add(country)
+                yield country, x, y
+        for country in countries:
+            if country not in drawn:
+                yield country, None, None
+        return
+    for country in countries:
+        if column in df and country in df[column]:
+            yield country, df.index.values, df[column][country]
+        else:
+            yield country, None, None
+
+
+def chart_json(spec):
+    '''a chart spec as compact json, for static/js/chart.js
+    
+    params: spec       dict - see render.draw_chart
+    
+    return str         json of the spec, where:
+        - x                 list - dates as 'yyyy-mm-dd', or days from overlap point,
+                                shared by all the lines
+        - lines, lines2     list of {'label': str, 'ltype': str, 'y': list of numbers}, the
+                                y values by x, null where there are no data; lines2 is null
+                                without delta fields
+        - num_colors, title, ylabel, y2label, xlabel, xlabelrot
+                            as in spec
+    
+    remark: all the lines have the same x, the index of the data to draw
+    '''
+    lines = spec['lines'] + (spec['lines2'] or [])
+    x = lines[0][0] if lines else np.array([])
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = np.datetime_as_string(x, unit='D')
+    
+    def encode(lines):
+        return [{'label': label,
+                 'ltype': ltype,
+                 'y':     [None if np.isnan(v) else v for v in np.asarray(y, dtype=np.float64).tolist()],
+                } for xl, y, ltype, label in lines]
+    
+    data = {key: value for key, value in spec.items() if key not in {'lines', 'lines2'}}
+    data['x'] = x.tolist()
+    data['lines'] = encode(spec['lines'])
+    data['lines2'] = encode(spec['lines2']) if spec['lines2'] is not None else None
+    return json.dumps(data, separators=(',', ':'))
+
+
+def svg_element(svg):
+    '''cut the <svg ...> ... </svg> element out of an svg document,
+       i.e. drop xml declaration, doctype and comments around it
     
-    # ldfa,2020-10-03 how going over 20 colors (needed to represent EU: 26 countries), see:
-    # https://stackoverflow.com/questions/8389636/creating-over-20-unique-legend-colors-using-matplotlib
-    # and here colormaps examples:
-    # https://matplotlib.org/examples/color/colormaps_reference.html
-    num_colors = len(countries)           # how many colors we need
-    cm = plt.get_cmap('tab20')     # color map to use: max 20 countries
-    ax.set_prop_cycle(color=[cm(1.*i/num_colors) for i in range(num_colors)])
+    params: svg        str - svg document, as matplotlib writes it
     
+    return str         the svg element, to embed in html
+    
+    remark: we do not parse the document: the element starts at the first <svg
+            and ends at the last </svg>
+    '''
+    fname = 'svg_element'
+    start = svg.find('<svg')
+    end   = svg.rfind('</svg>')
+    if start < 0 or end < start:
+        raise ValueError(_('%(function)s: svg element not found', function=fname))
+    return svg[start:end+len('</svg>')]
+
+
+def generate_figure(df, countries, columns=None):
+    '''lines of the figure, by column and country, as render.draw_lines wants them
+    
+    return (lines, missing_countries)
+        - lines         list of (x, y, line type, label)
+        - missing_countries
+                        list of str - countries without data in df
+    '''
+    if columns is None: columns = ['cases']
+    
+    lines = []
     missing_countries = []
     
     for column, ltype in zip(columns, ['-', '--', '-.', ':'][0:len(columns)]):
         #for country, color in zip(countries, COLORS[0:len(countries)]):
-        for country in countries:
-            try:
-                ax.plot(df.index.values,          # x
-                        df[column][country],         # y
-                        ltype,
-                        #color=color,
-                        label=_('%(column)s of %(country)s', column=column, country=country)         # label in legend
-                       )
-            except:
+        for country, x, y in figure_lines(df, column, countries):
+            if y is None:
                 missing_countries.append(country)
-        
-    fig = ax.get_figure()
+                continue
+            lines.append((x,
+                          np.asarray(y),
+                          ltype,
+                          _('%(column)s of %(country)s', column=column, country=country)         # label in legend
+                        ))
 
-    return fig, missing_countries
+    return lines, missing_countries
 
 # +- ldfa,2020-09-18 modified, using a modeled dataframe
 # + ldfa,2020-05-17 to show a summary table of chosen observations
-def table_nations(df, country_names, fields, normalize=False):
+def table_nations(df, country_names, fields, normalize=False, result=None):
     '''summary table of daily and observations
     
+    params
+        - result        QueryResult - of df, if at hand: its parts are shared with
+                            the chart and the table of last values
+    
     remarks: 
         - summary is by converting daily data to mean onto week data
         - here df is a dataframe with daily data, NOT the cumulative ones
+        - df is not copied: week and year are grouping keys, not new columns of it
     '''
     fname = 'table_nations'
     #current_app.logger.debug(fname)
     
-    ndf = df.copy(deep=True)
-    nfields = fields[:]
-    
-    if 'cases/day' in fields and 'cases' in fields:
-        nfields.remove('cases/day')
-        del ndf['cases/day']
-
-    if POP_FIELD in df.columns:
-        del ndf[POP_FIELD]
-    
-    if not 'dateRep' in ndf.columns:
-        ndf.reset_index(level=0, inplace=True)
-    
-    # now we need to translate daily dates to weeks
-    ndf['dateRep'] = pd.to_datetime(ndf['dateRep'])
-    ndf['week'] = ndf['dateRep'].dt.week    # adding week number
-    ndf['year'] = ndf['dateRep'].dt.year    # adding year
-    
-    #edf = edf.rename(columns=forms.FIELDS_IN_TABLE)    # renaming columns to avoid confusioni with names in graph
-    ndf = ndf.rename(columns={name: forms.FIELDS[name]['mean_tag'] for name in forms.FIELDS.keys()})    # renaming columns to avoid confusioni with names in graph
-    
-    ndf_avg = ndf.groupby(['year','week','countriesAndTerritories']).mean()
-    
-    ndf1 = pd.pivot_table(ndf_avg, index=['year','week'],columns='countriesAndTerritories')
-    return ndf1.to_html(buf=None, float_format=lambda x: '%10.2f' % x)
+    if result is None:
+        result = QueryResult(df, fields, normalize=normalize)
+    return result.weekly.to_html(buf=None, float_format=lambda x: '%10.2f' % x)
 
 
 # +- ldfa,2020-09-18 modified, using a modeled dataframe
@@ -812,62 +1391,26 @@ def table_last_values0(df, country_names, fields, normalize=False):
 # +- ldfa,2020-10-09 modified: countries as row index
 # +- ldfa,2020-09-18 modified, using a modeled dataframe
 # + ldfa,2020-05-27 to show values of observations on last day
-def table_last_values(df, country_names, fields, normalize=False):
+def table_last_values(df, country_names, fields, normalize=False, result=None):
     ''' show figures of last day about chosen observations
+    
+    params
+        - result        QueryResult - of df, if at hand: its cumulative sums are the
+                            ones of the chart
+    
+    remarks:
+        - the last value of a column is its last not nan one, nan if
+              the column is all nan; values of all columns are got at once
+        - df is not copied: the groupby selects its columns
     '''
     fname = 'table_last_values'
     #current_app.logger.debug(fname)
     
-    delta_fields = forms.list_delta_fields()
-
-    ndf = df.copy(deep=True)
-    if POP_FIELD in df.columns and not normalize:
-        del ndf[POP_FIELD]
-        
-    ndf = ndf.groupby(['dateRep', 'countriesAndTerritories']).sum()
-    ndf1 = pd.pivot_table(ndf, index='dateRep',columns='countriesAndTerritories')
-    if ndf1 is None:
-        raise ValueError(_('%(function)s: got an empty dataframe from pivot', function=fname))
-    tmpfields = [field for field in fields if not field in delta_fields]
+    if result is None:
+        result = QueryResult(df, fields, normalize=normalize)
     
-    for field in tmpfields:
-        ndf1[field] = ndf1[field].cumsum()
-
-    # START checking for nan in last row; if present we substitute it with last not nan value on the column
-    #     in case of nan in all the column, we give up
-    for field, country in ndf1.columns.to_list():
-        nrow, ncol = ndf1.shape
-        valid_row = -1
-        while pd.isnull(ndf1.iloc[valid_row][field, country]) and (valid_row+nrow) > 0:
-            valid_row -= 1
-        if valid_row==-1 or (valid_row+nrow)==0:
-            continue                              # ... if (valid_row+nrow)==0, all column is nan, here we give up
-        else:                                     # ... nas is present: we substitute it with last not nan value on the column
-            ndf1.iloc[-1][field, country] = ndf1.iloc[valid_row][field, country]
-    # END   checking for nan in last row
-    
-    ndf1 = ndf1.iloc[-1:]
-    
-    # - ldfa,2020.10.27 to fix bug #7
-    #if normalize:
-    #    for field in tmpfields:
-    #        index = pd.MultiIndex.from_product([[field+'/pop.'], country_names])
-    #        ndf2 = ndf1[field].divide(ndf1[POP_FIELD])
-    #        ndf2.columns = index
-    #        ndf1 = ndf1.join(ndf2)
-            
-    resultdf = pd.DataFrame()                               # START transposing to get countries as row index
-    for col, row in ndf1.columns.to_list():
-        resultdf.at[row, col] = ndf1[(col, row)].iloc[0]    # END   transposing to get countries as row index
-        
-    # + ldfa,2020.10.27 to fix bug #7
-    if normalize:
-        for field in tmpfields:
-            resultdf[field+'/pop.'] = resultdf[field].divide(resultdf[POP_FIELD])
-            
-
     #return ndf1.to_html(buf=None, float_format=lambda x: '%10.4f' % x)
-    return resultdf.to_html(buf=None, float_format="{:n}".format)                # a more flexible format to output numbers
+    return result.last_values.to_html(buf=None, float_format="{:n}".format)                # a more flexible format to output numbers
     
 # - ldfa,2020.10.27 emptied
 # START section about deleted code 
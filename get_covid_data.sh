@@ -1,6 +1,7 @@
 #!/bin/bash
 # getting data from ecdc
 
+ADIR=/usr/share/nginx/html/flask_covid/
 DDIR=/usr/share/nginx/html/flask_covid/instance/data/
 DFILE=covid19-worldwide.csv
 DLOG=covid19-worldwide.log
@@ -17,4 +18,18 @@ if ! wget https://opendata.ecdc.europa.eu/covid19/casedistribution/csv -O $DDIR$
     exit
 fi
 
+# binary snapshot of the new data: workers load it in milliseconds instead of parsing csv
+if ! (cd $ADIR && ${ADIR}venv/bin/flask data snapshot >> $DDIR$DLOG 2>&1); then
+    echo warning: snapshot not written, application will read csv >> $DDIR$DLOG
+fi
+
+# what changed from yesterday: new days only, or corrections of past days too
+if [ -f "$DDIR$OLDFILE" ]; then
+    if ! (cd $ADIR && ${ADIR}venv/bin/flask data diff $DDIR$OLDFILE >> $DDIR$DLOG 2>&1); then
+        echo warning: data diff failed >> $DDIR$DLOG
+    fi
+else
+    echo warning: no previous data file, data diff skipped >> $DDIR$DLOG
+fi
+
 #source $HDIR$RESTARTSH
@@ -0,0 +1,462 @@
+# :filename: tests/benchmarks.py
+# to use: "cd tests; python benchmarks.py"
+#
+# times the hot spots of the application on a synthetic dataframe
+# shaped as the ECDC one: ~210 countries x ~300 days, i.e. ~60k rows
+
+
+# import std libs
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+# import 3rd parties libs
+import numpy  as np
+import pandas as pd
+from flask       import Flask
+from flask_babel import Babel
+
+
+D_FMT2    = '%d/%m/%Y'
+COUNTRIES = 210
+DAYS      = 300
+REPEAT    = 5
+
+
+def make_csv(fname, countries=COUNTRIES, days=DAYS, seed=1):
+    '''write a synthetic csv file with the ECDC format
+
+    remark: as in ECDC file, rows are by country and, for every
+            country, by date in descending order
+    '''
+    rng = np.random.default_rng(seed)
+    last = date(2020, 10, 26)
+    dates = [last - timedelta(days=n) for n in range(days)]
+    rows = []
+    for n in range(countries):
+        name = 'Country_{:03d}'.format(n)
+        start = int(rng.integers(0, days//3))              # countries start to report on different days
+        pop   = int(rng.integers(10**4, 10**8))
+        for d in dates[:days-start]:
+            rows.append((d.strftime(D_FMT2), d.day, d.month, d.year,
+                         int(rng.poisson(100)), int(rng.poisson(3)),
+                         name, 'C{:03d}'.format(n), 'C{:03d}'.format(n), pop, 'Continent_{}'.format(n%5)))
+    df = pd.DataFrame(rows, columns=['dateRep', 'day', 'month', 'year', 'cases', 'deaths',
+                                     'countriesAndTerritories', 'geoId', 'countryterritoryCode',
+                                     'popData2019', 'continentExp'])
+    df.to_csv(fname, index=False)
+    return df.shape
+
+
+def bench(label, func, repeat=REPEAT):
+    '''print and return the best time, in seconds, of repeated calls of func'''
+    t = min(timeit.repeat(func, number=1, repeat=repeat))
+    print('{:<60} {:10.4f}s'.format(label, t))
+    return t
+
+
+def bench_world_shape(fname):
+    '''dates parsing: per row strptime (up to ver.1.3) vs vectorized world_shape'''
+    raw = pd.read_csv(fname)
+
+    def by_row():
+        df = raw.copy()
+        df['dateRep'] = df['dateRep'].map(lambda x: datetime.strptime(x, D_FMT2).date())
+
+    def vectorized():
+        models.world_shape(raw.copy())
+
+    t0 = bench('world_shape - per row strptime', by_row)
+    t1 = bench('world_shape - vectorized to_datetime', vectorized)
+    print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+
+
+def bench_snapshot(fname):
+    '''loading: csv parse + world_shape vs binary snapshot'''
+    sname = models.snapshot_df(fname)
+    stamp = models.file_stamp(fname)
+
+    t0 = bench('load - read_csv + world_shape', lambda: models.world_shape(pd.read_csv(fname)))
+    t1 = bench('load - binary snapshot', lambda: models.read_snapshot(sname, stamp, 'world_shape'))
+    print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+
+
+def bench_cube(fname):
+    '''cumulative data of 27 countries: rows regrouped and pivoted vs sliced from the cube'''
+    df = models.world_shape(pd.read_csv(fname))
+    ids = ['C{:03d}'.format(n) for n in range(0, 27*7, 7)]
+    first, last = (date(2020, 3, 1), date(2020, 9, 30),)
+
+    def by_rows():
+        ddf = models.select_rows_by_dates(df, first, last, remember=True)
+        ddf = models.subset_rows_by_nations(ddf, ids)
+        ddf = models.subset_cols(ddf, ['dateRep', 'countriesAndTerritories', 'cases', 'deaths'])
+        models.calculate_cumulative_sum(ddf.groupby(['dateRep', 'countriesAndTerritories']).sum(), ['cases', 'deaths'])
+
+    cube = models.Cube(df, 'popData2019')
+    bench('cube - build (once, at load)', lambda: models.Cube(df, 'popData2019'))
+    t0 = bench('cumulative - select rows + groupby + pivot', by_rows)
+    t1 = bench('cumulative - cube slice', lambda: cube.pivot(['cases', 'deaths'], ids, first, last, remember=True))
+    print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+
+
+def bench_overlap(fname):
+    '''overlap of 27 countries: loops over countries and dates vs array operations'''
+    df = models.world_shape(pd.read_csv(fname))
+    ids = ['C{:03d}'.format(n) for n in range(0, 27*7, 7)]
+    ndf = models.subset_cols(models.subset_rows_by_nations(df, ids), ['dateRep', 'countriesAndTerritories', 'cases'])
+    ndf = ndf.groupby(['dateRep', 'countriesAndTerritories']).sum()
+    threshold = models.suggest_threshold(ndf, column='cases', ratio=0.05)
+
+    def by_loops():
+        ndf2 = ndf.copy()
+        dates = pd.DatetimeIndex(ndf2.index.get_level_values('dateRep').drop_duplicates()).to_list()
+        idx = pd.IndexSlice
+        for country in ndf2.index.get_level_values('countriesAndTerritories').drop_duplicates():
+            ndf2.loc[idx[:, country], 'cases'] = ndf2.loc[idx[:, country], 'cases'].cumsum()
+            acountry = ndf2.xs(country, level='countriesAndTerritories')['cases']
+            cases_list = []
+            for n, adate in enumerate(dates[:-1]):                  # as up to ver.1.3: a lookup by day
+                try:
+                    if cases_list or (acountry.loc[adate] >= threshold and acountry.loc[dates[n+1]] >= threshold):
+                        cases_list.append(acountry.loc[adate])
+                except KeyError:
+                    pass
+
+    t0 = bench('overlap - loops over countries and dates', by_loops, repeat=1)
+    t1 = bench('overlap - cumulate_by_country + align_by_threshold',
+               lambda: models.align_by_threshold(models.cumulate_by_country(ndf, 'cases'), threshold))
+    print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+
+
+def bench_update(fname):
+    '''a new day of data: cube rebuilt vs cube checked and extended'''
+    df = models.world_shape(pd.read_csv(fname))
+    old = df[df['dateRep'] < df['dateRep'].max()]
+    cube = models.Cube(old, 'popData2019')
+
+    def incremental():
+        if cube.appends(df):
+            cube.extended(df)
+
+    t0 = bench('update - Cube rebuilt', lambda: models.Cube(df, 'popData2019'))
+    t1 = bench('update - Cube.appends + Cube.extended', incremental)
+    print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+    bench('update - diff_df (report of changes, off line)', lambda: models.diff_df(old, df))
+
+
+def bench_aggregates(fname):
+    '''rows of all continents: a filter and a groupby for each one vs one pass vs the cube'''
+    df = models.world_shape(pd.read_csv(fname))
+    ids = sorted(df['continentExp'].unique())
+
+    def by_loops():
+        for id in ids:                                                  # as up to ver.1.3
+            df_nrc = df[df['continentExp']==id]
+            population = df_nrc[['countriesAndTerritories', 'popData2019']].drop_duplicates().sum()['popData2019']
+            grouped = df_nrc.groupby(by='dateRep', as_index=False)
+            df_tmp = pd.DataFrame({'dateRep': grouped.sum()['dateRep']})
+            df_tmp['day'] = df_tmp['dateRep'].map(lambda x: x.day)
+            df_tmp['month'] = df_tmp['dateRep'].map(lambda x: x.month)
+            df_tmp['year'] = df_tmp['dateRep'].map(lambda x: x.year)
+            df_tmp['cases'] = grouped.sum()['cases']
+            df_tmp['deaths'] = grouped.sum()['deaths']
+
+    t0 = bench('continents - filter + groupby for each one', by_loops)
+    t1 = bench('continents - aggregate_rows', lambda: models.create_rows_by_continents(df, ids, 'popData2019'))
+    print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+    cube = models.Cube(df, 'popData2019')                               # aggregates materialised once, at load
+    t2 = bench('continents - rows of the cube', lambda: cube.rows(ids))
+    print('{:<60} {:>10}'.format('speed up on aggregate_rows', 'x{:.1f}'.format(t1/t2)))
+
+
+def bench_remember(fname):
+    '''dates interval with remember: a lookup for each country vs one grouped sum'''
+    df = models.world_shape(pd.read_csv(fname))
+    first, last = (pd.Timestamp(2020, 6, 1), pd.Timestamp(2020, 9, 30),)
+
+    def by_loops():
+        ti_df = df[(df['dateRep']>=first) & (df['dateRep']<=last)]      # as up to ver.1.3
+        base_df = df[(df['dateRep']<first)].groupby('countriesAndTerritories')[['cases', 'deaths']].sum()
+        ti_df2 = ti_df.set_index(['countriesAndTerritories', 'dateRep'])
+        for country in base_df.index.to_list():
+            try:
+                country_min_date = ti_df[(ti_df['countriesAndTerritories']==country)]['dateRep'].min()
+                ti_df2.at[(country, country_min_date,), 'cases']  = ti_df2.at[(country, country_min_date,), 'cases'] + base_df.at[country, 'cases']
+                ti_df2.at[(country, country_min_date,), 'deaths'] = ti_df2.at[(country, country_min_date,), 'deaths'] + base_df.at[country, 'deaths']
+            except:
+                pass
+        ti_df2.reset_index()
+
+    t0 = bench('remember - lookup for each country', by_loops)
+    t1 = bench('remember - select_rows_by_dates', lambda: models.select_rows_by_dates(df, first, last, remember=True))
+    print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+
+
+def bench_offsets(fname):
+    '''3 days of all countries and all days of 2 countries: boolean masks vs offsets, on 1x and 4x data'''
+    first, last = (date(2020, 10, 20), date(2020, 10, 22),)
+    for times in (1, 4):
+        df = models.world_shape(pd.read_csv(fname))
+        if times > 1:                                                   # more days of data before the same ones
+            df = pd.concat([df.assign(dateRep=df['dateRep'] - pd.Timedelta(days=DAYS*n)) for n in range(times)])
+        df = models.sort_rows(df)
+        offsets = models.Offsets(df)
+        t0 = bench('dates x{} - boolean mask'.format(times), lambda: models.select_rows_by_dates(df, first, last))
+        t1 = bench('dates x{} - offsets'.format(times), lambda: models.select_rows_by_dates(df, first, last, offsets=offsets))
+        print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+        t0 = bench('nations x{} - isin'.format(times), lambda: models.subset_rows_by_nations(df, ['C007', 'C014']))
+        t1 = bench('nations x{} - offsets'.format(times), lambda: models.subset_rows_by_nations(df, ['C007', 'C014'], offsets=offsets))
+        print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+
+
+def bench_ranking(fname):
+    '''15 worst countries per capita in a time interval: rows grouped by country vs running totals'''
+    df = models.world_shape(pd.read_csv(fname))
+    ids = sorted(df['geoId'].unique())
+    for id in ids:                                                      # population of entities is from GeoEntities
+        models.GeoEntities.set_entity(id, {'type': 'nation', 'population': df.loc[df['geoId']==id, 'popData2019'].iloc[0]})
+    first, last = (date(2020, 6, 1), date(2020, 9, 30),)
+    ranking = models.Ranking(models.Cube(df, 'popData2019'))
+
+    bench('ranking - build (once, at load)', lambda: models.Ranking(ranking.cube))
+    t0 = bench('worst - select rows + groupby', lambda: models.worst_countries(df, 'cases', ids, 1, 15, True, first, last))
+    t1 = bench('worst - Ranking.top', lambda: models.worst_countries(df, 'cases', ids, 1, 15, True, first, last, ranking=ranking))
+    print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+    for id in ids:
+        models.GeoEntities.del_entity(id)
+
+
+def bench_normalize(fname):
+    '''totals of all countries per capita: a division for each country vs a population vector'''
+    df = models.world_shape(pd.read_csv(fname))
+    ids = sorted(df['geoId'].unique())
+    for id in ids:                                                      # population of entities is from GeoEntities
+        models.GeoEntities.set_entity(id, {'type': 'nation', 'population': df.loc[df['geoId']==id, 'popData2019'].iloc[0]})
+    totals = df.groupby(['geoId'])['cases'].sum()
+
+    def by_loops():
+        ndf = totals.astype(np.float64)                                 # as up to ver.1.3
+        for country in ndf.index.to_list():
+            try:
+                ndf.at[country] = ndf.at[country] / models.GeoEntities.get_entity_att(country, 'population')
+            except:
+                ndf = ndf.drop(index=country)
+
+    def vectorized():
+        population = models.GeoEntities.get_population(totals.index)
+        ndf = totals.astype(np.float64) / population
+        ndf[~np.isnan(population)]
+
+    t0 = bench('normalize - division for each country', by_loops)
+    t1 = bench('normalize - GeoEntities.get_population', vectorized)
+    print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+    for id in ids:
+        models.GeoEntities.del_entity(id)
+
+
+def bench_last_values(fname):
+    '''last values of 27 countries x 2 fields: a backward walk for each column vs one pass'''
+    df = models.world_shape(pd.read_csv(fname))
+    ids = ['C{:03d}'.format(n) for n in range(0, 27*7, 7)]
+    ndf = models.subset_cols(models.subset_rows_by_nations(df, ids), ['dateRep', 'countriesAndTerritories', 'cases', 'deaths'])
+    ndf = ndf[~((ndf['countriesAndTerritories']=='Country_007') & (ndf['dateRep']>pd.Timestamp(2020, 10, 1)))]   # nan in last row
+    names = ndf['countriesAndTerritories'].drop_duplicates().to_list()
+
+    def by_loops():
+        ndf1 = pd.pivot_table(ndf.groupby(['dateRep', 'countriesAndTerritories']).sum(), index='dateRep', columns='countriesAndTerritories')
+        for field in ['cases', 'deaths']:                               # as up to ver.1.3
+            ndf1[field] = ndf1[field].cumsum()
+        for field, country in ndf1.columns.to_list():
+            nrow, ncol = ndf1.shape
+            valid_row = -1
+            while pd.isnull(ndf1.iloc[valid_row][field, country]) and (valid_row+nrow) > 0:
+                valid_row -= 1
+            if valid_row==-1 or (valid_row+nrow)==0:
+                continue
+            ndf1.iloc[-1][field, country] = ndf1.iloc[valid_row][field, country]
+        ndf1 = ndf1.iloc[-1:]
+        resultdf = pd.DataFrame()
+        for col, row in ndf1.columns.to_list():
+            resultdf.at[row, col] = ndf1[(col, row)].iloc[0]
+        resultdf.to_html(buf=None, float_format="{:n}".format)
+
+    t0 = bench('last values - backward walk + cell by cell transpose', by_loops)
+    t1 = bench('last values - table_last_values', lambda: views.table_last_values(ndf, names, ['cases', 'deaths']))
+    print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+
+
+def bench_query_result(fname):
+    '''graph page of 27 countries x 2 fields: chart and tables grouping and pivoting rows each vs a shared QueryResult'''
+    df = models.world_shape(pd.read_csv(fname))
+    ids = ['C{:03d}'.format(n) for n in range(0, 27*7, 7)]
+    ndf = models.subset_cols(models.subset_rows_by_nations(df, ids), ['dateRep', 'countriesAndTerritories', 'cases', 'deaths'])
+    names = ndf['countriesAndTerritories'].drop_duplicates().to_list()
+    fields = ['cases', 'deaths']
+
+    def each_one():
+        models.calculate_cumulative_sum(ndf.groupby(['dateRep', 'countriesAndTerritories']).sum(), fields)   # as up to ver.1.3: the chart ...
+        views.table_nations(ndf, names, fields)                                                            # ... and every table by itself
+        views.table_last_values(ndf, names, fields)
+
+    def shared():
+        result = views.QueryResult(ndf, fields)
+        result.chart
+        views.table_nations(ndf, names, fields, result=result)
+        views.table_last_values(ndf, names, fields, result=result)
+
+    t0 = bench('graph page - chart and tables by themselves', each_one)
+    t1 = bench('graph page - shared QueryResult', shared)
+    print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+
+
+def bench_lazy(fname):
+    '''graph page of all the countries: rows of all of them vs a LazyResult folding them one at a time'''
+    df = models.world_shape(pd.read_csv(fname))
+    cube = models.Cube(df, 'popData2019')
+    ids = sorted(df['geoId'].unique())
+    columns = ['cases', 'deaths', 'cases/day']
+
+    def eager():
+        ndf = models.subset_cols(cube.rows(ids), ['dateRep', 'countriesAndTerritories'] + columns)
+        result = views.QueryResult(ndf, columns)
+        cube.pivot(columns, ids)
+        views.table_nations(ndf, [], columns, result=result)
+        views.table_last_values(ndf, [], columns, result=result)
+
+    def lazy():
+        result = views.LazyResult(cube, ids, columns)
+        for column in columns:
+            for line in result.lines(column):
+                pass
+        views.table_nations(None, [], columns, result=result)
+        views.table_last_values(None, [], columns, result=result)
+
+    t0 = bench('all countries - rows and pivot of all of them', eager)
+    t1 = bench('all countries - LazyResult', lazy)
+    print('{:<60} {:>10}'.format('speed up', 'x{:.1f}'.format(t0/t1)))
+    m0 = peak('all countries memory - rows and pivot of all of them', eager)
+    m1 = peak('all countries memory - LazyResult', lazy)
+    print('{:<60} {:>10}'.format('less memory', 'x{:.1f}'.format(m0/m1)))
+
+
+def bench_render(fname, charts=8, threads=4):
+    '''charts of 15 countries from 4 threads: drawn in the threads (they hold the GIL) vs in a pool of 4 processes'''
+    df = models.world_shape(pd.read_csv(fname))
+    cube = models.Cube(df, 'popData2019')
+    ids = ['C{:03d}'.format(n) for n in range(0, 15*7, 7)]
+    ndf = cube.pivot(['cases', 'deaths'], ids)
+    names = ndf.columns.get_level_values(1).drop_duplicates().to_list()
+    spec, mc = views.chart_spec(ndf, names, ['cases', 'deaths'])
+    pool = render.RenderPool(processes=threads, timeout=60, queue=charts)
+    pool.draw(spec)                                                     # workers start and warm up
+
+    def by_threads(draw):
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(lambda n: draw(spec), range(charts)))
+
+    try:
+        t0 = bench('render - {} charts in {} threads'.format(charts, threads), lambda: by_threads(render.draw_chart), repeat=3)
+        t1 = bench('render - {} charts in a pool of {} processes'.format(charts, threads), lambda: by_threads(pool.draw), repeat=3)
+    finally:
+        pool.shutdown()
+    print('{:<60} {:>10}'.format('speed up (with {} cpus)'.format(os.cpu_count()), 'x{:.1f}'.format(t0/t1)))
+
+
+def bench_chart_json(fname):
+    '''a chart of 15 countries, with delta: drawn on the server as svg vs its json data, drawn in the browser'''
+    df = models.world_shape(pd.read_csv(fname))
+    cube = models.Cube(df, 'popData2019')
+    ids = ['C{:03d}'.format(n) for n in range(0, 15*7, 7)]
+    fields = ['cases', '\N{Greek Capital Letter Delta}cases/day']
+    ndf = cube.pivot(fields, ids)
+    names = ndf.columns.get_level_values(1).drop_duplicates().to_list()
+    spec, mc = views.chart_spec(ndf, names, fields)
+    svg = render.draw_chart(spec, 'svg').encode('utf-8')
+    data = views.chart_json(spec).encode('utf-8')
+    t0 = bench('chart - svg (matplotlib, on the server)', lambda: render.draw_chart(spec, 'svg'), repeat=3)
+    t1 = bench('chart - json (data, the browser draws them)', lambda: views.chart_json(spec), repeat=3)
+    print('{:<60} {:>10}'.format('speed up', 'x{:.0f}'.format(t0/t1)))
+    print('{:<60} {:>9.0f}kB'.format('chart - svg size', len(svg)/1024))
+    print('{:<60} {:>9.0f}kB'.format('chart - json size', len(data)/1024))
+
+
+def peak(label, func):
+    '''print and return the peak of memory, in bytes, allocated by a call of func'''
+    tracemalloc.start()
+    func()
+    size, top = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<60} {:9.1f}MB'.format(label, top/2**20))
+    return top
+
+
+def bench_memory(fname):
+    '''memory of a request (rows of 27 countries, all fields): deep copies in every stage vs projections'''
+    df = models.world_shape(pd.read_csv(fname))
+    ids = ['C{:03d}'.format(n) for n in range(0, 27*7, 7)]
+    rows = models.Cube(df, 'popData2019').rows(ids)
+    delta = '\N{Greek Capital Letter Delta}cases/day'
+    flds = ['dateRep', 'countriesAndTerritories', 'cases', 'deaths', 'cases/day', delta]
+    names = rows['countriesAndTerritories'].drop_duplicates().to_list()
+
+    def with_copies():
+        ddf = rows.copy(deep=True)                                      # as up to ver.1.3: add_cols ...
+        ddf['cases/day'] = ddf['cases']
+        ddf[delta] = ddf['cases'] - ddf['cases'].shift(-1)
+        sdf = ddf.copy(deep=True)                                       # ... subset_cols ...
+        for col in ddf.columns:
+            if col not in flds:
+                del sdf[col]
+        ndf = sdf.groupby(['dateRep', 'countriesAndTerritories']).sum()
+        cdf = pd.pivot_table(ndf.copy(deep=True), index='dateRep', columns='countriesAndTerritories')   # ... calculate_cumulative_sum ...
+        for field in ['cases', 'deaths']:
+            cdf[field] = cdf[field].cumsum()
+        tdf = sdf.copy(deep=True)                                       # ... table_nations ...
+        del tdf['cases/day']
+        tdf['week'] = tdf['dateRep'].dt.isocalendar().week if hasattr(tdf['dateRep'].dt, 'isocalendar') else tdf['dateRep'].dt.week
+        tdf['year'] = tdf['dateRep'].dt.year
+        pd.pivot_table(tdf.groupby(['year', 'week', 'countriesAndTerritories']).mean(numeric_only=True),
+                       index=['year', 'week'], columns='countriesAndTerritories').to_html()
+        ldf = sdf.copy(deep=True)                                       # ... and table_last_values
+        pd.pivot_table(ldf.groupby(['dateRep', 'countriesAndTerritories']).sum(), index='dateRep', columns='countriesAndTerritories')
+
+    def with_projections():
+        ddf = models.add_cols(rows, ['cases/day', delta])
+        sdf = models.subset_cols(ddf, flds)
+        models.calculate_cumulative_sum(sdf.groupby(['dateRep', 'countriesAndTerritories']).sum(), ['cases', 'deaths'])
+        views.table_nations(sdf, names, ['cases', 'deaths', 'cases/day', delta])
+        views.table_last_values(sdf, names, ['cases', 'deaths', 'cases/day', delta])
+
+    m0 = peak('request memory - deep copy in every stage', with_copies)
+    m1 = peak('request memory - projections', with_projections)
+    print('{:<60} {:>10}'.format('less memory', 'x{:.1f}'.format(m0/m1)))
+
+
+BENCHMARKS = [bench_world_shape, bench_snapshot, bench_cube, bench_overlap, bench_update, bench_aggregates, bench_remember,
+              bench_offsets, bench_ranking, bench_normalize, bench_last_values, bench_memory,
+              bench_query_result, bench_lazy, bench_render, bench_chart_json, ]
+
+
+if __name__ == '__main__':
+    # we need to add the project directory to pythonpath to find covid module in development PC without installing it
+    basedir, _ = os.path.split(os.path.abspath(os.path.dirname(__file__)).replace('\\', '/'))
+    sys.path.insert(1, basedir)              # ndx==1 because 0 is reserved for local directory
+    from covid import models                 # NOW we find covid module if we import it
+    from covid import render
+
+    app = Flask('benchmarks')
+    app.config['D_FMT2'] = D_FMT2
+    Babel(app)                               # views and forms translate their labels
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, 'covid19-worldwide.csv')
+        print('synthetic data: {} rows x {} columns'.format(*make_csv(fname)))
+        with app.app_context():
+            from covid import views          # forms need an application context to be imported
+            for benchmark in BENCHMARKS:
+                print('--- {}'.format(benchmark.__doc__))
+                benchmark(fname)
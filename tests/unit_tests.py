@@ -4,11 +4,16 @@
 
 # import std libs
 from datetime import datetime, date, timedelta
+import json
 import os
+import shutil
 import sys
+import tempfile
+import time
 import unittest
 
 # import 3rd parties libs
+import numpy  as np
 import pandas as pd
 from flask              import current_app, g, request, url_for
 from flask_wtf          import FlaskForm
@@ -79,6 +84,15 @@ class URLsTest(unittest.TestCase):
         self.assertEqual(arguments['first'], '2020-01-01')
         self.assertEqual(arguments['last'], '2020-03-31')
 
+    def test_chart_url_resolves_to_draw_chart_view(self):
+        ''' /chart/<contest>/<ids>/<fields>/<normalize>/<overlap>/<first>/<last>/<remember>.<fmt>  -> views.draw_chart'''
+        with self.app.test_request_context('/chart/nations/it-fr/cases/false/false/2020-01-01/2020-03-31/false.svg'):
+            urls = self.app.url_map.bind_to_environ(request.environ)
+            endpoint, arguments = urls.match('/chart/nations/it-fr/cases/false/false/2020-01-01/2020-03-31/false.svg', 'GET')
+        self.assertEqual(endpoint, 'views.draw_chart')
+        self.assertEqual(arguments['remember'], 'false')
+        self.assertEqual(arguments['fmt'], 'svg')
+
 
 class GeoEntitiesTest(unittest.TestCase):
     '''testing models.GeoEntities'''
@@ -102,6 +116,25 @@ class GeoEntitiesTest(unittest.TestCase):
         models.GeoEntities.del_entity('g')
         self.assertEqual(len(models.GeoEntities), length)
 
+    def test_entity_record(self):
+        models.GeoEntities.set_entity('g', {'type': 'person', 'name': 'goofy', 'nations': ['IT', 'FR'], 'friend': 'mickey'})
+        try:
+            e = models.GeoEntities.get_entity('g')
+            self.assertIsInstance(e, models.GeoEntity)
+            self.assertEqual(e['nations'], ('IT', 'FR'))                  # nations as a tuple
+            self.assertEqual(e.get('friend'), 'mickey')                  # an attribute out of slots
+            self.assertIsNone(e.get('population'))
+            with self.assertRaises(KeyError):
+                e['population']
+            self.assertEqual(e.to_dict(), {'type': 'person', 'name': 'goofy', 'nations': ['IT', 'FR'], 'friend': 'mickey'})
+            with tempfile.TemporaryDirectory() as tmpdir:               # to json and back
+                fname = os.path.join(tmpdir, 'geoentities.json')
+                models.GeoEntities.write_to_json(fname)
+                models.GeoEntities.load_from_json(fname)
+            self.assertEqual(models.GeoEntities.get_entity('g'), e)
+        finally:
+            models.GeoEntities.del_entity('g')
+
     def test_set_entity_att(self):
         models.GeoEntities.set_entity_att('AF', 'name', 'AFGHANISTAN')
         n = models.GeoEntities.get_entity_att('AF', 'name')
@@ -148,6 +181,31 @@ class GeoEntitiesTest(unittest.TestCase):
         oc = es.get_entities_by_att('original_country', True)
         self.assertEqual(len(oc), 210)
         
+    def test_indexes(self):
+        scan = tuple(id for id in models.GeoEntities().keys() if models.GeoEntities.get_entity_att(id, 'type')=='continent')
+        self.assertEqual(models.GeoEntities.get_ids_by_att('type', 'continent'), scan)      # by index as by scan
+        self.assertIn('EU', models.GeoEntities.get_areas_of('IT'))                           # nation -> its areas
+        es = models.GeoEntities(ids=['AF', 'Asia', 'AL'])
+        self.assertEqual(es.get_entities_by_att('type', 'nation').keys(), ['AF', 'AL'])      # a subset keeps its order
+        models.GeoEntities.set_entity('Big_Italy', {'type': 'nation', 'name': 'Big_Italy', 'nations': ['IT', 'SM']})
+        try:                                                                                  # indexes follow changes
+            self.assertIn('Big_Italy', models.GeoEntities.get_ids_by_att('type', 'nation'))
+            self.assertIn('Big_Italy', models.GeoEntities.get_areas_of('IT'))
+        finally:
+            models.GeoEntities.del_entity('Big_Italy')
+        self.assertNotIn('Big_Italy', models.GeoEntities.get_areas_of('IT'))
+
+    def test_get_population(self):
+        models.GeoEntities.set_entity('g', {'type': 'nation', 'name': 'goofy', 'population': None})
+        try:
+            population = models.GeoEntities.get_population(['AF', 'g', 'XX'])
+            self.assertEqual(population[0], models.GeoEntities.get_entity_att('AF', 'population'))
+            self.assertTrue(np.isnan(population[1:]).all())                        # missing population, unknown entity
+            models.GeoEntities.set_entity_att('g', 'population', 1000)
+            self.assertEqual(models.GeoEntities.get_population(['g'])[0], 1000.0)  # populations follow changes
+        finally:
+            models.GeoEntities.del_entity('g')
+
     def test_get_entities_att(self):
         es = models.GeoEntities()
         noc = es.get_entities_by_att('original_country', False)
@@ -177,7 +235,7 @@ class ModelsTest(unittest.TestCase):
     def setUp(self):
         self.app = create_app({ 'TESTING': True, 'DATA_FILE': 'covid_data_test.csv'})
         self.df = pd.DataFrame(utd.d)
-        self.df['dateRep'] = self.df['dateRep'].map(lambda x: datetime.strptime(x, '%d/%m/%Y').date()) # from str to date
+        self.df['dateRep'] = pd.to_datetime(self.df['dateRep'], format='%d/%m/%Y')  # from str to datetime64, as world_shape
         
     def tearDown(self):
         pass
@@ -194,7 +252,89 @@ class ModelsTest(unittest.TestCase):
             self.assertIsInstance(df, pd.DataFrame)             # this could be outside the "with" environment
             self.assertIsInstance(g.df, pd.DataFrame)           #< g MUST be inside an application context
         #print("df shape: {}".format(df.shape))
-    
+
+    def test_datastore(self):
+        fname = self.app.config['DATA_DIR']+'/'+self.app.config['DATA_FILE']
+        with self.app.test_request_context('/'):
+            df1 = models.open_df(fname, pd.read_csv, models.world_shape)
+        with self.app.test_request_context('/'):
+            df2 = models.open_df(fname, pd.read_csv, models.world_shape)
+            self.assertEqual(g.dataset.first, df2['dateRep'].min().date())
+            self.assertEqual(g.dataset.countries, df2['countriesAndTerritories'].drop_duplicates().count())
+        self.assertIs(df1, df2)                                    # the same dataframe is shared by requests
+        st = os.stat(fname)
+        os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns + 1))   # as the file was replaced
+        try:
+            with self.app.test_request_context('/'):
+                df3 = models.open_df(fname, pd.read_csv, models.world_shape)
+            self.assertIsNot(df1, df3)                             # so the dataframe is reloaded
+        finally:
+            os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, self.app.config['DATA_FILE'])
+            shutil.copy(self.app.config['DATA_DIR']+'/'+self.app.config['DATA_FILE'], fname)
+            with self.app.test_request_context('/'):
+                sname = models.snapshot_df(fname)
+                stamp = models.file_stamp(fname)
+                df = models.read_snapshot(sname, stamp, 'world_shape')
+                pd.testing.assert_frame_equal(df, models.world_shape(pd.read_csv(fname)), check_dtype=False)
+                self.assertEqual(df['cases'].dtype, 'int32')
+                self.assertIsNone(models.read_snapshot(sname, stamp, 'another_shaper'))
+                self.assertIsNone(models.read_snapshot(sname, (stamp[0]+1, stamp[1]), 'world_shape'))  # out of date
+
+    def test_cube(self):
+        cube = models.Cube(self.df, 'popData2019')
+        ndf = cube.rows(['BY', 'RU'], date(2020, 3, 1), date(2020, 3, 31))
+        self.assertEqual(ndf.shape, (4,11))
+        ndf = cube.rows(['EU'], date(2020, 3, 1), date(2020, 3, 31))               # an area ...
+        self.assertEqual(ndf.shape, (2,11))
+        self.assertEqual(ndf['cases'].sum(), 400)                                    # ... sums its nations (AT, IT)
+        ndf = cube.rows(['AT'], date(2020, 3, 26), date(2020, 4, 30), remember=True)
+        self.assertEqual(ndf.iloc[0]['cases'], 100)
+        ndf = cube.pivot(['cases', 'deaths'], ['AF', 'AL'])
+        odf = models.calculate_cumulative_sum(models.subset_cols(self.df[self.df['geoId'].isin(['AF', 'AL'])],
+                                                                 ['dateRep', 'countriesAndTerritories', 'cases', 'deaths']),
+                                              ['cases', 'deaths'])
+        pd.testing.assert_frame_equal(ndf, odf[ndf.columns], check_dtype=False)   # the same of the pivot of rows
+        columns = ['cases', 'cases/day', '\N{Greek Capital Letter Delta}cases/day']
+        for first, remember in ((None, False), (date(2020, 3, 26), False), (date(2020, 4, 25), True)):
+            rdf = models.add_cols(cube.rows(['AF', 'AT', 'EU'], first, remember=remember), columns[1:])
+            rdf = models.subset_cols(rdf, ['dateRep', 'countriesAndTerritories'] + columns)
+            cdf = cube.pivot(columns, ['AF', 'AT', 'EU'], first, remember=remember)
+            pd.testing.assert_frame_equal(cdf, views.QueryResult(rdf, columns).chart.reindex(columns=cdf.columns), check_dtype=False)   # a delta
+        self.assertTrue(np.isnan(cdf.iloc[0][('\N{Greek Capital Letter Delta}cases/day', 'Afghanistan')]))   # without previous day is nan
+        names = []
+        for name, present, edf in cube.entities(['cases', 'deaths'], ['AF', 'AL']):   # an entity at a time ...
+            names.append(name)
+            pd.testing.assert_frame_equal(edf, ndf.xs(name, axis='columns', level=1))   # ... the same of the pivot
+            self.assertTrue((present == ndf[('cases', name)].notnull().values).all())
+        self.assertEqual(names, ['Afghanistan', 'Albania'])
+        self.assertTrue(cube.covers(['AF', 'EU', 'Europe']))
+        self.assertFalse(cube.covers(['AF', 'PP']))
+
+    def test_cube_extended(self):
+        old = self.df[self.df['dateRep'] < pd.Timestamp(2020, 4, 25)]
+        diff = models.diff_df(old, self.df)                                          # new data only append a day ...
+        self.assertTrue(diff['appendable'])
+        self.assertEqual(len(diff['added']), 3)
+        cube = models.Cube(old, 'popData2019')
+        self.assertTrue(cube.appends(self.df))
+        cube, full = (cube.extended(self.df), models.Cube(self.df, 'popData2019'),)
+        pd.testing.assert_index_equal(cube.dates, full.dates)                        # ... so the cube is extended
+        np.testing.assert_array_equal(cube.present, full.present)
+        for field in models.CUBE_FIELDS:
+            np.testing.assert_array_equal(cube.daily[field], full.daily[field])
+            np.testing.assert_array_equal(cube.total[field], full.total[field])
+        new = self.df.copy()
+        new.loc[(new['geoId'] == 'IT') & (new['dateRep'] == pd.Timestamp(2020, 3, 26)), 'cases'] = 301
+        diff = models.diff_df(self.df, new)                                          # a past day is corrected
+        self.assertFalse(diff['appendable'])
+        self.assertFalse(full.appends(new))
+        self.assertEqual(diff['changed'].iloc[0]['cases_new'], 301)
+        self.assertIn('rows added: 0, removed: 0, changed: 1', models.diff_report(diff))
+
     def test_get_areas(self):
         ids = models.get_areas(['IT'], direct=False)
         self.assertEqual(len(ids), 1)
@@ -233,6 +373,16 @@ class ModelsTest(unittest.TestCase):
         self.assertEqual(ndf.shape, (4, 11))
         models.GeoEntities.del_entity('Big_Russia')
         
+    def test_aggregate_rows(self):
+        groups = models.continents_groups(self.df, ['Europe', 'Asia']) + models.areas_groups(['EU', 'PP'])
+        ndf = models.aggregate_rows(self.df, groups, 'popData2019')             # continents and areas in one pass
+        self.assertEqual(ndf['geoId'].drop_duplicates().to_list(), ['Europe', 'Asia', 'EU'])
+        eu = ndf[ndf['geoId']=='EU']
+        self.assertEqual(eu['cases'].sum(), 400)                                # AT and IT ...
+        europe = ndf[ndf['geoId']=='Europe']
+        self.assertEqual(europe[europe['dateRep']==pd.Timestamp(2020, 3, 26)]['cases'].iloc[0], 450)   # ... are in Europe too
+        self.assertEqual(europe['popData2019'].iloc[0], self.df[self.df['continentExp']=='Europe'].drop_duplicates('geoId')['popData2019'].sum())
+
     def test_select_rows_by_dates(self):
         '''test select_row_by_dates'''
         ndf = models.select_rows_by_dates(self.df, date(2020, 3, 1), date(2020, 3, 31))
@@ -242,16 +392,56 @@ class ModelsTest(unittest.TestCase):
         #cases = ndf[ndf['countriesAndTerritories']=='Austria']['cases'].values.item()
         cases = ndf[ndf['countriesAndTerritories']=='Austria'].iloc[0]['cases']
         self.assertEqual(cases, 100)
+        ndf = models.select_rows_by_dates(self.df, date(2020, 4, 25), date(2020, 4, 30), remember=True)
+        self.assertEqual(ndf.shape, (3,11))                                    # countries without rows in interval stay out
+        self.assertEqual(ndf[ndf['geoId']=='AF']['cases'].to_list(), [70+105])
+        self.assertEqual(ndf[ndf['geoId']=='AL']['deaths'].to_list(), [1+1])
+        self.assertEqual(models.select_rows_by_dates(self.df, date(2020, 4, 25), date(2020, 4, 30))['cases'].sum(), 70+15+6)   # self.df untouched
+
+    def test_offsets(self):
+        self.assertFalse(models.Offsets.is_sorted(self.df))                    # as in data file: dates in descending order
+        with self.assertRaises(ValueError):
+            models.Offsets(self.df)
+        df = models.sort_rows(self.df)
+        self.assertIs(models.sort_rows(df), df)
+        offsets = models.Offsets(df)
+        self.assertTrue(offsets.applies(df))
+        self.assertEqual(offsets.take(['RU', 'AF', 'XX'])['geoId'].to_list(), ['AF', 'AF', 'RU', 'RU'])
+        self.assertEqual(len(offsets.positions(first=date(2020, 4, 25))), 3)
+        self.assertEqual(len(offsets.positions(last=date(2020, 3, 1))), 0)
+        for first, last in ((date(2020, 3, 1), date(2020, 3, 31)), (date(2020, 3, 26), date(2020, 4, 24)), (date(2020, 4, 25), date(2020, 4, 30))):
+            for remember in (False, True):
+                ndf = models.select_rows_by_dates(df, first, last, remember, offsets=offsets)
+                self.assertTrue(ndf.reset_index(drop=True).equals(models.select_rows_by_dates(df, first, last, remember).reset_index(drop=True)))
+        ndf = models.subset_rows_by_nations(df, ['AT', 'IT'], offsets=offsets)
+        self.assertTrue(ndf.equals(models.subset_rows_by_nations(df, ['AT', 'IT'])))
 
     def test_subset_cols(self):
         ndf = models.subset_cols(self.df, ['dateRep', 'countriesAndTerritories', 'cases'])
         self.assertEqual(len(ndf.columns), 3)
         ndf = models.subset_cols(self.df, ['dateRep', 'countriesAndTerritories', 'cases'], direct=False)
         self.assertEqual(len(ndf.columns), 11-3)
-        
+
+    def test_add_cols(self):
+        delta = '\N{Greek Capital Letter Delta}cases/day'
+        ndf = models.add_cols(self.df, ['cases/day', delta])
+        self.assertEqual(len(ndf.columns), 11+2)
+        self.assertTrue(ndf['cases/day'].equals(self.df['cases']))
+        self.assertEqual(ndf.groupby('countriesAndTerritories')[delta].apply(lambda s: s.isnull().sum()).to_list(), [1]*self.df['countriesAndTerritories'].nunique())   # no delta at the first day of a country
+        shuffled = models.add_cols(self.df.sample(frac=1, random_state=1), [delta])
+        self.assertTrue(shuffled[delta].sort_index().equals(ndf[delta]))                 # independent from the order of rows
+
     def test_calculate_cumulative_sum(self):
         ndf = models.calculate_cumulative_sum(self.df, ['cases','deaths'])
         self.assertEqual(ndf.shape, (4,42))
+        df = self.df[['dateRep', 'countriesAndTerritories', 'popData2019', 'cases']].copy()
+        df.loc[df['countriesAndTerritories']=='Italy', 'popData2019'] = np.nan           # an entity without population
+        ndf = models.calculate_cumulative_sum(df, ['cases'], normalize=True)
+        self.assertEqual(ndf.columns.get_level_values(0).drop_duplicates().to_list(), ['cases'])
+        self.assertEqual(ndf[('cases', 'Austria')].max(), 100/8858775)
+        self.assertTrue(ndf[('cases', 'Italy')].isnull().all())
+        gdf = models.calculate_cumulative_sum(df.groupby(['dateRep', 'countriesAndTerritories']).sum(), ['cases'], normalize=True)
+        self.assertTrue(gdf.equals(ndf))                                                 # countries as index level, as build_data gives them
      
     def test_suggest_threshold(self):
         ndf = self.df.groupby(['dateRep', 'countriesAndTerritories']).sum()
@@ -262,6 +452,14 @@ class ModelsTest(unittest.TestCase):
         ndf = self.df.set_index(['dateRep', 'countriesAndTerritories'])
         ndf = models.calculate_cumulative_sum_with_overlap(ndf, column='cases', threshold=1)
         self.assertEqual(ndf.shape, (2, 3))
+        cdf = models.cumulate_by_country(self.df.set_index(['dateRep', 'countriesAndTerritories']), column='cases')
+        sdf, missing = models.align_by_threshold(cdf, threshold=1)
+        self.assertEqual(sdf[('cases', 'Afghanistan')].to_list(), [105, 175])
+        self.assertEqual(len(missing), 4)                         # Austria, ... have only one day over threshold
+        self.assertIn(('cases', 'Austria'), missing)
+        sdf, missing = models.align_by_threshold(cdf, threshold=10**6)
+        self.assertIsNone(sdf)
+        self.assertEqual(len(missing), 7)
 
         with self.app.test_request_context('/'):      # create a request context which in turn creates an application context
             df = models.open_df(self.app.config['DATA_DIR']+'/'+self.app.config['DATA_FILE'],
@@ -280,6 +478,9 @@ class ModelsTest(unittest.TestCase):
         adf = pd.DataFrame({'A': ['A0', 'A1'], 'B': ['B0', 'B1'],})
         ndf = models.stretch(adf, 3)
         self.assertEqual(ndf.shape, (3, 2))
+        self.assertEqual(ndf.index.to_list(), [0, 1, 2])
+        self.assertTrue(ndf.iloc[2].isnull().all())
+        self.assertIs(models.stretch(ndf, 2), ndf)                    # already high enough
 
     def test_worst_countries(self):
         l = models.worst_countries(self.df, 'cases', ['AF', 'AL'], 1, 1)
@@ -293,6 +494,27 @@ class ModelsTest(unittest.TestCase):
         with self.assertRaises(ValueError):
             models.worst_countries(self.df, 'cases', ['AF', 'AL'], 2, 1)
 
+    def test_ranking(self):
+        ranking = models.Ranking(models.Cube(self.df, 'popData2019'))
+        self.assertTrue(ranking.has('cases'))
+        self.assertEqual(ranking.top('cases', ['AT', 'IT', 'BY', 'AF', 'XX'], 1, 2), ['IT', 'AF'])
+        self.assertEqual(ranking.top('cases', ['AT', 'IT', 'BY', 'AF'], 1, 4, first=date(2020, 3, 1), last=date(2020, 3, 31)), ['IT', 'AT', 'BY'])
+        self.assertEqual(ranking.top('cases', ['AT', 'BY', 'RU'], 2, 3, first=date(2020, 3, 25), last=date(2020, 3, 25)), ['BY', 'RU'])   # all 0: ties in given order
+        self.assertEqual(ranking.top('cases', ['AT', 'IT'], 1, 2, first=date(2020, 4, 1)), [])                     # no data in time interval
+        for countries in (['AF', 'AL'], ['AF', 'AL', 'EU', 'RU', 'PP']):                    # totals from the ranking ...
+            for normalize in (False, True):
+                for first, last in ((None, None), (date(2020, 3, 26), None), (None, date(2020, 4, 24))):
+                    self.assertEqual(models.worst_countries(self.df, 'cases', countries, 1, 2, normalize, first, last, ranking=ranking),
+                                     models.worst_countries(self.df, 'cases', countries, 1, 2, normalize, first, last))   # ... rank as rows
+        population = models.GeoEntities.get_entity_att('IT', 'population')
+        models.GeoEntities.del_entity_att('IT', 'population')
+        try:
+            ranking = models.Ranking(models.Cube(self.df, 'popData2019'))
+            for r in (ranking, None):                                                       # without population: last, not left out
+                self.assertEqual(models.worst_countries(self.df, 'cases', ['IT', 'AT', 'BY'], 1, 3, True, ranking=r), ['AT', 'BY', 'IT'])
+        finally:
+            models.GeoEntities.set_entity_att('IT', 'population', population)
+
 
 class ViewsTest(unittest.TestCase):
     '''this is to test views'''
@@ -304,7 +526,7 @@ class ViewsTest(unittest.TestCase):
                                 'DATA_FILE': 'covid_data_test.csv',
                                 'WTF_CSRF_ENABLED': False, })
         self.df = pd.DataFrame(utd.d)
-        self.df['dateRep'] = self.df['dateRep'].map(lambda x: datetime.strptime(x, '%d/%m/%Y').date()) # from str to date
+        self.df['dateRep'] = pd.to_datetime(self.df['dateRep'], format='%d/%m/%Y')  # from str to datetime64, as world_shape
         
     def tearDown(self):
         pass
@@ -329,6 +551,18 @@ class ViewsTest(unittest.TestCase):
         self.assertIn('<title>Select country</title>', html)
         self.assertTrue(html.endswith('</html>'))
         
+    def test_select_choices(self):
+        ''' /select by GET twice -> choices and countries picker from cache'''
+        views.GRAPHS.clear()
+        with self.app.test_client() as client:
+            html1 = client.get('/select').data
+            html2 = client.get('/select').data
+            pages = g.dataset.pages
+        self.assertEqual(html1, html2)
+        self.assertEqual(len(views.GRAPHS), 0)                           # not in the charts cache ...
+        self.assertEqual(sorted(name for locale, name in pages), ['countries_picker', 'select'])   # ... but in the dataset
+        self.assertIn('id="nations"', html2.decode('utf8'))
+
     def test_select_view_by_post(self):
         ''' /select by POST     -> views.select'''
         with self.app.test_client() as client:
@@ -380,6 +614,77 @@ class ViewsTest(unittest.TestCase):
             with self.app.test_client() as client:
                 response = client.get('/graph/nations/AF-AL/cases/True/True/2020-04-24/2020-04-30/False')
 
+    def test_draw_chart_view(self):
+        ''' /chart/nations/AF/cases/False/False/2020-04-24/2020-04-24/False.svg      -> views.draw_chart'''
+        url = '/chart/nations/AF/cases/False/False/2020-04-24/2020-04-24/False.svg'
+        with self.app.test_client() as client:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'image/svg+xml')
+            self.assertTrue(response.data.startswith(b'<svg '))
+            etag, weak = response.get_etag()
+            self.assertFalse(weak)
+            self.assertIn('max-age', response.headers['Cache-Control'])
+            response = client.get(url, headers={'If-None-Match': '"{}"'.format(etag)})
+            self.assertEqual(response.status_code, 304)                              # not modified
+            response = client.get(url.replace('.svg', '.png'))
+            self.assertEqual(response.mimetype, 'image/png')
+            self.assertNotEqual(response.get_etag()[0], etag)
+        app = create_app({'TESTING': True, 'DATA_FILE': 'covid_data_test.csv',
+                          'RENDER_PROCESSES': 1, 'RENDER_QUEUE': 0, })                # a busy pool of workers ...
+        try:
+            with app.test_client() as client:
+                response = client.get(url.replace('/AF/', '/AL/'))
+                self.assertEqual(response.status_code, 503)                          # ... and we do not wait for it
+        finally:
+            views.init_app(self.app)                                                 # the pool is of the process
+
+    def test_query_data(self):
+        ''' a page and its image: data are built once'''
+        views.GRAPHS.clear()
+        built = []
+        build_data = views.build_data
+        views.build_data = lambda **params: built.append(params) or build_data(**params)
+        try:
+            with self.app.test_client() as client:
+                response = client.get('/graph/nations/AF-AL/cases/False/False/2020-04-24/2020-04-25/False')
+                self.assertEqual(response.status_code, 200)
+                response = client.get('/chart/nations/AF-AL/cases/False/False/2020-04-24/2020-04-25/False.svg')
+                self.assertEqual(response.status_code, 200)
+        finally:
+            views.build_data = build_data
+        self.assertEqual(len(built), 1)
+        self.assertTrue(views.GRAPHS.stats()['bytes'] >= len(response.data))
+
+    def test_chart_json_view(self):
+        ''' /chart/nations/AF-AL/cases/False/False/2020-04-24/2020-04-25/False.json  -> views.draw_chart
+            //graph/nations/AF-AL/cases/False/False/2020-04-24/2020-04-25/False?chart=client  -> views.draw_graph'''
+        url = '/chart/nations/AF-AL/cases/False/False/2020-04-24/2020-04-25/False.json'
+        with self.app.test_client() as client:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'application/json')
+            self.assertFalse(response.get_etag()[1])
+            data = json.loads(response.data.decode('utf8'))
+            self.assertEqual(data['x'], ['2020-04-24', '2020-04-25'])
+            self.assertEqual(len(data['lines']), 2)
+            self.assertIsNone(data['lines2'])
+            for line in data['lines']:
+                self.assertEqual(len(line['y']), len(data['x']))
+                self.assertEqual(line['ltype'], '-')
+            self.assertEqual(data['lines'][0], {'label': 'cases of Afghanistan', 'ltype': '-', 'y': [105, 175]})
+            self.assertEqual(data['num_colors'], 2)
+            response = client.get(url.replace('/cases/', '/cases-\N{Greek Capital Letter Delta}cases_day/'))
+            data = json.loads(response.data.decode('utf8'))
+            self.assertEqual(data['lines2'][0]['y'], [None, -35])                   # null where there are no data
+            response = client.get('/graph/nations/AF-AL/cases/False/False/2020-04-24/2020-04-25/False?chart=client')
+            html = response.data.decode('utf8')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('data-chart-url="{}"'.format(url), html)
+            self.assertIn('data-chart-error="The chart is not available"', html)      # translated by the page
+            self.assertIn('js/chart.js', html)
+            self.assertIn('chart=server', html)                                        # link to the other mode
+
     def test_query_patterns(self):
         # 1. test canonical nations
         ndf = views.query_patterns(self.df, 'nations', 'BY-RU', date(2020, 3, 1), date(2020, 3, 31))
@@ -402,7 +707,43 @@ class ViewsTest(unittest.TestCase):
         ndf = views.query_patterns(self.df, 'continents', 'Europe-Big_Russia', date(2020, 3, 1), date(2020, 3, 31))
         self.assertEqual(ndf.shape, (4,11))
         models.GeoEntities.del_entity('Big_Russia')
+        # 5. areas and continents are materialised in the cube: the same rows, without building them
+        cube = models.Cube(self.df, 'popData2019')
+        for context, ids in (('nations', 'EU-RU'), ('continents', 'Europe-Africa')):
+            ndf = views.query_patterns(self.df, context, ids, date(2020, 3, 1), date(2020, 4, 30))
+            cdf = views.query_patterns(self.df, context, ids, date(2020, 3, 1), date(2020, 4, 30), cube=cube)
+            pd.testing.assert_frame_equal(cdf.groupby('countriesAndTerritories')[['cases', 'deaths']].sum(),
+                                          ndf.groupby('countriesAndTerritories')[['cases', 'deaths']].sum(), check_dtype=False)
         
+    def test_lru_cache(self):
+        cache = views.LRUCache(100)
+        self.assertTrue(cache.put('a', 'A', size=40))
+        self.assertTrue(cache.put('b', 'B', size=40))
+        self.assertEqual(cache.get('a'), 'A')                      # now 'b' is the least recently used ...
+        self.assertTrue(cache.put('c', 'C', size=40))              # ... so it is dropped
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 'C')
+        self.assertFalse(cache.put('d', 'D', size=101))            # too big to be stored
+        self.assertEqual(cache.stats(), {'items': 2, 'bytes': 80, 'hits': 2, 'misses': 1})
+        cache.resize(50)                                           # a lower limit drops the least recently used
+        self.assertEqual(cache.stats()['items'], 1)
+        self.assertEqual(cache.get('c'), 'C')
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_payload_size(self):
+        self.assertEqual(views.payload_size('\N{Greek Capital Letter Delta}x'), 3)    # utf-8 bytes
+        self.assertEqual(views.payload_size(b'abc'), 3)
+        self.assertEqual(views.payload_size({'t': 'x'*1000, 'l': ['a'*500, 'b'*500]}), 2002)   # items are counted
+
+    def test_svg_element(self):
+        svg = ('<?xml version="1.0" encoding="utf-8" standalone="no"?>\n'
+               '<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN"\n  "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n'
+               '<svg viewBox="0 0 10 10"><g><path d="M 0 0"/></g></svg>\n')
+        self.assertEqual(views.svg_element(svg), '<svg viewBox="0 0 10 10"><g><path d="M 0 0"/></g></svg>')
+        with self.assertRaises(ValueError):
+            views.svg_element('<html></html>')
+
     def test_table_nations(self):
         ndf = views.query_patterns(self.df, 'nations', 'AF-AL')
         columns = ['cases']
@@ -418,6 +759,51 @@ class ViewsTest(unittest.TestCase):
         html_table = views.table_last_values(ndf, country_names, columns)
         self.assertTrue(html_table.startswith('<table '))
         self.assertTrue(html_table.endswith('</table>'))
+        ndf = views.query_patterns(self.df, 'nations', 'AF-AT')                   # Austria has no data in the last day ...
+        html_table = views.table_last_values(ndf, ['Afghanistan', 'Austria'], columns)
+        self.assertRegex(html_table, r'<th>Afghanistan</th>\s*<td>175</td>')
+        self.assertRegex(html_table, r'<th>Austria</th>\s*<td>100</td>')           # ... so it shows its last total
+
+    def test_lazy_result(self):
+        cube = models.Cube(self.df, 'popData2019')
+        ids = ['AF', 'AL', 'AT', 'EU']
+        columns = ['cases', 'deaths', 'cases/day', '\N{Greek Capital Letter Delta}cases/day']
+        for first, remember in ((None, False), (date(2020, 3, 26), False), (date(2020, 4, 25), True)):   # all, mid-series, last day
+            ndf = models.add_cols(cube.rows(ids, first, remember=remember), columns[2:])
+            ndf = models.subset_cols(ndf, ['dateRep', 'countriesAndTerritories'] + columns)
+            result = views.QueryResult(ndf, columns)
+            sliced = views.QueryResult(ndf, columns, cube=cube, ids=ids, first=first, remember=remember)
+            pd.testing.assert_frame_equal(sliced.last_values, result.last_values, check_dtype=False)   # from the running totals
+            lazy = views.LazyResult(cube, ids, columns, first, remember=remember)      # without rows, the same tables
+            self.assertEqual(views.table_nations(None, lazy.names, columns, result=lazy),
+                             views.table_nations(ndf, lazy.names, columns, result=result))
+            self.assertEqual(views.table_last_values(None, lazy.names, columns, result=lazy),
+                             views.table_last_values(ndf, lazy.names, columns, result=result))
+            lines = list(views.figure_lines(lazy, 'cases', lazy.names + ['Goofy']))
+            self.assertEqual([country for country, x, y in lines], lazy.names + ['Goofy'])
+            self.assertIsNone(lines[-1][2])                                          # a missing country
+            for column in columns:                                                   # the same lines of chart, a delta
+                chart = result.chart.reindex(columns=pd.MultiIndex.from_product([[column], lazy.names]))   # without previous day is nan
+                for country, x, y in views.figure_lines(lazy, column, lazy.names):
+                    np.testing.assert_array_equal(np.asarray(y, dtype=np.float64),
+                                                  chart[(column, country)].reindex(x).values)
+            self.assertIs(lazy.weekly, lazy.weekly)                                  # parts are computed once
+        empty = views.LazyResult(cube, ids, columns, date(2020, 4, 1), date(2020, 4, 20))   # no data in time interval
+        self.assertTrue(empty.weekly.empty)
+        self.assertTrue(empty.last_values.empty)
+
+    def test_query_result(self):
+        ndf = models.subset_cols(views.query_patterns(self.df, 'nations', 'AF-AT'), ['dateRep', 'countriesAndTerritories', 'cases'])
+        result = views.QueryResult(ndf, ['cases'])
+        self.assertIs(result.chart, result.cumulative)                             # without normalize the chart is the cumulative pivot
+        self.assertIs(result.daily, result.daily)                                  # parts are computed once ...
+        self.assertEqual(result.cumulative[('cases', 'Austria')].max(), 100)
+        self.assertEqual(result.daily[('cases', 'Austria')].max(), 100)            # ... and cumulating does not modify the shared daily pivot
+        self.assertEqual(result.last_values.loc['Afghanistan', 'cases'], 175)
+        html_table = views.table_last_values(ndf, ['Afghanistan', 'Austria'], ['cases'], result=result)
+        self.assertEqual(html_table, views.table_last_values(ndf, ['Afghanistan', 'Austria'], ['cases']))
+        html_table = views.table_nations(ndf, ['Afghanistan', 'Austria'], ['cases'], result=result)
+        self.assertEqual(html_table, views.table_nations(ndf, ['Afghanistan', 'Austria'], ['cases']))
 
 
     #def test_nothing(self):
@@ -426,6 +812,41 @@ class ViewsTest(unittest.TestCase):
     #    self.df = pd.DataFrame(utd.d)
     #    print(self.df.head(6))
 
+class RenderTest(unittest.TestCase):
+    '''testing render'''
+    
+    def setUp(self):
+        self.spec = {'lines': [(np.arange(3), np.array([1., 2., 4.]), '-', 'cases of Goofyland')],
+                     'lines2': None, 'num_colors': 1, 'xlabelrot': 80,
+                     'title': 'title', 'ylabel': 'y', 'y2label': 'y2', 'xlabel': 'x', }
+        
+    def test_draw_chart(self):
+        svg = render.draw_chart(self.spec, 'svg')
+        self.assertIn('<svg ', svg)
+        self.assertTrue(render.draw_chart(self.spec, 'png').startswith(b'\x89PNG'))
+        self.spec['lines2'] = [(np.arange(3), np.array([1., -1., 2.]), '-', 'delta')]   # with the axes of delta fields
+        self.assertIn('<svg ', render.draw_chart(self.spec, 'svg'))
+        
+    def test_render_pool(self):
+        self.assertIn('<svg ', render.RenderPool(processes=0).draw(self.spec))      # in this process
+        pool = render.RenderPool(processes=1, timeout=60, queue=0)
+        with self.assertRaises(render.Busy):                                         # queue is full
+            pool.draw(self.spec)
+        pool.configure(1, 60, 2)
+        try:
+            svg = pool.draw(self.spec)                                               # in a worker process
+            pool.configure(1, 0.001, 2)
+            with self.assertRaises(render.Busy):                                     # out of time ...
+                pool.draw({**self.spec, 'lines': self.spec['lines'] * 200})
+            deadline = time.monotonic() + 60
+            while pool.pending > 0 and time.monotonic() < deadline:                  # ... it is pending until it is drawn
+                time.sleep(0.05)
+        finally:
+            pool.shutdown()
+        self.assertEqual(pool.pending, 0)                                            # nothing is leaked, warm up included
+        self.assertIn('<svg ', svg)
+
+
 #sys.path.append('..')
 #from covid.forms import TimeRange, SelForm, SelectForm, OtherSelectForm
 class FormsTest(unittest.TestCase):
@@ -491,6 +912,7 @@ if __name__ == '__main__':
     from covid import models
     from covid import forms
     from covid import views
+    from covid import render
     import utd
     unittest.main()
     